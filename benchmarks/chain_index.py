@@ -0,0 +1,83 @@
+# Сравнение nx.all_simple_paths и DialogChainIndex на синтетических графах диалога.
+# Запуск: python -m benchmarks.chain_index --max-depth 10 --max-answers 4
+import argparse
+import random
+import time
+
+import networkx as nx
+
+from lib.llm.generator import DialogChainIndex, get_bfs_order, get_prev_dialog_chains
+
+
+def make_dialog_graph(depth, answers, seed=0):
+    # Слои шириной answers, из каждой вершины от 1 до answers рёбер в следующий слой:
+    # ветки сходятся, и число путей растёт как answers ** depth
+    rnd = random.Random(seed)
+    dialog_graph = nx.DiGraph()
+    layers = [[0]]
+    node_id = 1
+    for _ in range(depth - 1):
+        layers.append(list(range(node_id, node_id + answers)))
+        node_id += answers
+    for layer in layers:
+        for node in layer:
+            dialog_graph.add_node(node, line=f"Реплика NPC {node}", info=f"Тематика {node}", mood="нейтральный")
+    for layer, next_layer in zip(layers, layers[1:]):
+        for node in layer:
+            for next_node in rnd.sample(next_layer, rnd.randint(1, answers)):
+                dialog_graph.add_edge(node, next_node, line=f"Ответ игрока {node}->{next_node}", mood="нейтральный")
+        for next_node in next_layer:
+            if not dialog_graph.in_degree(next_node):
+                dialog_graph.add_edge(rnd.choice(layer), next_node, line=f"Ответ игрока -> {next_node}", mood="нейтральный")
+    return dialog_graph
+
+
+def count_paths(dialog_graph):
+    paths = {node: 0 for node in dialog_graph.nodes}
+    paths[0] = 1
+    for node in nx.topological_sort(dialog_graph):
+        for next_node in dialog_graph.adj[node]:
+            paths[next_node] += paths[node]
+    return sum(paths.values())
+
+
+def run_all_simple_paths(dialog_graph, order):
+    return [get_prev_dialog_chains(dialog_graph, node) for node in order]
+
+
+def run_chain_index(dialog_graph, order):
+    chain_index = DialogChainIndex(dialog_graph)
+    return [chain_index.get_chains(node) for node in order]
+
+
+def measure(func, dialog_graph, order):
+    start = time.perf_counter()
+    result = func(dialog_graph, order)
+    return time.perf_counter() - start, result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--max-depth", type=int, default=10)
+    parser.add_argument("--max-answers", type=int, default=4)
+    parser.add_argument("--max-paths", type=int, default=200000, help="не запускать all_simple_paths на графах с большим числом путей")
+    args = parser.parse_args()
+
+    print(f"{'depth':>5} {'answers':>7} {'nodes':>5} {'paths':>9} {'all_simple_paths, s':>20} {'chain index, s':>15} {'speedup':>8}")
+    for depth in range(2, args.max_depth + 1):
+        for answers in range(1, args.max_answers + 1):
+            dialog_graph = make_dialog_graph(depth, answers, seed=depth * 100 + answers)
+            order = get_bfs_order(dialog_graph)
+            paths = count_paths(dialog_graph)
+            index_time, index_chains = measure(run_chain_index, dialog_graph, order)
+            if paths > args.max_paths:
+                print(f"{depth:>5} {answers:>7} {len(dialog_graph):>5} {paths:>9} {'-':>20} {index_time:>15.4f} {'-':>8}")
+                continue
+            old_time, old_chains = measure(run_all_simple_paths, dialog_graph, order)
+            if old_chains != index_chains:
+                raise AssertionError(f"Chains differ for depth={depth}, answers={answers}")
+            print(f"{depth:>5} {answers:>7} {len(dialog_graph):>5} {paths:>9} {old_time:>20.4f} {index_time:>15.4f} {old_time / index_time:>8.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,198 @@
+# Сквозной прогон Orchestrator.create_dialog на локальной заглушке LLM (benchmarks.llm_stub).
+# Для каждой пары mx_depth/mx_answers_cnt меряет время генерации, число вызовов LLM по этапам,
+# процессорное время в графовых утилитах и пиковую память (tracemalloc, отдельным прогоном).
+# Запуск: python -m benchmarks.generation --depths 3,5,7 --answers 2,3 --repeats 3 --latency-mean 0.05
+import argparse
+import contextlib
+import dataclasses
+import functools
+import json
+import os
+import statistics
+import threading
+import time
+import tracemalloc
+
+from benchmarks.llm_stub import add_stub_arguments, make_stub
+
+# Настройки читаются при первом обращении, поэтому окружение задаётся до импорта генератора
+os.environ["LLM_CACHE_STAGES"] = ""
+os.environ["LLM_ARTIFACTS_ENABLED"] = "false"
+
+import lib.llm.generator as generator
+from lib.llm.client import STAGES, LLMClient, LLMConfig
+from lib.llm.instrumentation import PipelineMetrics
+from lib.models.schemas import Params
+
+
+GRAPH_UTILITIES = (
+    (generator, "graph_to_JSON"),
+    (generator, "JSON_to_graph"),
+    (generator, "get_prev_dialog_chains"),
+    (generator, "get_bfs_order"),
+    (generator, "get_content_dependencies"),
+    (generator.DialogChainIndex, "__init__"),
+    (generator.DialogChainIndex, "get_chains"),
+    (generator.DialogValidator, "validate_structure_alg"),
+)
+
+
+class GraphTimer:
+    # Процессорное время потока внутри графовых утилит, суммарно по всем потокам генерации.
+    # Вложенные вызовы (get_chains -> get_prev_dialog_chains) считаются один раз
+    def __init__(self):
+        self.cpu_time = 0.0
+        self.calls = 0
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def wrap(self, func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            depth = getattr(self._local, "depth", 0)
+            self._local.depth = depth + 1
+            start_time = time.thread_time()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self._local.depth = depth
+                if depth == 0:
+                    elapsed = time.thread_time() - start_time
+                    with self._lock:
+                        self.cpu_time += elapsed
+                        self.calls += 1
+        return wrapper
+
+    def install(self):
+        originals = []
+        for owner, name in GRAPH_UTILITIES:
+            func = getattr(owner, name)
+            originals.append((owner, name, func))
+            setattr(owner, name, self.wrap(func))
+        return originals
+
+    def reset(self):
+        with self._lock:
+            self.cpu_time = 0.0
+            self.calls = 0
+
+
+def make_params(depth, answers):
+    character = {"name": "Марта", "profession": "Библиотекарь", "talk_style": "Сдержанный", "traits": "Внимательная", "look": "Очки", "extra": ""}
+    hero = {"name": "Игрок", "profession": "Студент", "talk_style": "Прямой", "traits": "Любопытный", "look": "Рюкзак", "extra": ""}
+    return Params(
+        npc=character,
+        hero=hero,
+        world_settings="Университетский кампус",
+        NPC_to_hero_relation="Нейтральное",
+        hero_to_NPC_relation="Уважительное",
+        mx_answers_cnt=answers,
+        mn_answers_cnt=min(2, answers),
+        mx_depth=depth,
+        mn_depth=max(1, depth - 2),
+        scene="Библиотека вечером",
+        genre="Драма",
+        epoch="Современность",
+        tonality="Спокойная",
+        extra="",
+        context="",
+        goals=[{"type": "item", "object": "Бейдж", "condition": "Убедить NPC"}],
+        game_id="bench",
+        scene_id="bench",
+        script_id="bench"
+    ).dict()
+
+
+def run_once(params, graph_timer):
+    metrics = PipelineMetrics()
+    graph_timer.reset()
+    start_time = time.perf_counter()
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        dialogue = generator.Orchestrator(params, metrics=metrics).create_dialog()
+    latency = time.perf_counter() - start_time
+    summary = metrics.summary()
+    return {
+        "latency": latency,
+        "nodes": len(dialogue["data"]),
+        "llm_calls": summary["total"]["llm_calls"],
+        "retries": summary["total"]["retries"],
+        "tokens": summary["total"]["prompt_tokens"] + summary["total"]["completion_tokens"],
+        "stage_calls": {stage: stats["llm_calls"] for stage, stats in summary["stages"].items()},
+        "graph_cpu": graph_timer.cpu_time,
+        "graph_calls": graph_timer.calls
+    }
+
+
+def measure_peak_memory(params, graph_timer):
+    tracemalloc.start()
+    try:
+        run_once(params, graph_timer)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--depths", default="3,5,7", help="значения mx_depth через запятую")
+    parser.add_argument("--answers", default="2,3", help="значения mx_answers_cnt через запятую")
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--concurrency", type=int, default=None, help="DIALOGUE_GENERATION_CONCURRENCY, по умолчанию из окружения")
+    parser.add_argument("--requests-per-minute", type=int, default=0, help="LLM_REQUESTS_PER_MINUTE для governor, 0 - без ограничения")
+    parser.add_argument("--no-memory", action="store_true", help="не делать прогон с tracemalloc")
+    parser.add_argument("--json", help="сохранить результаты в файл")
+    add_stub_arguments(parser)
+    args = parser.parse_args()
+
+    os.environ["LLM_REQUESTS_PER_MINUTE"] = str(args.requests_per_minute)
+    stub = make_stub(args).start()
+    config = LLMConfig.from_env()
+    config = dataclasses.replace(
+        config,
+        api_key="stub",
+        base_url=stub.base_url,
+        models={stage: f"stub-{stage}" for stage in STAGES},
+        dialogue_generation_concurrency=args.concurrency or config.dialogue_generation_concurrency
+    )
+    LLMClient.configure(config)
+    graph_timer = GraphTimer()
+    graph_timer.install()
+
+    results = []
+    print(f"{'depth':>5} {'answers':>7} {'nodes':>5} {'latency, s':>11} {'p_max, s':>9} {'calls':>6} {'retries':>7} {'graph cpu, ms':>14} {'peak, MB':>9}")
+    try:
+        for depth in [int(value) for value in args.depths.split(",")]:
+            for answers in [int(value) for value in args.answers.split(",")]:
+                params = make_params(depth, answers)
+                runs = [run_once(dict(params), graph_timer) for _ in range(args.repeats)]
+                peak = None if args.no_memory else measure_peak_memory(dict(params), graph_timer)
+                latencies = [run["latency"] for run in runs]
+                row = {
+                    "depth": depth,
+                    "answers": answers,
+                    "nodes": runs[-1]["nodes"],
+                    "latency_median": statistics.median(latencies),
+                    "latency_max": max(latencies),
+                    "llm_calls": statistics.median(run["llm_calls"] for run in runs),
+                    "retries": sum(run["retries"] for run in runs),
+                    "tokens": statistics.median(run["tokens"] for run in runs),
+                    "stage_calls": runs[-1]["stage_calls"],
+                    "graph_cpu_median": statistics.median(run["graph_cpu"] for run in runs),
+                    "graph_calls": runs[-1]["graph_calls"],
+                    "peak_memory": peak
+                }
+                results.append(row)
+                peak_text = "-" if peak is None else f"{peak / 1024 / 1024:.1f}"
+                print(f"{depth:>5} {answers:>7} {row['nodes']:>5} {row['latency_median']:>11.3f} {row['latency_max']:>9.3f} {row['llm_calls']:>6} {row['retries']:>7} {row['graph_cpu_median'] * 1000:>14.1f} {peak_text:>9}")
+                print("      calls by stage: " + ", ".join(f"{stage}={calls}" for stage, calls in row["stage_calls"].items()))
+    finally:
+        stub.stop()
+        LLMClient.close()
+    print(f"stub: {stub.stats}")
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as file:
+            json.dump({"args": vars(args), "results": results}, file, ensure_ascii=False, indent=4)
+
+
+if __name__ == "__main__":
+    main()
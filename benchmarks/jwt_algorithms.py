@@ -0,0 +1,77 @@
+# Стоимость подписи и проверки access-токена по алгоритмам, чтобы выбирать ключ для JWTKeys по данным:
+#   RS256 pem  - RS256 с разбором PEM на каждый вызов (так работала python-jose)
+#   RS256, PS256, ES256, EdDSA - разобранные объекты ключей, как в JWTKeys
+# Для каждого алгоритма - p50/p99 подписи и проверки в микросекундах и длина токена (уходит в каждом запросе).
+# Ключи генерируются на время прогона, payload - как у create_access_token.
+# Запуск: python -m benchmarks.jwt_algorithms --repeats 2000
+import argparse
+import statistics
+import time
+from datetime import datetime, timedelta
+
+import jwt
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import ec, ed25519, rsa
+
+from lib.auth.keys import make_kid
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * q))]
+
+
+def to_pem(private_key):
+    private_pem = private_key.private_bytes(
+        serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8, serialization.NoEncryption()
+    )
+    public_pem = private_key.public_key().public_bytes(serialization.Encoding.PEM, serialization.PublicFormat.SubjectPublicKeyInfo)
+    return private_pem.decode(), public_pem.decode()
+
+
+def make_cases(rsa_bits):
+    rsa_key = rsa.generate_private_key(public_exponent=65537, key_size=rsa_bits)
+    ec_key = ec.generate_private_key(ec.SECP256R1())
+    ed_key = ed25519.Ed25519PrivateKey.generate()
+    return (
+        ("RS256 pem", "RS256", *to_pem(rsa_key), rsa_key),
+        ("RS256", "RS256", rsa_key, rsa_key.public_key(), rsa_key),
+        ("PS256", "PS256", rsa_key, rsa_key.public_key(), rsa_key),
+        ("ES256", "ES256", ec_key, ec_key.public_key(), ec_key),
+        ("EdDSA", "EdDSA", ed_key, ed_key.public_key(), ed_key),
+    )
+
+
+def measure(call, repeats):
+    times = []
+    for _ in range(repeats):
+        start_time = time.perf_counter()
+        call()
+        times.append(time.perf_counter() - start_time)
+    return times
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeats", type=int, default=2000)
+    parser.add_argument("--rsa-bits", type=int, default=2048)
+    args = parser.parse_args()
+
+    payload = {
+        "id": 123, "mail": "user@example.com", "name": "Иван", "surname": "Петров",
+        "exp": datetime.utcnow() + timedelta(minutes=60)
+    }
+    print(f"{'algorithm':10} {'sign p50':>9} {'sign p99':>9} {'verify p50':>11} {'verify p99':>11} {'bytes':>6}   (us)")
+    for name, algorithm, signing_key, verify_key, private_key in make_cases(args.rsa_bits):
+        headers = {"kid": make_kid(private_key.public_key())}
+        token = jwt.encode(payload, signing_key, algorithm=algorithm, headers=headers)
+        sign_times = measure(lambda: jwt.encode(payload, signing_key, algorithm=algorithm, headers=headers), args.repeats)
+        verify_times = measure(lambda: jwt.decode(token, verify_key, algorithms=[algorithm]), args.repeats)
+        print(
+            f"{name:10} {statistics.median(sign_times) * 1e6:9.1f} {percentile(sign_times, 0.99) * 1e6:9.1f} "
+            f"{statistics.median(verify_times) * 1e6:11.1f} {percentile(verify_times, 0.99) * 1e6:11.1f} {len(token):6}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,235 @@
+# Локальная замена DeepSeek для нагрузочных прогонов без трат на API.
+# OpenAI-совместимая ручка /chat/completions отвечает по этапу, который берётся из имени модели:
+# MODEL_TYPE_<STAGE>=stub-<stage>, например MODEL_TYPE_STRUCTURE_GENERATION=stub-structure_generation.
+# Содержимое ответа детерминировано (зависит только от промпта и --seed), задержки и отказы - от --seed.
+# Запуск: python -m benchmarks.llm_stub --port 8099 --latency lognormal --latency-mean 0.5 --error-rate 0.05
+import argparse
+import hashlib
+import json
+import math
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+def get_prompt_random(prompt, seed):
+    digest = hashlib.sha256(f"{seed}:{prompt}".encode("utf-8")).digest()
+    return random.Random(int.from_bytes(digest[:8], "big"))
+
+
+def get_range(prompt, pattern, default):
+    match = re.search(pattern, prompt)
+    if not match:
+        return default
+    return int(match.group(1)), int(match.group(2))
+
+
+def make_structure(prompt, rnd):
+    # Граф слоями, как в benchmarks.chain_index: ширина слоя - максимум ответов,
+    # из каждой C-вершины от mn до mx рёбер в следующий слой, последний слой - P-вершины
+    mn_answers, mx_answers = get_range(prompt, r"от (\d+) до (\d+) вариантов ответа", (2, 3))
+    mn_depth, mx_depth = get_range(prompt, r"в диапазоне от (\d+) до (\d+)", (3, 5))
+    mx_answers = max(1, mx_answers)
+    mn_answers = max(1, min(mn_answers, mx_answers))
+    layers = [[0]]
+    node_id = 1
+    for _ in range(max(1, mx_depth) - 1):
+        layers.append(list(range(node_id, node_id + mx_answers)))
+        node_id += mx_answers
+    edges = {node: [] for layer in layers for node in layer}
+    for layer, next_layer in zip(layers, layers[1:]):
+        for node in layer:
+            edges[node] = sorted(rnd.sample(next_layer, rnd.randint(mn_answers, mx_answers)))
+        for next_node in next_layer:
+            if not any(next_node in edges[node] for node in layer):
+                edges[rnd.choice(layer)].append(next_node)
+    data = []
+    for layer in layers:
+        for node in layer:
+            children = edges[node]
+            data.append({
+                "id": node,
+                "info": f"Тематика {node}",
+                "type": "P" if not children else "M" if len(children) == 1 else "C",
+                "mood": "нейтральный",
+                "goal_achieved": {"item": "", "info": ""},
+                "to": [{"id": child, "mood": "нейтральный"} for child in children]
+            })
+    return {"data": data}
+
+
+def make_lines(prompt, rnd):
+    match = re.search(r"\{'tematics': \[(.*?)\]\}", prompt, re.S)
+    tematic_ids = re.findall(r"'id': (\d+)", match.group(1)) if match else []
+    return {"lines": [
+        {"id": int(tematic_id), "line": f"Ответ игрока {tematic_id}-{rnd.randrange(10 ** 6)}", "info": f"Переход к тематике {tematic_id}"}
+        for tematic_id in tematic_ids
+    ]}
+
+
+def make_metrics(rnd, low_rate_probability):
+    rate = 5 if rnd.random() < low_rate_probability else rnd.choice((8, 9, 10))
+    return {"metrics": {
+        name: {"rate": rate, "comment": "" if rate > 6 else f"Замечание по проверке «{name}»"}
+        for name in ("Соответствие персонажу", "Связность", "Соответствие миру")
+    }}
+
+
+def make_content(stage, prompt, json_mode, seed, low_rate_probability):
+    rnd = get_prompt_random(prompt, seed)
+    if stage in ("structure_generation", "structure_regeneration"):
+        return json.dumps(make_structure(prompt, rnd), ensure_ascii=False)
+    if stage in ("structure_validation", "dialogue_validation"):
+        return json.dumps(make_metrics(rnd, low_rate_probability), ensure_ascii=False)
+    if json_mode:
+        return json.dumps(make_lines(prompt, rnd), ensure_ascii=False)
+    return f"Реплика NPC {rnd.randrange(10 ** 6)}"
+
+
+class LLMStub:
+    def __init__(self, host="127.0.0.1", port=0, seed=0, latency="fixed", latency_mean=0.0, latency_spread=0.0,
+                 error_rate=0.0, rate_limit_rate=0.0, low_rate_probability=0.0):
+        self.seed = seed
+        self.latency = latency
+        self.latency_mean = latency_mean
+        self.latency_spread = latency_spread
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.low_rate_probability = low_rate_probability
+        self.stats = {"requests": 0, "errors": 0, "rate_limited": 0}
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.server = ThreadingHTTPServer((host, port), self.make_handler())
+        self.server.daemon_threads = True
+        self.thread = None
+
+    @property
+    def base_url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def get_delay(self):
+        with self._lock:
+            if self.latency == "uniform":
+                return max(0.0, self._random.uniform(self.latency_mean - self.latency_spread, self.latency_mean + self.latency_spread))
+            if self.latency == "lognormal" and self.latency_mean > 0:
+                # latency_mean - медиана, latency_spread - sigma логарифма: длинный хвост, как у настоящего API
+                return self._random.lognormvariate(math.log(self.latency_mean), self.latency_spread)
+            return self.latency_mean
+
+    def get_failure(self):
+        with self._lock:
+            self.stats["requests"] += 1
+            value = self._random.random()
+            if value < self.rate_limit_rate:
+                self.stats["rate_limited"] += 1
+                return 429
+            if value < self.rate_limit_rate + self.error_rate:
+                self.stats["errors"] += 1
+                return 500
+            return None
+
+    def make_handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            # заголовки и тело пишутся отдельно, без этого keep-alive ждёт delayed ACK ~40 мс
+            disable_nagle_algorithm = True
+
+            def log_message(self, format, *args):
+                pass
+
+            def send_json(self, code, body, headers=None):
+                data = json.dumps(body, ensure_ascii=False).encode("utf-8")
+                self.send_response(code)
+                for key, value in (headers or {}).items():
+                    self.send_header(key, value)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_POST(self):
+                request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+                if not self.path.endswith("/chat/completions"):
+                    self.send_json(404, {"error": {"message": f"Unknown path {self.path}"}})
+                    return
+                time.sleep(stub.get_delay())
+                failure = stub.get_failure()
+                if failure == 429:
+                    self.send_json(429, {"error": {"message": "Rate limit reached", "type": "rate_limit_error"}}, {"retry-after-ms": "200"})
+                    return
+                if failure:
+                    self.send_json(500, {"error": {"message": "Stub internal error", "type": "server_error"}})
+                    return
+                model = request.get("model", "")
+                stage = model[len("stub-"):] if model.startswith("stub-") else model
+                prompt = request["messages"][-1]["content"]
+                json_mode = (request.get("response_format") or {}).get("type") == "json_object"
+                content = make_content(stage, prompt, json_mode, stub.seed, stub.low_rate_probability)
+                prompt_tokens = sum(len(message["content"]) for message in request["messages"]) // 3
+                completion_tokens = len(content) // 3
+                self.send_json(200, {
+                    "id": "stub-" + hashlib.sha1(prompt.encode("utf-8")).hexdigest()[:12],
+                    "object": "chat.completion",
+                    "created": int(time.time()),
+                    "model": model,
+                    "choices": [{"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": content}}],
+                    "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens, "total_tokens": prompt_tokens + completion_tokens}
+                })
+
+        return Handler
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, name="llm-stub", daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def add_stub_arguments(parser):
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--latency", choices=("fixed", "uniform", "lognormal"), default="fixed")
+    parser.add_argument("--latency-mean", type=float, default=0.0, help="секунды; для lognormal - медиана")
+    parser.add_argument("--latency-spread", type=float, default=0.0, help="для uniform - полуширина, для lognormal - sigma")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="доля ответов 500")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="доля ответов 429")
+    parser.add_argument("--low-rate-probability", type=float, default=0.0, help="доля низких оценок валидации, запускает перегенерацию")
+
+
+def make_stub(args, host="127.0.0.1", port=0):
+    return LLMStub(
+        host=host,
+        port=port,
+        seed=args.seed,
+        latency=args.latency,
+        latency_mean=args.latency_mean,
+        latency_spread=args.latency_spread,
+        error_rate=args.error_rate,
+        rate_limit_rate=args.rate_limit_rate,
+        low_rate_probability=args.low_rate_probability
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8099)
+    add_stub_arguments(parser)
+    args = parser.parse_args()
+    stub = make_stub(args, args.host, args.port)
+    print(f"LLM stub on {stub.base_url}, set DEEPSEEK_BASE_URL={stub.base_url} and MODEL_TYPE_<STAGE>=stub-<stage>")
+    try:
+        stub.server.serve_forever()
+    except KeyboardInterrupt:
+        stub.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+# Пропускная способность /login в зависимости от стоимости bcrypt (BCRYPT_ROUNDS) и места, где считается хэш:
+#   threadpool - verify_password в общем пуле потоков Starlette (run_in_threadpool), как было
+#   process    - PasswordHasher: отдельный пул процессов с ограниченной очередью
+# Во время всплеска входов параллельно идут дешёвые вызовы run_in_threadpool - так в приложении ведут себя
+# sync-ручки чтения данных. Их p99 показывает, насколько вход мешает остальным запросам.
+# Запуск: python -m benchmarks.password_hashing --rounds 10,11,12 --logins 64 --concurrency 32
+import argparse
+import asyncio
+import os
+import statistics
+import time
+
+from fastapi.concurrency import run_in_threadpool
+
+from lib.auth.hashing import PasswordHasher
+from lib.auth.utils import hash_password, verify_password
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * q))]
+
+
+async def verify_in_threadpool(plain, hashed):
+    return await run_in_threadpool(verify_password, plain, hashed)
+
+
+async def probe_threadpool(stop, latencies):
+    while not stop.is_set():
+        start_time = time.perf_counter()
+        await run_in_threadpool(time.sleep, 0)
+        latencies.append(time.perf_counter() - start_time)
+        await asyncio.sleep(0.005)
+
+
+async def run_burst(verify, hashed, logins, concurrency):
+    semaphore = asyncio.Semaphore(concurrency)
+    times = []
+
+    async def login():
+        async with semaphore:
+            start_time = time.perf_counter()
+            assert await verify("correct horse battery staple", hashed)
+            times.append(time.perf_counter() - start_time)
+
+    stop = asyncio.Event()
+    probe_latencies = []
+    probe = asyncio.create_task(probe_threadpool(stop, probe_latencies))
+    start_time = time.perf_counter()
+    await asyncio.gather(*(login() for _ in range(logins)))
+    elapsed = time.perf_counter() - start_time
+    stop.set()
+    await probe
+    return logins / elapsed, times, probe_latencies
+
+
+async def main_async(args):
+    if args.workers:
+        os.environ["PASSWORD_HASH_WORKERS"] = str(args.workers)
+    PasswordHasher.init_pool()
+    # очередь не должна отказывать в бенчмарке: меряется скорость, а не отказы
+    PasswordHasher.max_queued = args.logins
+    # прогрев: процессы пула стартуют при первых задачах
+    await asyncio.gather(*(PasswordHasher.verify("x", hash_password("x", 4)) for _ in range(PasswordHasher.workers)))
+
+    print(f"workers: {PasswordHasher.workers}, logins: {args.logins}, concurrency: {args.concurrency}")
+    print(f"{'rounds':>6} {'path':10} {'logins/s':>9} {'p50 ms':>8} {'p99 ms':>8} {'probe p99 ms':>13}")
+    for rounds in args.rounds:
+        hashed = hash_password("correct horse battery staple", rounds)
+        for path, verify in (("threadpool", verify_in_threadpool), ("process", PasswordHasher.verify)):
+            rate, times, probe = await run_burst(verify, hashed, args.logins, args.concurrency)
+            probe_p99 = f"{percentile(probe, 0.99) * 1000:13.2f}" if probe else f"{'-':>13}"
+            print(
+                f"{rounds:6} {path:10} {rate:9.1f} {statistics.median(times) * 1000:8.1f} "
+                f"{percentile(times, 0.99) * 1000:8.1f} {probe_p99}"
+            )
+    PasswordHasher.shutdown()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rounds", type=lambda value: [int(item) for item in value.split(",")], default=[10, 11, 12])
+    parser.add_argument("--logins", type=int, default=64)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--workers", type=int, default=0)
+    args = parser.parse_args()
+    asyncio.run(main_async(args))
+
+
+if __name__ == "__main__":
+    main()
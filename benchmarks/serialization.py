@@ -0,0 +1,137 @@
+# Отдача больших JSON-ответов: документ /users/me/data и граф диалога на кириллице.
+# Сравниваются пути сериализации (p50/p99 на ответ) и байты на проводе без сжатия, с gzip и с br:
+#   default  - драйвер разбирает jsonb в dict, FastAPI: jsonable_encoder + json.dumps (JSONResponse)
+#   orjson   - то же, но ORJSONResponse (jsonable_encoder + orjson.dumps)
+#   raw      - текст jsonb::text из Postgres вставляется в ответ как есть (src.responses.raw_json_response)
+# Текст "из базы" повторяет вывод jsonb::text (разделители ", " и ": "), поэтому raw по байтам чуть больше.
+# Запуск: python -m benchmarks.serialization --repeats 200
+import argparse
+import gzip
+import json
+import random
+import statistics
+import time
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, ORJSONResponse
+
+from src.compression import brotli
+from src.responses import RawJSON, raw_json_response
+
+
+WORDS = (
+    "путник", "стража", "замок", "меч", "старый", "король", "тайна", "деревня", "лес", "дорога",
+    "золото", "помощь", "опасность", "ночь", "трактир", "кузнец", "письмо", "долг", "правда", "ключ"
+)
+MOODS = ("спокойное", "раздражённое", "радостное", "тревожное", "насмешливое")
+
+
+def sentence(rnd, words):
+    return " ".join(rnd.choice(WORDS) for _ in range(words)).capitalize() + "."
+
+
+def make_graph(rnd, nodes, answers):
+    # Как graph_to_JSON: вершины NPC с рёбрами-ответами игрока
+    data = []
+    for node_id in range(nodes):
+        children = [child for child in range(node_id * answers + 1, node_id * answers + answers + 1) if child < nodes]
+        data.append({
+            "id": node_id,
+            "info": sentence(rnd, 8),
+            "type": "C" if children else "P",
+            "mood": rnd.choice(MOODS),
+            "goal_achieved": {"item": rnd.random() < 0.1, "info": rnd.random() < 0.2},
+            "line": sentence(rnd, 25),
+            "to": [{"id": child, "mood": rnd.choice(MOODS), "line": sentence(rnd, 15), "info": sentence(rnd, 6)} for child in children]
+        })
+    return {"data": data}
+
+
+def make_document(rnd, games, scenes, scripts):
+    # Документ пользователя после normalized storage: у сценариев сводка generated, а не граф
+    return {
+        "games": [
+            {
+                "id": f"g{g}", "title": sentence(rnd, 3), "technology_level": "средневековье", "magic": "есть",
+                "description": sentence(rnd, 40),
+                "scenes": [
+                    {
+                        "id": f"s{s}", "title": sentence(rnd, 3), "description": sentence(rnd, 30),
+                        "scripts": [
+                            {
+                                "id": f"d{d}", "title": sentence(rnd, 3), "npc": sentence(rnd, 20), "goal": sentence(rnd, 10),
+                                "generated": {"nodes": 40, "size": 30000, "generated_at": "2025-01-01T12:00:00+00:00"}
+                            }
+                            for d in range(scripts)
+                        ]
+                    }
+                    for s in range(scenes)
+                ]
+            }
+            for g in range(games)
+        ],
+        "selectedGameId": "g0",
+        "user": {"firstName": "Иван", "lastName": "Петров", "email": "", "avatar": ""}
+    }
+
+
+def pg_text(value):
+    # Вывод jsonb::text: ", " и ": " между элементами, кириллица как есть
+    return json.dumps(value, ensure_ascii=False)
+
+
+def render_default(text, key):
+    return JSONResponse(jsonable_encoder({key: json.loads(text)})).body
+
+
+def render_orjson(text, key):
+    return ORJSONResponse(jsonable_encoder({key: json.loads(text)})).body
+
+
+def render_raw(text, key):
+    return raw_json_response({key: RawJSON(text)}).body
+
+
+RENDERERS = (("default", render_default), ("orjson", render_orjson), ("raw", render_raw))
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * q))]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeats", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--gzip-level", type=int, default=6)
+    parser.add_argument("--brotli-quality", type=int, default=5)
+    args = parser.parse_args()
+
+    rnd = random.Random(args.seed)
+    payloads = (
+        ("document 2x3x4", "data", make_document(rnd, 2, 3, 4)),
+        ("document 10x8x6", "data", make_document(rnd, 10, 8, 6)),
+        ("graph 40 nodes", "result", make_graph(rnd, 40, 3)),
+        ("graph 400 nodes", "result", make_graph(rnd, 400, 3)),
+    )
+    print(f"{'payload':18} {'path':8} {'p50 ms':>8} {'p99 ms':>8} {'bytes':>9} {'gzip':>8} {'br':>8}")
+    for name, key, value in payloads:
+        text = pg_text(value)
+        for path, render in RENDERERS:
+            times = []
+            for _ in range(args.repeats):
+                start_time = time.perf_counter()
+                body = render(text, key)
+                times.append(time.perf_counter() - start_time)
+            assert json.loads(body) == {key: value}
+            gzip_size = len(gzip.compress(body, compresslevel=args.gzip_level))
+            br_size = len(brotli.compress(body, quality=args.brotli_quality)) if brotli else "-"
+            print(
+                f"{name:18} {path:8} {statistics.median(times) * 1000:8.3f} {percentile(times, 0.99) * 1000:8.3f} "
+                f"{len(body):9} {gzip_size:8} {br_size:>8}"
+            )
+
+
+if __name__ == "__main__":
+    main()
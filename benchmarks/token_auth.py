@@ -0,0 +1,52 @@
+# Проверка access-токена на защищённом запросе: полная проверка RS256 (decode_token) против кэша
+# проверенных токенов (TokenCache.decode). Запросы идут с тем же набором токенов, что держат клиенты:
+# каждый клиент шлёт свой токен весь его срок. Печатаются p50/p99 на проверку и доля попаданий.
+# Ключи берутся из PRIVATE_SECRET_KEY/PUBLIC_SECRET_KEY, как у приложения.
+# Запуск: python -m benchmarks.token_auth --clients 100 --requests 5000
+import argparse
+import random
+import statistics
+import time
+
+from lib.auth.token_cache import TokenCache
+from lib.auth.utils import create_access_token, decode_token
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * q))]
+
+
+def measure(decode, tokens, requests, rnd):
+    times = []
+    for _ in range(requests):
+        token = rnd.choice(tokens)
+        start_time = time.perf_counter()
+        decode(token)
+        times.append(time.perf_counter() - start_time)
+    return times
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--clients", type=int, default=100)
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    tokens = [
+        create_access_token({"id": user_id, "mail": f"user{user_id}@example.com", "name": "Иван", "surname": "Петров"})
+        for user_id in range(1, args.clients + 1)
+    ]
+    TokenCache.init_cache()
+    print(f"{'path':8} {'p50 us':>8} {'p99 us':>8} {'hit ratio':>10}")
+    for path, decode in (("verify", decode_token), ("cache", TokenCache.decode)):
+        times = measure(decode, tokens, args.requests, random.Random(args.seed))
+        stats = TokenCache.get_stats()
+        lookups = stats["hits"] + stats["misses"]
+        hit_ratio = f"{stats['hits'] / lookups:.3f}" if path == "cache" and lookups else "-"
+        print(f"{path:8} {statistics.median(times) * 1e6:8.1f} {percentile(times, 0.99) * 1e6:8.1f} {hit_ratio:>10}")
+
+
+if __name__ == "__main__":
+    main()
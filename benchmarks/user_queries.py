@@ -0,0 +1,155 @@
+# Запросы к базе на одну операцию Users: как было (SELECT * для проверки пользователя + сама операция)
+# и как сейчас (нужные колонки, проверка и действие одним запросом). Для каждой операции - число запросов,
+# объём полученных строк и медианное время. Пользователь создаётся на время прогона и удаляется после.
+# Запуск: DATABASE_URL=... python -m benchmarks.user_queries --games 5 --scenes 4 --scripts 3 --repeats 50
+import argparse
+import contextlib
+import io
+import json
+import logging
+import os
+import statistics
+import time
+
+import psycopg2
+from psycopg2.extras import RealDictCursor
+
+from db.users_db import USER_PROFILE_COLUMNS, Users, select_columns
+
+
+class CountingCursor(RealDictCursor):
+    # Считает запросы и примерный объём полученных данных (строки в JSON)
+    stats = {"queries": 0, "bytes": 0}
+
+    def execute(self, query, vars=None):
+        CountingCursor.stats["queries"] += 1
+        return super().execute(query, vars)
+
+    def fetchone(self):
+        row = super().fetchone()
+        CountingCursor.stats["bytes"] += len(json.dumps(row, default=str)) if row else 0
+        return row
+
+    def fetchall(self):
+        rows = super().fetchall()
+        CountingCursor.stats["bytes"] += len(json.dumps(rows, default=str))
+        return rows
+
+
+class CountingConnection(psycopg2.extensions.connection):
+    def cursor(self, *args, **kwargs):
+        kwargs["cursor_factory"] = CountingCursor
+        return super().cursor(*args, **kwargs)
+
+
+def make_document(games, scenes, scripts):
+    graph = {"data": [{"id": f"n{i}", "text": "x" * 200} for i in range(30)]}
+    return {
+        "games": [
+            {
+                "id": f"g{g}", "title": f"Game {g}",
+                "scenes": [
+                    {
+                        "id": f"s{s}", "title": f"Scene {s}",
+                        "scripts": [{"id": f"d{d}", "title": f"Script {d}", "result": graph} for d in range(scripts)]
+                    }
+                    for s in range(scenes)
+                ]
+            }
+            for g in range(games)
+        ],
+        "selectedGameId": None,
+        "user": {"firstName": "", "lastName": "", "email": "", "avatar": ""}
+    }
+
+
+# Прежняя реализация: ручка сначала читала пользователя целиком, затем выполняла операцию
+def old_get_data(conn, user_id, mail):
+    with conn.cursor() as curs:
+        curs.execute("SELECT * FROM users_data WHERE id = %s;", (user_id,))
+        curs.fetchone()
+        curs.execute("SELECT data || jsonb_build_object('games', user_games(id)) AS data FROM users_data WHERE id = %s;", (user_id,))
+        curs.fetchone()
+
+
+def old_login_lookup(conn, user_id, mail):
+    with conn.cursor() as curs:
+        curs.execute("SELECT * FROM users_data WHERE mail = %s;", (mail,))
+        curs.fetchone()
+
+
+def old_update_name(conn, user_id, mail):
+    with conn.cursor() as curs:
+        curs.execute("SELECT * FROM users_data WHERE id = %s;", (user_id,))
+        curs.fetchone()
+        curs.execute("UPDATE users_data SET name = %s, surname = %s WHERE id = %s;", ("Bench", "Mark", user_id))
+    conn.commit()
+
+
+def old_get_me(conn, user_id, mail):
+    with conn.cursor() as curs:
+        curs.execute("SELECT * FROM users_data WHERE id = %s;", (user_id,))
+        curs.fetchone()
+
+
+def new_get_me(users, user_id, mail):
+    # GET /users/me читает через AsyncUsers.get_user_by_id (asyncpg), здесь тот же запрос через psycopg2
+    with users.db_conn.cursor() as curs:
+        curs.execute(f"SELECT {select_columns(USER_PROFILE_COLUMNS)} FROM users_data WHERE id = %s AND NOT is_deleted;", (user_id,))
+        curs.fetchone()
+
+
+OPERATIONS = (
+    ("GET /users/me", old_get_me, new_get_me),
+    ("GET /users/me/data", old_get_data, lambda users, user_id, mail: users.get_user_data(user_id)),
+    ("POST /login (lookup)", old_login_lookup, lambda users, user_id, mail: users.get_user_by_mail(mail)),
+    ("PUT /users/me/name", old_update_name, lambda users, user_id, mail: users.update_user_name(user_id, "Bench", "Mark")),
+)
+
+
+def measure(func, repeats):
+    CountingCursor.stats.update(queries=0, bytes=0)
+    times = []
+    # Users печатает и логирует каждую выборку, прежние запросы - нет: в замер это не попадает
+    logging.disable(logging.INFO)
+    with contextlib.redirect_stdout(io.StringIO()):
+        for _ in range(repeats):
+            start_time = time.perf_counter()
+            func()
+            times.append(time.perf_counter() - start_time)
+    logging.disable(logging.NOTSET)
+    return {
+        "queries": CountingCursor.stats["queries"] / repeats,
+        "bytes": CountingCursor.stats["bytes"] / repeats,
+        "median_ms": statistics.median(times) * 1000
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--games", type=int, default=5)
+    parser.add_argument("--scenes", type=int, default=4)
+    parser.add_argument("--scripts", type=int, default=3)
+    parser.add_argument("--repeats", type=int, default=50)
+    args = parser.parse_args()
+
+    conn = psycopg2.connect(os.environ["DATABASE_URL"], connection_factory=CountingConnection)
+    users = Users(conn)
+    mail = f"bench-{time.time_ns()}@example.com"
+    with contextlib.redirect_stdout(io.StringIO()):
+        user_id = users.create_user(mail, "Bench", "User", "x" * 60, data=make_document(args.games, args.scenes, args.scripts))
+    try:
+        print(f"{'operation':24} {'':4} {'queries':>8} {'bytes':>10} {'median ms':>10}")
+        for name, old, new in OPERATIONS:
+            for label, func in (("old", lambda: old(conn, user_id, mail)), ("new", lambda: new(users, user_id, mail))):
+                stats = measure(func, args.repeats)
+                print(f"{name:24} {label:4} {stats['queries']:8.1f} {stats['bytes']:10.0f} {stats['median_ms']:10.2f}")
+    finally:
+        with conn.cursor() as curs:
+            curs.execute("DELETE FROM users_data WHERE id = %s;", (user_id,))
+        conn.commit()
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+import asyncio
+import json
+import logging
+import os
+import time
+from contextlib import asynccontextmanager
+
+import asyncpg
+from dotenv import load_dotenv
+
+from db.database import DB_BUCKETS, DatabasePoolTimeout
+from lib.metrics import Metrics
+
+
+load_dotenv()
+
+
+async def init_connection(conn):
+    # jsonb приходит и уходит как dict/list, как у psycopg2 с RealDictCursor
+    await conn.set_type_codec("jsonb", encoder=json.dumps, decoder=json.loads, schema="pg_catalog")
+    await conn.set_type_codec("json", encoder=json.dumps, decoder=json.loads, schema="pg_catalog")
+
+
+class AsyncDatabasePool:
+    # Пул asyncpg для async-ручек: запрос к базе не занимает поток threadpool, пока ждёт ответа.
+    # Размер отдельный от DatabasePool (ASYNC_MIN_CONN/ASYNC_MAX_CONN), таймаут ожидания общий - DB_POOL_TIMEOUT
+    _pool = None
+
+    @classmethod
+    async def init_pool(cls):
+        cls.dburl = os.getenv('DATABASE_URL')
+        cls.min_conn = int(os.getenv('ASYNC_MIN_CONN', os.getenv('MIN_CONN', 1)))
+        cls.max_conn = int(os.getenv('ASYNC_MAX_CONN', os.getenv('MAX_CONN', 10)))
+        cls.checkout_timeout = float(os.getenv('DB_POOL_TIMEOUT', 10))
+        await cls.connect_pool()
+
+    @classmethod
+    async def connect_pool(cls):
+        try:
+            cls._pool = await asyncpg.create_pool(
+                dsn=cls.dburl,
+                min_size=cls.min_conn,
+                max_size=cls.max_conn,
+                ssl="require",
+                init=init_connection
+            )
+            logging.info(f"Async connection pool to the database is ready: {cls.min_conn}-{cls.max_conn} connections")
+        except Exception as e:
+            logging.error(f"Error connecting to the database (async): {e}")
+            raise
+
+    @classmethod
+    async def get_connection(cls, timeout=None):
+        if not cls._pool:
+            await cls.connect_pool()
+        timeout = cls.checkout_timeout if timeout is None else timeout
+        start_time = time.perf_counter()
+        try:
+            conn = await cls._pool.acquire(timeout=timeout)
+        except asyncio.TimeoutError:
+            Metrics.inc("db_async_pool_timeouts_total", 1, "Async connection checkouts that timed out waiting for the pool")
+            raise DatabasePoolTimeout(f"No free database connection in {timeout} s")
+        Metrics.observe("db_async_pool_wait_seconds", time.perf_counter() - start_time, "Time spent waiting for a free async pool connection", buckets=DB_BUCKETS)
+        return conn
+
+    @classmethod
+    async def put_connection(cls, conn):
+        # release сам откатывает незавершённую транзакцию и сбрасывает состояние соединения
+        try:
+            await cls._pool.release(conn)
+        except Exception as e:
+            logging.error(f"Error returning async connection to the pool: {e}")
+
+    @classmethod
+    @asynccontextmanager
+    async def connection(cls, timeout=None):
+        conn = await cls.get_connection(timeout)
+        try:
+            yield conn
+        finally:
+            await cls.put_connection(conn)
+
+    @classmethod
+    def get_stats(cls):
+        if not cls._pool:
+            return {"max": 0, "in_use": 0, "idle": 0}
+        idle = cls._pool.get_idle_size()
+        return {"max": cls.max_conn, "in_use": cls._pool.get_size() - idle, "idle": idle}
+
+    @classmethod
+    async def close_all(cls):
+        if not cls._pool:
+            return
+        try:
+            await cls._pool.close()
+            logging.info("All async database connections are closed")
+        except Exception as e:
+            logging.error(f"Error closing the async connection pool: {e}")
+        finally:
+            cls._pool = None
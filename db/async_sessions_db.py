@@ -0,0 +1,103 @@
+from db.logging import logger
+
+
+class AsyncSessions:
+    # Сессии refresh-токенов (user_sessions) для async-ручек /login, /refresh, /logout.
+    # Токены приходят уже хэшированными (hash_refresh_token), сроки - в секундах
+    def __init__(self, db_conn):
+        self.db_conn = db_conn
+
+    async def create_session(self, user_id: int, token_hash: bytes, ttl: float):
+        # Заодно удаляются истёкшие и давно отозванные сессии пользователя: таблица не растёт с каждым входом
+        try:
+            session_id = await self.db_conn.fetchval(
+                """
+                WITH cleanup AS (
+                    DELETE FROM user_sessions
+                    WHERE user_id = $1 AND (expires_at < now() OR revoked_at < now() - interval '1 day')
+                )
+                INSERT INTO user_sessions (user_id, token_hash, expires_at)
+                VALUES ($1, $2, now() + make_interval(secs => $3)) RETURNING id;
+                """,
+                user_id, token_hash, float(ttl)
+            )
+            logger.info(f"Session {session_id} created for user {user_id}")
+            return session_id
+        except Exception as e:
+            logger.error(f"Error creating session for user {user_id}: {e}")
+            print(f"Error creating session for user {user_id}: {e}", end="\n\n======\n\n")
+            return None
+
+    async def rotate_session(self, token_hash: bytes, new_token_hash: bytes, ttl: float):
+        # Действующая сессия получает новый токен и продлевается, в ответ - данные пользователя для access-токена.
+        # Один UPDATE: из двух параллельных обновлений одним токеном пройдёт только одно.
+        # dict - сессия обновлена, False - токен неизвестен, истёк, отозван или пользователь удалён, None - ошибка
+        try:
+            row = await self.db_conn.fetchrow(
+                """
+                UPDATE user_sessions s SET token_hash = $2, previous_token_hash = s.token_hash, rotated_at = now(),
+                    expires_at = now() + make_interval(secs => $3)
+                FROM users_data u
+                WHERE s.token_hash = $1 AND s.revoked_at IS NULL AND s.expires_at > now()
+                    AND u.id = s.user_id AND NOT u.is_deleted
+                RETURNING s.id AS session_id, u.id, u.mail, u.name, u.surname;
+                """,
+                token_hash, new_token_hash, float(ttl)
+            )
+            if not row:
+                return False
+            logger.info(f"Session {row['session_id']} rotated for user {row['id']}")
+            return dict(row)
+        except Exception as e:
+            logger.error(f"Error rotating session: {e}")
+            print(f"Error rotating session: {e}", end="\n\n======\n\n")
+            return None
+
+    async def revoke_reused(self, token_hash: bytes, grace: float):
+        # Предъявлен уже заменённый токен. Сразу после ротации это гонка (две вкладки, повтор запроса),
+        # позже - признак кражи: сессия отзывается целиком, вместе с токеном, выданным взамен
+        try:
+            session_id = await self.db_conn.fetchval(
+                """
+                UPDATE user_sessions SET revoked_at = now()
+                WHERE previous_token_hash = $1 AND revoked_at IS NULL AND rotated_at < now() - make_interval(secs => $2)
+                RETURNING id;
+                """,
+                token_hash, float(grace)
+            )
+            if session_id:
+                logger.error(f"Refresh token reused, session {session_id} revoked")
+            return session_id
+        except Exception as e:
+            logger.error(f"Error revoking reused session: {e}")
+            print(f"Error revoking reused session: {e}", end="\n\n======\n\n")
+            return None
+
+    async def revoke_session(self, token_hash: bytes):
+        # True - сессия отозвана, False - токен неизвестен или уже отозван, None - ошибка
+        try:
+            session_id = await self.db_conn.fetchval(
+                "UPDATE user_sessions SET revoked_at = now() WHERE token_hash = $1 AND revoked_at IS NULL RETURNING id;",
+                token_hash
+            )
+            logger.info(f"Session {session_id} revoked")
+            return session_id is not None
+        except Exception as e:
+            logger.error(f"Error revoking session: {e}")
+            print(f"Error revoking session: {e}", end="\n\n======\n\n")
+            return None
+
+    async def revoke_user_sessions(self, user_id: int):
+        # Число отозванных сессий или None при ошибке
+        try:
+            status = await self.db_conn.execute(
+                "UPDATE user_sessions SET revoked_at = now() WHERE user_id = $1 AND revoked_at IS NULL;",
+                user_id
+            )
+            revoked = int(status.split()[-1])
+            logger.info(f"{revoked} sessions of user {user_id} revoked")
+            return revoked
+        except Exception as e:
+            logger.error(f"Error revoking sessions of user {user_id}: {e}")
+            print(f"Error revoking sessions of user {user_id}: {e}", end="\n\n======\n\n")
+            return None
@@ -0,0 +1,74 @@
+from pydantic import EmailStr
+from db.logging import logger
+from db.users_db import USER_LOGIN_COLUMNS, USER_PROFILE_COLUMNS, select_columns
+
+
+class AsyncUsers:
+    # Те же операции чтения, что у Users, для async-ручек (/users/me, /users/me/data, /login).
+    # Соединение - из AsyncDatabasePool, результаты - dict, как у RealDictCursor
+    def __init__(self, db_conn):
+        self.db_conn = db_conn
+
+    async def get_user_by_mail(self, mail: EmailStr, columns=USER_LOGIN_COLUMNS):
+        try:
+            row = await self.db_conn.fetchrow(f"SELECT {select_columns(columns)} FROM users_data WHERE mail = $1 AND NOT is_deleted;", mail)
+            user = dict(row) if row else None
+            logger.info(f"Received user by mail: {mail}")
+            print(f"Received user by mail: {mail}", user, sep = "\n", end="\n\n======\n\n")
+            return user
+        except Exception as e:
+            logger.error(f"Error when receiving user by mail {mail}: {e}")
+            print(f"Error when receiving user by mail {mail}: {e}", end="\n\n======\n\n")
+            return None
+
+    async def get_user_by_id(self, user_id: int, columns=USER_PROFILE_COLUMNS):
+        try:
+            row = await self.db_conn.fetchrow(f"SELECT {select_columns(columns)} FROM users_data WHERE id = $1 AND NOT is_deleted;", user_id)
+            user = dict(row) if row else None
+            logger.info(f"Received user by id: {user_id}")
+            print(f"Received user by id: {user_id}", user, sep = "\n", end="\n\n======\n\n")
+            return user
+        except Exception as e:
+            logger.error(f"Error when receiving user by id {user_id}: {e}")
+            print(f"Error when receiving user by id {user_id}: {e}", end="\n\n======\n\n")
+            return None
+
+    async def get_user_data(self, user_id: int, known_versions=None):
+        # known_versions - версии из If-None-Match: если текущая среди них, data не читается (not_modified).
+        # None - пользователя нет или он удалён, иначе version, not_modified и data - JSON-текст для отдачи как есть
+        try:
+            # games хранятся в таблицах games/scenes/dialogues и собираются в документ при чтении
+            row = await self.db_conn.fetchrow(
+                """
+                SELECT version, COALESCE(version = ANY($2::text[]), false) AS not_modified,
+                    CASE WHEN version = ANY($2::text[]) THEN NULL ELSE (data || jsonb_build_object('games', user_games(id)))::text END AS data
+                FROM (
+                    SELECT id, data, user_data_version(id, version) AS version FROM users_data WHERE id = $1 AND NOT is_deleted
+                ) u;
+                """,
+                user_id, known_versions
+            )
+            result = dict(row) if row else None
+            logger.info(f"Received data for user {user_id}, version {result['version'] if result else None}")
+            print(f"Received data for user: {user_id}", result, sep = "\n", end="\n\n======\n\n")
+            return result
+        except Exception as e:
+            logger.error(f"Error when receiving data for user {user_id}: {e}")
+            print(f"Error when receiving data for user {user_id}: {e}", end="\n\n======\n\n")
+            return None
+
+    async def update_password_hash(self, user_id: int, old_hash: str, new_hash: str):
+        # Пересчёт хэша при входе (новая стоимость bcrypt): пароль тот же, поэтому version документа не меняется.
+        # Условие на старый хэш - чтобы не затереть пароль, сменённый параллельным запросом
+        try:
+            status = await self.db_conn.execute(
+                "UPDATE users_data SET password_hash = $3 WHERE id = $1 AND password_hash = $2 AND NOT is_deleted;",
+                user_id, old_hash, new_hash
+            )
+            updated = status == "UPDATE 1"
+            logger.info(f"Password hash of user {user_id} rehashed: {updated}")
+            return updated
+        except Exception as e:
+            logger.error(f"Error when rehashing password of user {user_id}: {e}")
+            print(f"Error when rehashing password of user {user_id}: {e}", end="\n\n======\n\n")
+            return None
@@ -1,15 +1,23 @@
 import psycopg2
+import threading
+import time
+from contextlib import contextmanager
 from psycopg2.pool import ThreadedConnectionPool
+from psycopg2.extensions import TRANSACTION_STATUS_IDLE
 from psycopg2.extras import RealDictCursor
 import json
 import logging
 import os
 from dotenv import load_dotenv
 from urllib.parse import urlparse
+from lib.metrics import Metrics
 
 
 load_dotenv()
 
+# Ожидание соединения и время его удержания - от миллисекунд до секунд
+DB_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
 
 logging.basicConfig(
     level=logging.INFO,
@@ -17,8 +25,18 @@ logging.basicConfig(
     filename='db.log',
     filemode='a'
 )
+
+
+class DatabasePoolTimeout(Exception):
+    pass
+
+
 class DatabasePool:
     _pool = None
+    _slots = None
+    # id соединения -> время выдачи, только выданные через get_connection
+    _checked_out = {}
+    _lock = threading.Lock()
 
     @classmethod
     def init_pool(cls):
@@ -30,6 +48,8 @@ class DatabasePool:
         cls.port = int(os.getenv('DB_PORT'))
         cls.min_conn = int(os.getenv('MIN_CONN'))
         cls.max_conn = int(os.getenv('MAX_CONN'))
+        # Сколько ждать свободное соединение, прежде чем отказать (503), вместо PoolError сразу
+        cls.checkout_timeout = float(os.getenv('DB_POOL_TIMEOUT', 10))
         cls.connect_pool()
 
     @classmethod
@@ -41,6 +61,8 @@ class DatabasePool:
                 dsn=cls.dburl,
                 sslmode="require"
             )
+            cls._slots = threading.BoundedSemaphore(cls.max_conn)
+            cls._checked_out = {}
             logging.info(f"Connection to the database is successful: {cls.host}:{cls.port}/{cls.dbname}")
         except Exception as e:
             logging.error(f"Error connecting to the database: {e}")
@@ -52,12 +74,74 @@ class DatabasePool:
             cls.connect_pool()
 
     @classmethod
-    def get_connection(cls):
-        return cls._pool.getconn()
-    
+    def get_connection(cls, timeout=None):
+        cls.check_pool()
+        timeout = cls.checkout_timeout if timeout is None else timeout
+        start_time = time.perf_counter()
+        if not cls._slots.acquire(timeout=timeout):
+            Metrics.inc("db_pool_timeouts_total", 1, "Connection checkouts that timed out waiting for the pool")
+            raise DatabasePoolTimeout(f"No free database connection in {timeout} s")
+        Metrics.observe("db_pool_wait_seconds", time.perf_counter() - start_time, "Time spent waiting for a free pool connection", buckets=DB_BUCKETS)
+        try:
+            conn = cls._pool.getconn()
+        except Exception:
+            cls._slots.release()
+            raise
+        with cls._lock:
+            cls._checked_out[id(conn)] = time.perf_counter()
+        return conn
+
     @classmethod
     def put_connection(cls, conn):
-        return cls._pool.putconn(conn)
+        with cls._lock:
+            checked_out = cls._checked_out.pop(id(conn), None)
+        if checked_out is None:
+            # уже возвращено (или пул пересоздан) - второй возврат не должен освободить чужой слот
+            return None
+        try:
+            close = bool(conn.closed)
+            if not close and conn.get_transaction_status() != TRANSACTION_STATUS_IDLE:
+                # незавершённая транзакция не должна достаться следующему запросу
+                try:
+                    conn.rollback()
+                except Exception:
+                    close = True
+            cls._pool.putconn(conn, close=close)
+        except Exception as e:
+            logging.error(f"Error returning connection to the pool: {e}")
+        finally:
+            cls._slots.release()
+        return time.perf_counter() - checked_out
+
+    @classmethod
+    @contextmanager
+    def connection(cls, timeout=None):
+        conn = cls.get_connection(timeout)
+        try:
+            yield conn
+        finally:
+            cls.put_connection(conn)
+
+    @classmethod
+    def get_stats(cls):
+        if not cls._pool:
+            return {"max": 0, "in_use": 0, "idle": 0}
+        with cls._lock:
+            in_use = len(cls._checked_out)
+        return {"max": cls.max_conn, "in_use": in_use, "idle": len(cls._pool._pool)}
+
+    @classmethod
+    def close_all(cls):
+        if not cls._pool:
+            return
+        try:
+            cls._pool.closeall()
+            logging.info("All database connections are closed")
+        except Exception as e:
+            logging.error(f"Error closing the connection pool: {e}")
+        finally:
+            cls._pool = None
+            cls._checked_out = {}
 
 # class Database:
 #     def __init__(self):
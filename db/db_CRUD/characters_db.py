@@ -1,35 +1,41 @@
-from db.database import Database
+from psycopg2.extras import RealDictCursor
 from db.logging import logger
 
+# Колонки, которые можно менять через update_character: имена полей попадают в текст запроса
+CHARACTER_FIELDS = ("dialogue_id", "is_npc", "name", "profession", "goal", "talk_style", "traits", "appearance")
+
+
 class Characters:
-    def __init__(self, db: Database):
-        self.db = db
+    def __init__(self, db_conn):
+        self.db_conn = db_conn
 
     def create_character(self, game_id: int, is_npc: bool, name: str, profession: str, goal: str,
                          talk_style: str, traits: str, appearance: str, dialogue_id: int = None):
         try:
-            self.db.cursor.execute(
-                """
-                INSERT INTO characters (
-                    game_id, dialogue_id, is_npc, name, profession,
-                    goal, talk_style, traits, appearance
-                ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
-                RETURNING id;
-                """,
-                (game_id, dialogue_id, is_npc, name, profession, goal, talk_style, traits, appearance)
-            )
-            character_id = self.db.cursor.fetchone()["id"]
-            self.db.conn.commit()
+            with self.db_conn.cursor(cursor_factory=RealDictCursor) as curs:
+                curs.execute(
+                    """
+                    INSERT INTO characters (
+                        game_id, dialogue_id, is_npc, name, profession,
+                        goal, talk_style, traits, appearance
+                    ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
+                    RETURNING id;
+                    """,
+                    (game_id, dialogue_id, is_npc, name, profession, goal, talk_style, traits, appearance)
+                )
+                character_id = curs.fetchone()["id"]
+            self.db_conn.commit()
             logger.info(f"Character created: {character_id} ({name}) in game {game_id}")
             return character_id
         except Exception as e:
             logger.error(f"Error creating character for game {game_id}: {e}")
-            self.db.conn.rollback()
+            self.db_conn.rollback()
 
     def get_character_by_id(self, character_id: int):
         try:
-            self.db.cursor.execute("SELECT * FROM characters WHERE id = %s;", (character_id,))
-            character = self.db.cursor.fetchone()
+            with self.db_conn.cursor(cursor_factory=RealDictCursor) as curs:
+                curs.execute("SELECT * FROM characters WHERE id = %s;", (character_id,))
+                character = curs.fetchone()
             logger.info(f"Fetched character by id: {character_id}")
             return character
         except Exception as e:
@@ -37,8 +43,9 @@ class Characters:
 
     def get_characters_by_game(self, game_id: int):
         try:
-            self.db.cursor.execute("SELECT * FROM characters WHERE game_id = %s;", (game_id,))
-            characters = self.db.cursor.fetchall()
+            with self.db_conn.cursor(cursor_factory=RealDictCursor) as curs:
+                curs.execute("SELECT * FROM characters WHERE game_id = %s;", (game_id,))
+                characters = curs.fetchall()
             logger.info(f"Fetched {len(characters)} characters for game {game_id}")
             return characters
         except Exception as e:
@@ -46,8 +53,9 @@ class Characters:
 
     def get_characters_by_dialogue(self, dialogue_id: int):
         try:
-            self.db.cursor.execute("SELECT * FROM characters WHERE dialogue_id = %s;", (dialogue_id,))
-            characters = self.db.cursor.fetchall()
+            with self.db_conn.cursor(cursor_factory=RealDictCursor) as curs:
+                curs.execute("SELECT * FROM characters WHERE dialogue_id = %s;", (dialogue_id,))
+                characters = curs.fetchall()
             logger.info(f"Fetched {len(characters)} characters for dialogue {dialogue_id}")
             return characters
         except Exception as e:
@@ -58,25 +66,29 @@ class Characters:
             fields = []
             values = []
             for key, value in kwargs.items():
+                if key not in CHARACTER_FIELDS:
+                    raise ValueError(f"Unknown character field: {key}")
                 fields.append(f"{key} = %s")
                 values.append(value)
             values.append(character_id)
             set_clause = ", ".join(fields)
             query = f"UPDATE characters SET {set_clause} WHERE id = %s;"
-            self.db.cursor.execute(query, tuple(values))
-            self.db.conn.commit()
+            with self.db_conn.cursor() as curs:
+                curs.execute(query, tuple(values))
+            self.db_conn.commit()
             logger.info(f"Updated character {character_id} fields: {list(kwargs.keys())}")
             return True
         except Exception as e:
             logger.error(f"Error updating character {character_id}: {e}")
-            self.db.conn.rollback()
+            self.db_conn.rollback()
 
     def delete_character(self, character_id: int):
         try:
-            self.db.cursor.execute("DELETE FROM characters WHERE id = %s;", (character_id,))
-            self.db.conn.commit()
+            with self.db_conn.cursor() as curs:
+                curs.execute("DELETE FROM characters WHERE id = %s;", (character_id,))
+            self.db_conn.commit()
             logger.info(f"Deleted character {character_id}")
             return True
         except Exception as e:
             logger.error(f"Error deleting character {character_id}: {e}")
-            self.db.conn.rollback()
+            self.db_conn.rollback()
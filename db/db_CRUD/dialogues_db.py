@@ -1,33 +1,41 @@
-from db.database import Database
+from psycopg2.extras import RealDictCursor
 from db.logging import logger
 import json
 
 class Dialogues:
-    def __init__(self, db: Database):
-        self.db = db
+    # Сценарии сцены. Поля сценария - в extra, результат генерации - в generated_dialogues
+    def __init__(self, db_conn):
+        self.db_conn = db_conn
 
-    def create_dialogue(self, scene_id: int, title: str, data):
+    def create_dialogue(self, scene_id: int, title: str, data, external_id: str = None):
         try:
-            self.db.cursor.execute(
-                """
-                INSERT INTO dialogues (scene_id, title, data)
-                VALUES (%s, %s, %s)
-                RETURNING id;
-                """,
-                (scene_id, title, json.dumps(data))
-            )
-            dialogue_id = self.db.cursor.fetchone()["id"]
-            self.db.conn.commit()
+            with self.db_conn.cursor(cursor_factory=RealDictCursor) as curs:
+                curs.execute(
+                    """
+                    INSERT INTO dialogues (scene_id, external_id, position, title, extra)
+                    VALUES (
+                        %(scene_id)s, COALESCE(%(external_id)s, gen_random_uuid()::text),
+                        (SELECT COALESCE(MAX(position) + 1, 0) FROM dialogues WHERE scene_id = %(scene_id)s),
+                        %(title)s, jsonb_strip_nulls(jsonb_build_object('title', %(title)s::text))
+                    )
+                    RETURNING id;
+                    """,
+                    {"scene_id": scene_id, "external_id": external_id, "title": title}
+                )
+                dialogue_id = curs.fetchone()["id"]
+                curs.execute("SELECT save_generated_dialogue(%s, %s::jsonb, true);", (dialogue_id, json.dumps(data)))
+            self.db_conn.commit()
             logger.info(f"Dialogue created: {dialogue_id} in scene {scene_id}")
             return dialogue_id
         except Exception as e:
             logger.error(f"Error creating dialogue for scene {scene_id}: {e}")
-            self.db.conn.rollback()
+            self.db_conn.rollback()
 
     def get_dialogue_by_id(self, dialogue_id: int):
         try:
-            self.db.cursor.execute("SELECT * FROM dialogues WHERE id = %s;", (dialogue_id,))
-            dialogue = self.db.cursor.fetchone()
+            with self.db_conn.cursor(cursor_factory=RealDictCursor) as curs:
+                curs.execute("SELECT * FROM dialogues WHERE id = %s;", (dialogue_id,))
+                dialogue = curs.fetchone()
             logger.info(f"Fetched dialogue by id: {dialogue_id}")
             return dialogue
         except Exception as e:
@@ -35,8 +43,9 @@ class Dialogues:
 
     def get_dialogues_by_scene(self, scene_id: int):
         try:
-            self.db.cursor.execute("SELECT * FROM dialogues WHERE scene_id = %s;", (scene_id,))
-            dialogues = self.db.cursor.fetchall()
+            with self.db_conn.cursor(cursor_factory=RealDictCursor) as curs:
+                curs.execute("SELECT * FROM dialogues WHERE scene_id = %s ORDER BY position, id;", (scene_id,))
+                dialogues = curs.fetchall()
             logger.info(f"Fetched {len(dialogues)} dialogues for scene {scene_id}")
             return dialogues
         except Exception as e:
@@ -44,36 +53,128 @@ class Dialogues:
 
     def update_dialogue_data(self, dialogue_id: int, new_data):
         try:
-            self.db.cursor.execute(
-                "UPDATE dialogues SET data = %s WHERE id = %s;",
-                (json.dumps(new_data), dialogue_id)
-            )
-            self.db.conn.commit()
+            with self.db_conn.cursor() as curs:
+                curs.execute("SELECT save_generated_dialogue(%s, %s::jsonb, true);", (dialogue_id, json.dumps(new_data)))
+            self.db_conn.commit()
             logger.info(f"Updated data of dialogue {dialogue_id}")
             return True
         except Exception as e:
             logger.error(f"Error updating data for dialogue {dialogue_id}: {e}")
-            self.db.conn.rollback()
+            self.db_conn.rollback()
 
     def update_dialogue_title(self, dialogue_id: int, new_title: str):
         try:
-            self.db.cursor.execute(
-                "UPDATE dialogues SET title = %s WHERE id = %s;",
-                (new_title, dialogue_id)
-            )
-            self.db.conn.commit()
+            with self.db_conn.cursor() as curs:
+                curs.execute(
+                    "UPDATE dialogues SET title = %(title)s, extra = extra || jsonb_build_object('title', %(title)s::text) WHERE id = %(id)s;",
+                    {"title": new_title, "id": dialogue_id}
+                )
+            self.db_conn.commit()
             logger.info(f"Updated title of dialogue {dialogue_id} to '{new_title}'")
             return True
         except Exception as e:
             logger.error(f"Error updating title for dialogue {dialogue_id}: {e}")
-            self.db.conn.rollback()
+            self.db_conn.rollback()
 
     def delete_dialogue(self, dialogue_id: int):
         try:
-            self.db.cursor.execute("DELETE FROM dialogues WHERE id = %s;", (dialogue_id,))
-            self.db.conn.commit()
+            with self.db_conn.cursor() as curs:
+                curs.execute("DELETE FROM dialogues WHERE id = %s;", (dialogue_id,))
+            self.db_conn.commit()
             logger.info(f"Deleted dialogue {dialogue_id}")
             return True
         except Exception as e:
             logger.error(f"Error deleting dialogue {dialogue_id}: {e}")
-            self.db.conn.rollback()
+            self.db_conn.rollback()
+
+    def get_user_dialogue(self, user_id: int, game_id: str, scene_id: str, script_id: str):
+        try:
+            with self.db_conn.cursor(cursor_factory=RealDictCursor) as curs:
+                curs.execute(
+                    """
+                    SELECT dialogue_json(d.id)::text AS script
+                    FROM dialogues d
+                    JOIN scenes s ON s.id = d.scene_id
+                    JOIN games g ON g.id = s.game_id
+                    WHERE g.user_id = %s AND g.external_id = %s AND s.external_id = %s AND d.external_id = %s;
+                    """,
+                    (user_id, str(game_id), str(scene_id), str(script_id))
+                )
+                row = curs.fetchone()
+            logger.info(f"Fetched script {game_id}/{scene_id}/{script_id} for user {user_id}")
+            return row["script"] if row else None
+        except Exception as e:
+            logger.error(f"Error fetching script {game_id}/{scene_id}/{script_id} for user {user_id}: {e}")
+
+    def put_user_dialogue(self, user_id: int, game_id: str, scene_id: str, script_id: str, script: dict):
+        # Блокируется только строка сценария. Сохранённый result не перезаписывается, для нового сценария берётся присланный
+        try:
+            with self.db_conn.cursor(cursor_factory=RealDictCursor) as curs:
+                curs.execute(
+                    """
+                    INSERT INTO dialogues (scene_id, external_id, position, title, extra)
+                    SELECT s.id, %(script_id)s,
+                        (SELECT COALESCE(MAX(position) + 1, 0) FROM dialogues WHERE scene_id = s.id),
+                        COALESCE(%(script)s::jsonb ->> 'title', %(script)s::jsonb ->> 'name'),
+                        %(script)s::jsonb - 'result' - 'generated'
+                    FROM scenes s JOIN games g ON g.id = s.game_id
+                    WHERE g.user_id = %(user_id)s AND g.external_id = %(game_id)s AND s.external_id = %(scene_id)s
+                    ON CONFLICT (scene_id, external_id) DO UPDATE
+                    SET title = EXCLUDED.title,
+                        -- без id в теле сохраняется прежний id объекта
+                        extra = (CASE WHEN EXCLUDED.extra ? 'id' OR NOT dialogues.extra ? 'id' THEN '{}'::jsonb ELSE jsonb_build_object('id', dialogues.extra -> 'id') END) || EXCLUDED.extra
+                    RETURNING id, (xmax = 0) AS created;
+                    """,
+                    {"user_id": user_id, "game_id": str(game_id), "scene_id": str(scene_id), "script_id": str(script_id), "script": json.dumps(script)}
+                )
+                row = curs.fetchone()
+                if row and "result" in script:
+                    curs.execute("SELECT save_generated_dialogue(%s, %s::jsonb, false);", (row["id"], json.dumps(script["result"])))
+            self.db_conn.commit()
+            if not row:
+                return {"scene": False, "created": False}
+            logger.info(f"Saved script {game_id}/{scene_id}/{script_id} for user {user_id}, created: {row['created']}")
+            return {"scene": True, "created": row["created"]}
+        except Exception as e:
+            logger.error(f"Error saving script {game_id}/{scene_id}/{script_id} for user {user_id}: {e}")
+            self.db_conn.rollback()
+
+    def get_user_generated(self, user_id: int, game_id: str, scene_id: str, script_id: str):
+        # Граф читается только здесь - в документе пользователя и в get_user_dialogue его нет. graph - JSON-текст
+        try:
+            with self.db_conn.cursor(cursor_factory=RealDictCursor) as curs:
+                curs.execute(
+                    """
+                    SELECT gd.graph::text AS graph, gd.node_count, gd.size, gd.created_at
+                    FROM generated_dialogues gd
+                    JOIN dialogues d ON d.id = gd.dialogue_id
+                    JOIN scenes s ON s.id = d.scene_id
+                    JOIN games g ON g.id = s.game_id
+                    WHERE g.user_id = %s AND g.external_id = %s AND s.external_id = %s AND d.external_id = %s;
+                    """,
+                    (user_id, str(game_id), str(scene_id), str(script_id))
+                )
+                row = curs.fetchone()
+            logger.info(f"Fetched generated dialogue {game_id}/{scene_id}/{script_id} for user {user_id}")
+            return row
+        except Exception as e:
+            logger.error(f"Error fetching generated dialogue {game_id}/{scene_id}/{script_id} for user {user_id}: {e}")
+
+    def delete_user_dialogue(self, user_id: int, game_id: str, scene_id: str, script_id: str):
+        try:
+            with self.db_conn.cursor() as curs:
+                curs.execute(
+                    """
+                    DELETE FROM dialogues d USING scenes s, games g
+                    WHERE s.id = d.scene_id AND g.id = s.game_id
+                        AND g.user_id = %s AND g.external_id = %s AND s.external_id = %s AND d.external_id = %s;
+                    """,
+                    (user_id, str(game_id), str(scene_id), str(script_id))
+                )
+                deleted = curs.rowcount > 0
+            self.db_conn.commit()
+            logger.info(f"Deleted script {game_id}/{scene_id}/{script_id} for user {user_id}: {deleted}")
+            return deleted
+        except Exception as e:
+            logger.error(f"Error deleting script {game_id}/{scene_id}/{script_id} for user {user_id}: {e}")
+            self.db_conn.rollback()
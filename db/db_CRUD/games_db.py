@@ -1,33 +1,45 @@
-from db.database import Database
+import json
+from psycopg2.extras import RealDictCursor
 from db.logging import logger
 
 
 class Games:
-    def __init__(self, db: Database):
-        self.db = db
+    # Игры пользователя. id - внутренний ключ строки, external_id - id игры в документе фронтенда,
+    # по нему работают методы *_user_game и эндпоинты /users/me/games.
+    # Записи здесь, в Scenes и Dialogues не трогают строку users_data: ETag /users/me/data учитывает их
+    # через user_content_stamp (xmin строк игр, сцен и сценариев), вычисляемый при чтении
+    def __init__(self, db_conn):
+        self.db_conn = db_conn
 
-    def create_game(self, user_id: int, title: str, technology_level: str = None, magic: str = None):
+    def create_game(self, user_id: int, title: str, technology_level: str = None, magic: str = None, external_id: str = None):
         try:
-            self.db.cursor.execute(
-                """
-                INSERT INTO games (user_id, title, technology_level, magic)
-                VALUES (%s, %s, %s, %s)
-                RETURNING id;
-                """,
-                (user_id, title, technology_level, magic)
-            )
-            game_id = self.db.cursor.fetchone()["id"]
-            self.db.conn.commit()
+            with self.db_conn.cursor(cursor_factory=RealDictCursor) as curs:
+                curs.execute(
+                    """
+                    INSERT INTO games (user_id, external_id, position, title, technology_level, magic, extra)
+                    VALUES (
+                        %(user_id)s, COALESCE(%(external_id)s, gen_random_uuid()::text),
+                        (SELECT COALESCE(MAX(position) + 1, 0) FROM games WHERE user_id = %(user_id)s),
+                        %(title)s, %(technology_level)s, %(magic)s,
+                        jsonb_strip_nulls(jsonb_build_object('title', %(title)s::text, 'technology_level', %(technology_level)s::text, 'magic', %(magic)s::text))
+                    )
+                    RETURNING id;
+                    """,
+                    {"user_id": user_id, "external_id": external_id, "title": title, "technology_level": technology_level, "magic": magic}
+                )
+                game_id = curs.fetchone()["id"]
+            self.db_conn.commit()
             logger.info(f"Game created: {game_id} by user {user_id}")
             return game_id
         except Exception as e:
             logger.error(f"Error creating game for user {user_id}: {e}")
-            self.db.conn.rollback()
+            self.db_conn.rollback()
 
     def get_game_by_id(self, game_id: int):
         try:
-            self.db.cursor.execute("SELECT * FROM games WHERE id = %s;", (game_id,))
-            game = self.db.cursor.fetchone()
+            with self.db_conn.cursor(cursor_factory=RealDictCursor) as curs:
+                curs.execute("SELECT * FROM games WHERE id = %s;", (game_id,))
+                game = curs.fetchone()
             logger.info(f"Fetched game by id: {game_id}")
             return game
         except Exception as e:
@@ -35,8 +47,9 @@ class Games:
 
     def get_games_by_user(self, user_id: int):
         try:
-            self.db.cursor.execute("SELECT * FROM games WHERE user_id = %s;", (user_id,))
-            games = self.db.cursor.fetchall()
+            with self.db_conn.cursor(cursor_factory=RealDictCursor) as curs:
+                curs.execute("SELECT * FROM games WHERE user_id = %s ORDER BY position, id;", (user_id,))
+                games = curs.fetchall()
             logger.info(f"Fetched {len(games)} games for user {user_id}")
             return games
         except Exception as e:
@@ -44,9 +57,9 @@ class Games:
 
     def search_games_by_title(self, title: str):
         try:
-            self.db.cursor.execute(
-                "SELECT * FROM games WHERE title = %s;", (title,))
-            new_title = self.db.cursor.fetchall()
+            with self.db_conn.cursor(cursor_factory=RealDictCursor) as curs:
+                curs.execute("SELECT * FROM games WHERE title = %s;", (title,))
+                new_title = curs.fetchall()
             logger.info(f"Found {len(new_title)} games matching title part: '{title}'")
             return new_title
         except Exception as e:
@@ -54,36 +67,124 @@ class Games:
 
     def update_game_title(self, game_id: int, new_title: str):
         try:
-            self.db.cursor.execute(
-                "UPDATE games SET title = %s WHERE id = %s;",
-                (new_title, game_id)
-            )
-            self.db.conn.commit()
+            with self.db_conn.cursor() as curs:
+                curs.execute(
+                    "UPDATE games SET title = %(title)s, extra = extra || jsonb_build_object('title', %(title)s::text) WHERE id = %(id)s;",
+                    {"title": new_title, "id": game_id}
+                )
+            self.db_conn.commit()
             logger.info(f"Updated title of game {game_id} to '{new_title}'")
             return True
         except Exception as e:
             logger.error(f"Error updating title for game {game_id}: {e}")
-            self.db.conn.rollback()
+            self.db_conn.rollback()
 
     def update_game_settings(self, game_id: int, technology_level: str = None, magic: str = None):
         try:
-            self.db.cursor.execute(
-                "UPDATE games SET technology_level = %s, magic = %s WHERE id = %s;",
-                (technology_level, magic, game_id)
-            )
-            self.db.conn.commit()
+            with self.db_conn.cursor() as curs:
+                curs.execute(
+                    """
+                    UPDATE games SET technology_level = %(technology_level)s, magic = %(magic)s,
+                        extra = jsonb_strip_nulls(extra || jsonb_build_object('technology_level', %(technology_level)s::text, 'magic', %(magic)s::text))
+                    WHERE id = %(id)s;
+                    """,
+                    {"technology_level": technology_level, "magic": magic, "id": game_id}
+                )
+            self.db_conn.commit()
             logger.info(f"Updated settings of game {game_id}")
             return True
         except Exception as e:
             logger.error(f"Error updating settings for game {game_id}: {e}")
-            self.db.conn.rollback()
+            self.db_conn.rollback()
 
     def delete_game(self, game_id: int):
         try:
-            self.db.cursor.execute("DELETE FROM games WHERE id = %s;", (game_id,))
-            self.db.conn.commit()
+            with self.db_conn.cursor() as curs:
+                curs.execute("DELETE FROM games WHERE id = %s;", (game_id,))
+            self.db_conn.commit()
             logger.info(f"Deleted game {game_id}")
             return True
         except Exception as e:
             logger.error(f"Error deleting game {game_id}: {e}")
-            self.db.conn.rollback()
+            self.db_conn.rollback()
+
+    def get_user_games(self, user_id: int):
+        # Список игр без сцен - для навигации, сцены и сценарии читаются отдельными запросами.
+        # Как и get_user_game, возвращает JSON-текст: ручка отдаёт его без разбора
+        try:
+            with self.db_conn.cursor(cursor_factory=RealDictCursor) as curs:
+                curs.execute(
+                    """
+                    SELECT COALESCE(jsonb_agg(jsonb_build_object('id', external_id) || extra ORDER BY position, id), '[]'::jsonb)::text AS games
+                    FROM games WHERE user_id = %s;
+                    """,
+                    (user_id,)
+                )
+                games = curs.fetchone()["games"]
+            logger.info(f"Fetched games for user {user_id}")
+            return games
+        except Exception as e:
+            logger.error(f"Error fetching games for user {user_id}: {e}")
+
+    def get_user_game(self, user_id: int, game_id: str):
+        try:
+            with self.db_conn.cursor(cursor_factory=RealDictCursor) as curs:
+                curs.execute(
+                    "SELECT game_json(id)::text AS game FROM games WHERE user_id = %s AND external_id = %s;",
+                    (user_id, str(game_id))
+                )
+                row = curs.fetchone()
+            logger.info(f"Fetched game {game_id} for user {user_id}")
+            return row["game"] if row else None
+        except Exception as e:
+            logger.error(f"Error fetching game {game_id} for user {user_id}: {e}")
+
+    def put_user_game(self, user_id: int, game_id: str, game: dict):
+        # Новая игра встаёт в конец списка. Сцены заменяются, только если переданы в game["scenes"]
+        try:
+            with self.db_conn.cursor(cursor_factory=RealDictCursor) as curs:
+                curs.execute(
+                    """
+                    INSERT INTO games (user_id, external_id, position, title, technology_level, magic, extra)
+                    VALUES (
+                        %(user_id)s, %(game_id)s,
+                        (SELECT COALESCE(MAX(position) + 1, 0) FROM games WHERE user_id = %(user_id)s),
+                        COALESCE(%(game)s::jsonb ->> 'title', %(game)s::jsonb ->> 'name'),
+                        %(game)s::jsonb ->> 'technology_level', %(game)s::jsonb ->> 'magic', %(game)s::jsonb - 'scenes'
+                    )
+                    ON CONFLICT (user_id, external_id) DO UPDATE
+                    SET title = EXCLUDED.title, technology_level = EXCLUDED.technology_level,
+                        magic = EXCLUDED.magic,
+                        -- без id в теле сохраняется прежний id объекта
+                        extra = (CASE WHEN EXCLUDED.extra ? 'id' OR NOT games.extra ? 'id' THEN '{}'::jsonb ELSE jsonb_build_object('id', games.extra -> 'id') END) || EXCLUDED.extra
+                    RETURNING id, (xmax = 0) AS created;
+                    """,
+                    {"user_id": user_id, "game_id": str(game_id), "game": json.dumps(game)}
+                )
+                row = curs.fetchone()
+                if "scenes" in game:
+                    curs.execute("SELECT sync_game_scenes(%s, %s::jsonb);", (row["id"], json.dumps(game["scenes"])))
+            self.db_conn.commit()
+            logger.info(f"Saved game {game_id} for user {user_id}, created: {row['created']}")
+            return {"created": row["created"]}
+        except Exception as e:
+            logger.error(f"Error saving game {game_id} for user {user_id}: {e}")
+            self.db_conn.rollback()
+
+    def delete_user_game(self, user_id: int, game_id: str):
+        try:
+            with self.db_conn.cursor() as curs:
+                curs.execute("DELETE FROM games WHERE user_id = %s AND external_id = %s;", (user_id, str(game_id)))
+                deleted = curs.rowcount > 0
+            self.db_conn.commit()
+            logger.info(f"Deleted game {game_id} for user {user_id}: {deleted}")
+            return deleted
+        except Exception as e:
+            logger.error(f"Error deleting game {game_id} for user {user_id}: {e}")
+            self.db_conn.rollback()
+
+    def sync_user_games(self, user_id: int, games):
+        # Приводит строки к массиву games из документа. Работает в транзакции вызывающего:
+        # не коммитит и не ловит ошибки
+        with self.db_conn.cursor() as curs:
+            curs.execute("SELECT sync_user_games(%s, %s::jsonb);", (user_id, json.dumps(games)))
@@ -1,33 +1,40 @@
-from db.database import Database
+import json
+from psycopg2.extras import RealDictCursor
 from db.logging import logger
 
 
 class Scenes:
-    def __init__(self, db: Database):
-        self.db = db
+    def __init__(self, db_conn):
+        self.db_conn = db_conn
 
-    def create_scene(self, game_id: int, title: str = None):
+    def create_scene(self, game_id: int, title: str = None, external_id: str = None):
         try:
-            self.db.cursor.execute(
-                """
-                INSERT INTO scenes (game_id, title)
-                VALUES (%s, %s)
-                RETURNING id;
-                """,
-                (game_id, title)
-            )
-            scene_id = self.db.cursor.fetchone()['id']
-            self.db.conn.commit()
+            with self.db_conn.cursor(cursor_factory=RealDictCursor) as curs:
+                curs.execute(
+                    """
+                    INSERT INTO scenes (game_id, external_id, position, title, extra)
+                    VALUES (
+                        %(game_id)s, COALESCE(%(external_id)s, gen_random_uuid()::text),
+                        (SELECT COALESCE(MAX(position) + 1, 0) FROM scenes WHERE game_id = %(game_id)s),
+                        %(title)s, jsonb_strip_nulls(jsonb_build_object('title', %(title)s::text))
+                    )
+                    RETURNING id;
+                    """,
+                    {"game_id": game_id, "external_id": external_id, "title": title}
+                )
+                scene_id = curs.fetchone()['id']
+            self.db_conn.commit()
             logger.info(f"Scene created: {scene_id} in game {game_id}")
             return scene_id
         except Exception as e:
             logger.error(f"Error creating scene for game {game_id}: {e}")
-            self.db.conn.rollback()
+            self.db_conn.rollback()
 
     def get_scene_by_id(self, scene_id: int):
         try:
-            self.db.cursor.execute("SELECT * FROM scenes WHERE id = %s;", (scene_id,))
-            scene = self.db.cursor.fetchone()
+            with self.db_conn.cursor(cursor_factory=RealDictCursor) as curs:
+                curs.execute("SELECT * FROM scenes WHERE id = %s;", (scene_id,))
+                scene = curs.fetchone()
             logger.info(f"Fetched scene by id: {scene_id}")
             return scene
         except Exception as e:
@@ -35,8 +42,9 @@ class Scenes:
 
     def get_scenes_by_game(self, game_id: int):
         try:
-            self.db.cursor.execute("SELECT * FROM scenes WHERE game_id = %s;", (game_id,))
-            scenes = self.db.cursor.fetchall()
+            with self.db_conn.cursor(cursor_factory=RealDictCursor) as curs:
+                curs.execute("SELECT * FROM scenes WHERE game_id = %s ORDER BY position, id;", (game_id,))
+                scenes = curs.fetchall()
             logger.info(f"Fetched {len(scenes)} scenes for game {game_id}")
             return scenes
         except Exception as e:
@@ -44,23 +52,91 @@ class Scenes:
 
     def update_scene_title(self, scene_id: int, new_title: str):
         try:
-            self.db.cursor.execute(
-                "UPDATE scenes SET title = %s WHERE id = %s;",
-                (new_title, scene_id)
-            )
-            self.db.conn.commit()
+            with self.db_conn.cursor() as curs:
+                curs.execute(
+                    "UPDATE scenes SET title = %(title)s, extra = extra || jsonb_build_object('title', %(title)s::text) WHERE id = %(id)s;",
+                    {"title": new_title, "id": scene_id}
+                )
+            self.db_conn.commit()
             logger.info(f"Updated scene {scene_id} title to '{new_title}'")
             return True
         except Exception as e:
             logger.error(f"Error updating title of scene {scene_id}: {e}")
-            self.db.conn.rollback()
+            self.db_conn.rollback()
 
     def delete_scene(self, scene_id: int):
         try:
-            self.db.cursor.execute("DELETE FROM scenes WHERE id = %s;", (scene_id,))
-            self.db.conn.commit()
+            with self.db_conn.cursor() as curs:
+                curs.execute("DELETE FROM scenes WHERE id = %s;", (scene_id,))
+            self.db_conn.commit()
             logger.info(f"Deleted scene {scene_id}")
             return True
         except Exception as e:
             logger.error(f"Error deleting scene {scene_id}: {e}")
-            self.db.conn.rollback()
+            self.db_conn.rollback()
+
+    def get_user_scene(self, user_id: int, game_id: str, scene_id: str):
+        try:
+            with self.db_conn.cursor(cursor_factory=RealDictCursor) as curs:
+                curs.execute(
+                    """
+                    SELECT scene_json(s.id)::text AS scene
+                    FROM scenes s JOIN games g ON g.id = s.game_id
+                    WHERE g.user_id = %s AND g.external_id = %s AND s.external_id = %s;
+                    """,
+                    (user_id, str(game_id), str(scene_id))
+                )
+                row = curs.fetchone()
+            logger.info(f"Fetched scene {game_id}/{scene_id} for user {user_id}")
+            return row["scene"] if row else None
+        except Exception as e:
+            logger.error(f"Error fetching scene {game_id}/{scene_id} for user {user_id}: {e}")
+
+    def put_user_scene(self, user_id: int, game_id: str, scene_id: str, scene: dict):
+        # Возвращает None при ошибке, {"game": False} если игры нет. Сценарии заменяются, только если переданы
+        try:
+            with self.db_conn.cursor(cursor_factory=RealDictCursor) as curs:
+                curs.execute(
+                    """
+                    INSERT INTO scenes (game_id, external_id, position, title, extra)
+                    SELECT g.id, %(scene_id)s,
+                        (SELECT COALESCE(MAX(position) + 1, 0) FROM scenes WHERE game_id = g.id),
+                        COALESCE(%(scene)s::jsonb ->> 'title', %(scene)s::jsonb ->> 'name'), %(scene)s::jsonb - 'scripts'
+                    FROM games g WHERE g.user_id = %(user_id)s AND g.external_id = %(game_id)s
+                    ON CONFLICT (game_id, external_id) DO UPDATE
+                    SET title = EXCLUDED.title,
+                        -- без id в теле сохраняется прежний id объекта
+                        extra = (CASE WHEN EXCLUDED.extra ? 'id' OR NOT scenes.extra ? 'id' THEN '{}'::jsonb ELSE jsonb_build_object('id', scenes.extra -> 'id') END) || EXCLUDED.extra
+                    RETURNING id, (xmax = 0) AS created;
+                    """,
+                    {"user_id": user_id, "game_id": str(game_id), "scene_id": str(scene_id), "scene": json.dumps(scene)}
+                )
+                row = curs.fetchone()
+                if row and "scripts" in scene:
+                    curs.execute("SELECT sync_scene_dialogues(%s, %s::jsonb);", (row["id"], json.dumps(scene["scripts"])))
+            self.db_conn.commit()
+            if not row:
+                return {"game": False, "created": False}
+            logger.info(f"Saved scene {game_id}/{scene_id} for user {user_id}, created: {row['created']}")
+            return {"game": True, "created": row["created"]}
+        except Exception as e:
+            logger.error(f"Error saving scene {game_id}/{scene_id} for user {user_id}: {e}")
+            self.db_conn.rollback()
+
+    def delete_user_scene(self, user_id: int, game_id: str, scene_id: str):
+        try:
+            with self.db_conn.cursor() as curs:
+                curs.execute(
+                    """
+                    DELETE FROM scenes s USING games g
+                    WHERE g.id = s.game_id AND g.user_id = %s AND g.external_id = %s AND s.external_id = %s;
+                    """,
+                    (user_id, str(game_id), str(scene_id))
+                )
+                deleted = curs.rowcount > 0
+            self.db_conn.commit()
+            logger.info(f"Deleted scene {game_id}/{scene_id} for user {user_id}: {deleted}")
+            return deleted
+        except Exception as e:
+            logger.error(f"Error deleting scene {game_id}/{scene_id} for user {user_id}: {e}")
+            self.db_conn.rollback()
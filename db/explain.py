@@ -0,0 +1,93 @@
+import sys
+from db.database import DatabasePool
+from db.logging import logger
+
+
+# Горячие запросы CRUD-слоя и сессий в той же форме, что в db/users_db.py, db/db_CRUD и db/async_sessions_db.py: (название, запрос, параметры).
+# Значения параметров на план не влияют - важна только форма условий
+HOT_QUERIES = (
+    ("login: user by mail", "SELECT id, mail, name, surname, password_hash FROM users_data WHERE mail = %s AND NOT is_deleted;", ("user@example.com",)),
+    ("user by id", "SELECT id, mail, name, surname FROM users_data WHERE id = %s AND NOT is_deleted;", (1,)),
+    ("games of user", "SELECT jsonb_build_object('id', external_id) || extra FROM games WHERE user_id = %s ORDER BY position, id;", (1,)),
+    ("game by id", "SELECT id FROM games WHERE user_id = %s AND external_id = %s;", (1, "g")),
+    ("games by title", "SELECT * FROM games WHERE title = %s;", ("title",)),
+    ("scenes of game", "SELECT * FROM scenes WHERE game_id = %s ORDER BY position, id;", (1,)),
+    (
+        "scene by id",
+        "SELECT s.id FROM scenes s JOIN games g ON g.id = s.game_id WHERE g.user_id = %s AND g.external_id = %s AND s.external_id = %s;",
+        (1, "g", "s")
+    ),
+    ("dialogues of scene", "SELECT * FROM dialogues WHERE scene_id = %s ORDER BY position, id;", (1,)),
+    (
+        "script by id",
+        """
+        SELECT d.id FROM dialogues d JOIN scenes s ON s.id = d.scene_id JOIN games g ON g.id = s.game_id
+        WHERE g.user_id = %s AND g.external_id = %s AND s.external_id = %s AND d.external_id = %s;
+        """,
+        (1, "g", "s", "d")
+    ),
+    (
+        "generated dialogue",
+        """
+        SELECT gd.node_count FROM generated_dialogues gd JOIN dialogues d ON d.id = gd.dialogue_id
+        JOIN scenes s ON s.id = d.scene_id JOIN games g ON g.id = s.game_id
+        WHERE g.user_id = %s AND g.external_id = %s AND s.external_id = %s AND d.external_id = %s;
+        """,
+        (1, "g", "s", "d")
+    ),
+    ("characters of game", "SELECT * FROM characters WHERE game_id = %s;", (1,)),
+    ("characters of dialogue", "SELECT * FROM characters WHERE dialogue_id = %s;", (1,)),
+    (
+        "refresh: session by token",
+        """
+        SELECT s.id, u.mail FROM user_sessions s JOIN users_data u ON u.id = s.user_id
+        WHERE s.token_hash = %s AND s.revoked_at IS NULL AND s.expires_at > now() AND NOT u.is_deleted;
+        """,
+        (b"token",)
+    ),
+    ("refresh: reused token", "SELECT id FROM user_sessions WHERE previous_token_hash = %s AND revoked_at IS NULL;", (b"token",)),
+    ("sessions of user", "SELECT id FROM user_sessions WHERE user_id = %s AND revoked_at IS NULL;", (1,)),
+)
+
+
+def get_seq_scans(plan):
+    # Таблицы, которые план читает полным просмотром
+    tables = []
+    if plan.get("Node Type") == "Seq Scan":
+        tables.append(plan.get("Relation Name"))
+    for child in plan.get("Plans", []):
+        tables.extend(get_seq_scans(child))
+    return tables
+
+
+def check_query_plans(db_conn):
+    # На маленьких таблицах планировщик выберет Seq Scan и при наличии индекса, поэтому полный просмотр
+    # запрещается (enable_seqscan = off): если он всё равно в плане, подходящего индекса нет.
+    # Возвращает {название запроса: таблицы с Seq Scan} для запросов, которые индекс не обслуживает
+    failed = {}
+    try:
+        with db_conn.cursor() as curs:
+            curs.execute("SET LOCAL enable_seqscan = off;")
+            for name, query, params in HOT_QUERIES:
+                curs.execute("EXPLAIN (FORMAT JSON) " + query, params)
+                plan = curs.fetchone()[0][0]["Plan"]
+                seq_scans = get_seq_scans(plan)
+                if seq_scans:
+                    failed[name] = seq_scans
+                    logger.error(f"Query '{name}' uses Seq Scan on {', '.join(seq_scans)}")
+    finally:
+        db_conn.rollback()
+    return failed
+
+
+if __name__ == "__main__":
+    # python -m db.explain - код выхода 1, если какой-то горячий запрос не может идти по индексу
+    DatabasePool.init_pool()
+    try:
+        with DatabasePool.connection() as conn:
+            failed = check_query_plans(conn)
+        for name, _, _ in HOT_QUERIES:
+            print(f"{'SEQ SCAN ' + ', '.join(failed[name]) if name in failed else 'index':40} {name}")
+        sys.exit(1 if failed else 0)
+    finally:
+        DatabasePool.close_all()
@@ -0,0 +1,130 @@
+import json
+from psycopg2.extras import RealDictCursor
+from db.logging import logger
+
+
+class Jobs:
+    # Задачи генерации (generation_jobs). Время отдаётся в секундах epoch, как и раньше в ответах /generate.
+    # Очередь и выполнение - в процессе (lib.llm.jobs.GenerationJobs), здесь только состояние
+    def __init__(self, db_conn):
+        self.db_conn = db_conn
+
+    def create_job(self, job_id: str, user_id: int, game_id, scene_id, script_id, worker: str, ttl: float):
+        # Заодно удаляются задачи, завершённые больше ttl секунд назад
+        try:
+            with self.db_conn.cursor() as curs:
+                curs.execute("DELETE FROM generation_jobs WHERE finished_at < now() - make_interval(secs => %s);", (float(ttl),))
+                curs.execute(
+                    """
+                    INSERT INTO generation_jobs (id, user_id, game_id, scene_id, script_id, worker)
+                    VALUES (%s, %s, %s, %s, %s, %s);
+                    """,
+                    (job_id, user_id, str(game_id), str(scene_id), str(script_id), worker)
+                )
+            self.db_conn.commit()
+            logger.info(f"Generation job {job_id} created for user {user_id}")
+            return True
+        except Exception as e:
+            logger.error(f"Error creating generation job for user {user_id}: {e}")
+            print(f"Error creating generation job for user {user_id}: {e}", end="\n\n======\n\n")
+            self.db_conn.rollback()
+            return False
+
+    def start_job(self, job_id: str):
+        try:
+            with self.db_conn.cursor() as curs:
+                curs.execute(
+                    "UPDATE generation_jobs SET status = 'running', started_at = now(), heartbeat_at = now() WHERE id = %s;",
+                    (job_id,)
+                )
+            self.db_conn.commit()
+            return True
+        except Exception as e:
+            logger.error(f"Error starting generation job {job_id}: {e}")
+            self.db_conn.rollback()
+            return False
+
+    def finish_job(self, job_id: str, status: str, error: str = None, metrics: dict = None):
+        try:
+            with self.db_conn.cursor() as curs:
+                curs.execute(
+                    """
+                    UPDATE generation_jobs SET status = %s, finished_at = now(), heartbeat_at = now(), error = %s,
+                        metrics = COALESCE(%s::jsonb, metrics)
+                    WHERE id = %s;
+                    """,
+                    (status, error, json.dumps(metrics) if metrics is not None else None, job_id)
+                )
+            self.db_conn.commit()
+            logger.info(f"Generation job {job_id} finished: {status}")
+            return True
+        except Exception as e:
+            logger.error(f"Error finishing generation job {job_id}: {e}")
+            print(f"Error finishing generation job {job_id}: {e}", end="\n\n======\n\n")
+            self.db_conn.rollback()
+            return False
+
+    def heartbeat(self, worker: str, metrics: dict):
+        # metrics - сводка по идущим задачам процесса {job_id: summary}: прогресс виден из любого воркера
+        try:
+            with self.db_conn.cursor() as curs:
+                curs.execute(
+                    "UPDATE generation_jobs SET heartbeat_at = now() WHERE worker = %s AND finished_at IS NULL;",
+                    (worker,)
+                )
+                for job_id, summary in metrics.items():
+                    curs.execute("UPDATE generation_jobs SET metrics = %s::jsonb WHERE id = %s;", (json.dumps(summary), job_id))
+            self.db_conn.commit()
+            return True
+        except Exception as e:
+            logger.error(f"Error updating generation jobs of {worker}: {e}")
+            self.db_conn.rollback()
+            return False
+
+    def interrupt_jobs(self, worker: str, error: str):
+        # Незавершённые задачи процесса, который останавливается: их потоки отменены
+        try:
+            with self.db_conn.cursor() as curs:
+                curs.execute(
+                    """
+                    UPDATE generation_jobs SET status = 'failed', finished_at = now(), error = %s
+                    WHERE worker = %s AND finished_at IS NULL;
+                    """,
+                    (error, worker)
+                )
+                count = curs.rowcount
+            self.db_conn.commit()
+            logger.info(f"Interrupted {count} generation jobs of {worker}")
+            return count
+        except Exception as e:
+            logger.error(f"Error interrupting generation jobs of {worker}: {e}")
+            self.db_conn.rollback()
+            return None
+
+    def get_job(self, job_id: str, stale_after: float):
+        # Задача без heartbeat дольше stale_after секунд отдаётся как failed: процесс, который её выполнял, остановлен
+        try:
+            with self.db_conn.cursor(cursor_factory=RealDictCursor) as curs:
+                curs.execute(
+                    """
+                    SELECT id, user_id, game_id, scene_id, script_id, worker, metrics,
+                        CASE WHEN stale THEN 'failed' ELSE status END AS status,
+                        CASE WHEN stale THEN 'Generation was interrupted' ELSE error END AS error,
+                        extract(epoch FROM created_at)::float8 AS created_at,
+                        extract(epoch FROM started_at)::float8 AS started_at,
+                        extract(epoch FROM COALESCE(finished_at, CASE WHEN stale THEN heartbeat_at END))::float8 AS finished_at
+                    FROM (
+                        SELECT *, finished_at IS NULL AND heartbeat_at < now() - make_interval(secs => %s) AS stale
+                        FROM generation_jobs WHERE id = %s
+                    ) j;
+                    """,
+                    (float(stale_after), job_id)
+                )
+                row = curs.fetchone()
+            self.db_conn.commit()
+            return row
+        except Exception as e:
+            logger.error(f"Error fetching generation job {job_id}: {e}")
+            print(f"Error fetching generation job {job_id}: {e}", end="\n\n======\n\n")
+            self.db_conn.rollback()
+            return None
@@ -0,0 +1,137 @@
+import os
+import sys
+from dotenv import load_dotenv
+from db.database import DatabasePool
+from db.logging import logger
+
+
+load_dotenv()
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(__file__), "migrations")
+# Один ключ advisory lock на все процессы: несколько воркеров uvicorn не применяют миграции одновременно
+MIGRATIONS_LOCK_ID = 7125001
+
+# Поиски CRUD-слоя: для каждой пары (таблица, колонки) нужен индекс, который начинается с этих колонок.
+# unique - индекс должен быть уникальным (mail: на нём держится регистрация)
+REQUIRED_INDEXES = (
+    ("users_data", ("mail",), True),
+    ("games", ("user_id",), False),
+    ("games", ("title",), False),
+    ("scenes", ("game_id",), False),
+    ("dialogues", ("scene_id",), False),
+    ("characters", ("game_id",), False),
+    ("characters", ("dialogue_id",), False),
+    ("generated_dialogues", ("dialogue_id",), True),
+    ("user_sessions", ("token_hash",), True),
+    ("user_sessions", ("previous_token_hash",), False),
+    ("user_sessions", ("user_id",), False),
+    ("auth_throttle", ("key", "window_index"), True),
+    ("generation_jobs", ("finished_at",), False),
+)
+
+
+class Migrations:
+    # Миграции - файлы NNN_name.sql в db/migrations, применяются по порядку номера,
+    # каждая в своей транзакции, применённые записываются в schema_migrations
+
+    @classmethod
+    def get_migrations(cls):
+        migrations = []
+        for file_name in sorted(os.listdir(MIGRATIONS_DIR)):
+            if file_name.endswith(".sql") and file_name.split("_", 1)[0].isdigit():
+                migrations.append((int(file_name.split("_", 1)[0]), file_name))
+        return migrations
+
+    @classmethod
+    def get_applied(cls, db_conn):
+        with db_conn.cursor() as curs:
+            curs.execute(
+                """
+                CREATE TABLE IF NOT EXISTS schema_migrations (
+                    version INTEGER PRIMARY KEY,
+                    name TEXT NOT NULL,
+                    applied_at TIMESTAMPTZ NOT NULL DEFAULT now()
+                );
+                """
+            )
+            curs.execute("SELECT version FROM schema_migrations;")
+            return {row[0] for row in curs.fetchall()}
+
+    @classmethod
+    def apply(cls, db_conn):
+        applied_now = []
+        with db_conn.cursor() as curs:
+            curs.execute("SELECT pg_advisory_lock(%s);", (MIGRATIONS_LOCK_ID,))
+        try:
+            applied = cls.get_applied(db_conn)
+            db_conn.commit()
+            for version, file_name in cls.get_migrations():
+                if version in applied:
+                    continue
+                with open(os.path.join(MIGRATIONS_DIR, file_name), encoding="utf-8") as file:
+                    sql = file.read()
+                try:
+                    with db_conn.cursor() as curs:
+                        curs.execute(sql)
+                        curs.execute("INSERT INTO schema_migrations (version, name) VALUES (%s, %s);", (version, file_name))
+                    db_conn.commit()
+                except Exception as e:
+                    db_conn.rollback()
+                    logger.error(f"Migration {file_name} failed: {e}")
+                    print(f"Migration {file_name} failed: {e}", end="\n\n======\n\n")
+                    raise
+                logger.info(f"Migration applied: {file_name}")
+                print(f"Migration applied: {file_name}", end="\n\n======\n\n")
+                applied_now.append(file_name)
+        finally:
+            with db_conn.cursor() as curs:
+                curs.execute("SELECT pg_advisory_unlock(%s);", (MIGRATIONS_LOCK_ID,))
+            db_conn.commit()
+        return applied_now
+
+    @classmethod
+    def check_indexes(cls, db_conn):
+        # Возвращает описания недостающих индексов из REQUIRED_INDEXES. Частичные и невалидные индексы не считаются
+        with db_conn.cursor() as curs:
+            curs.execute(
+                """
+                SELECT t.relname, i.indisunique, array_agg(a.attname::text ORDER BY k.ord) AS columns
+                FROM pg_index i
+                JOIN pg_class t ON t.oid = i.indrelid
+                JOIN LATERAL unnest(i.indkey) WITH ORDINALITY AS k(attnum, ord) ON true
+                JOIN pg_attribute a ON a.attrelid = t.oid AND a.attnum = k.attnum
+                WHERE t.relname = ANY(%s) AND pg_table_is_visible(t.oid) AND i.indisvalid AND i.indpred IS NULL
+                GROUP BY i.indexrelid, t.relname, i.indisunique;
+                """,
+                (list({table for table, _, _ in REQUIRED_INDEXES}),)
+            )
+            indexes = curs.fetchall()
+        db_conn.commit()
+        missing = []
+        for table, columns, unique in REQUIRED_INDEXES:
+            found = any(
+                relname == table and tuple(index_columns[:len(columns)]) == columns and (is_unique or not unique)
+                for relname, is_unique, index_columns in indexes
+            )
+            if not found:
+                missing.append(f"{'unique ' if unique else ''}index on {table} ({', '.join(columns)})")
+        for description in missing:
+            logger.error(f"Missing {description}")
+            print(f"Missing {description}", end="\n\n======\n\n")
+        return missing
+
+
+if __name__ == "__main__":
+    # python -m db.migrate - применить миграции без запуска сервиса (DB_AUTO_MIGRATE=false);
+    # python -m db.migrate --check - только проверить индексы, код выхода 1 при недостающих
+    DatabasePool.init_pool()
+    try:
+        with DatabasePool.connection() as conn:
+            if "--check" in sys.argv:
+                missing = Migrations.check_indexes(conn)
+                print(f"Missing indexes: {missing}" if missing else "All required indexes exist")
+                sys.exit(1 if missing else 0)
+            applied = Migrations.apply(conn)
+        print(f"Applied: {applied or 'nothing to apply'}")
+    finally:
+        DatabasePool.close_all()
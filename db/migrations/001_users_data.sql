@@ -0,0 +1,10 @@
+-- Базовая схема: таблица уже существует в рабочих базах, для новых создаётся здесь
+CREATE TABLE IF NOT EXISTS users_data (
+    id SERIAL PRIMARY KEY,
+    mail TEXT NOT NULL,
+    name TEXT NOT NULL,
+    surname TEXT NOT NULL,
+    password_hash TEXT NOT NULL,
+    is_deleted BOOLEAN NOT NULL DEFAULT FALSE,
+    data JSONB
+);
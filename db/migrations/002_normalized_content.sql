@@ -0,0 +1,202 @@
+-- Игры, сцены и сценарии (диалоги) выносятся из users_data.data в отдельные строки.
+-- external_id - id, который выдаёт фронтенд; extra - остальные поля объекта как есть,
+-- поэтому документ /users/me/data собирается обратно без потерь. dialogues.data - result генерации
+ALTER TABLE users_data ALTER COLUMN data TYPE JSONB USING data::jsonb;
+
+CREATE TABLE IF NOT EXISTS games (
+    id SERIAL PRIMARY KEY,
+    user_id INTEGER NOT NULL REFERENCES users_data (id) ON DELETE CASCADE,
+    external_id TEXT NOT NULL,
+    position INTEGER NOT NULL DEFAULT 0,
+    title TEXT,
+    technology_level TEXT,
+    magic TEXT,
+    extra JSONB NOT NULL DEFAULT '{}'::jsonb,
+    UNIQUE (user_id, external_id)
+);
+
+CREATE TABLE IF NOT EXISTS scenes (
+    id SERIAL PRIMARY KEY,
+    game_id INTEGER NOT NULL REFERENCES games (id) ON DELETE CASCADE,
+    external_id TEXT NOT NULL,
+    position INTEGER NOT NULL DEFAULT 0,
+    title TEXT,
+    extra JSONB NOT NULL DEFAULT '{}'::jsonb,
+    UNIQUE (game_id, external_id)
+);
+
+CREATE TABLE IF NOT EXISTS dialogues (
+    id SERIAL PRIMARY KEY,
+    scene_id INTEGER NOT NULL REFERENCES scenes (id) ON DELETE CASCADE,
+    external_id TEXT NOT NULL,
+    position INTEGER NOT NULL DEFAULT 0,
+    title TEXT,
+    data JSONB,
+    extra JSONB NOT NULL DEFAULT '{}'::jsonb,
+    UNIQUE (scene_id, external_id)
+);
+
+CREATE TABLE IF NOT EXISTS characters (
+    id SERIAL PRIMARY KEY,
+    game_id INTEGER NOT NULL REFERENCES games (id) ON DELETE CASCADE,
+    dialogue_id INTEGER REFERENCES dialogues (id) ON DELETE SET NULL,
+    is_npc BOOLEAN NOT NULL DEFAULT TRUE,
+    name TEXT,
+    profession TEXT,
+    goal TEXT,
+    talk_style TEXT,
+    traits TEXT,
+    appearance TEXT
+);
+
+CREATE INDEX IF NOT EXISTS characters_game_id_idx ON characters (game_id);
+
+-- games/scenes/dialogues могли остаться от прежнего CRUD-слоя: тогда CREATE TABLE выше ничего не делает
+-- и новые колонки с ограничениями добавляются здесь. Старым строкам выдаётся uuid как external_id,
+-- а title и параметры игры переносятся в extra - из него собирается документ
+ALTER TABLE games
+    ADD COLUMN IF NOT EXISTS external_id TEXT,
+    ADD COLUMN IF NOT EXISTS position INTEGER NOT NULL DEFAULT 0,
+    ADD COLUMN IF NOT EXISTS extra JSONB NOT NULL DEFAULT '{}'::jsonb;
+UPDATE games SET external_id = gen_random_uuid()::text,
+    extra = jsonb_strip_nulls(jsonb_build_object('title', title, 'technology_level', technology_level, 'magic', magic))
+WHERE external_id IS NULL;
+ALTER TABLE games ALTER COLUMN external_id SET NOT NULL;
+
+ALTER TABLE scenes
+    ADD COLUMN IF NOT EXISTS external_id TEXT,
+    ADD COLUMN IF NOT EXISTS position INTEGER NOT NULL DEFAULT 0,
+    ADD COLUMN IF NOT EXISTS extra JSONB NOT NULL DEFAULT '{}'::jsonb;
+UPDATE scenes SET external_id = gen_random_uuid()::text, extra = jsonb_strip_nulls(jsonb_build_object('title', title))
+WHERE external_id IS NULL;
+ALTER TABLE scenes ALTER COLUMN external_id SET NOT NULL;
+
+ALTER TABLE dialogues
+    ADD COLUMN IF NOT EXISTS external_id TEXT,
+    ADD COLUMN IF NOT EXISTS position INTEGER NOT NULL DEFAULT 0,
+    ADD COLUMN IF NOT EXISTS data JSONB,
+    ADD COLUMN IF NOT EXISTS extra JSONB NOT NULL DEFAULT '{}'::jsonb;
+ALTER TABLE dialogues ALTER COLUMN data TYPE JSONB USING data::jsonb;
+UPDATE dialogues SET external_id = gen_random_uuid()::text, extra = jsonb_strip_nulls(jsonb_build_object('title', title))
+WHERE external_id IS NULL;
+ALTER TABLE dialogues ALTER COLUMN external_id SET NOT NULL;
+
+DO $$
+BEGIN
+    IF NOT EXISTS (SELECT 1 FROM pg_constraint WHERE conrelid = 'games'::regclass AND conname = 'games_user_id_external_id_key') THEN
+        ALTER TABLE games ADD CONSTRAINT games_user_id_external_id_key UNIQUE (user_id, external_id);
+    END IF;
+    IF NOT EXISTS (SELECT 1 FROM pg_constraint WHERE conrelid = 'scenes'::regclass AND conname = 'scenes_game_id_external_id_key') THEN
+        ALTER TABLE scenes ADD CONSTRAINT scenes_game_id_external_id_key UNIQUE (game_id, external_id);
+    END IF;
+    IF NOT EXISTS (SELECT 1 FROM pg_constraint WHERE conrelid = 'dialogues'::regclass AND conname = 'dialogues_scene_id_external_id_key') THEN
+        ALTER TABLE dialogues ADD CONSTRAINT dialogues_scene_id_external_id_key UNIQUE (scene_id, external_id);
+    END IF;
+END;
+$$;
+
+-- Элементы массива документа с их external_id и позицией. Элемент без id получает '#<номер>',
+-- повторяющиеся id схлопываются в первый по порядку элемент - так же раньше работал поиск сценария по id
+CREATE OR REPLACE FUNCTION content_items(p_items JSONB)
+RETURNS TABLE (external_id TEXT, item_position INTEGER, value JSONB) AS $$
+    SELECT DISTINCT ON (1) COALESCE(e.value ->> 'id', '#' || e.idx), (e.idx - 1)::int, e.value
+    FROM jsonb_array_elements(CASE WHEN jsonb_typeof(p_items) = 'array' THEN p_items ELSE '[]'::jsonb END)
+        WITH ORDINALITY AS e(value, idx)
+    WHERE jsonb_typeof(e.value) = 'object'
+    ORDER BY 1, e.idx;
+$$ LANGUAGE sql IMMUTABLE;
+
+-- Сборка объектов документа из строк: id всегда есть, result добавляется только если сохранён
+CREATE OR REPLACE FUNCTION dialogue_json(p_dialogue_id INTEGER) RETURNS JSONB AS $$
+    SELECT jsonb_build_object('id', d.external_id) || d.extra
+        || CASE WHEN d.data IS NULL THEN '{}'::jsonb ELSE jsonb_build_object('result', d.data) END
+    FROM dialogues d WHERE d.id = p_dialogue_id;
+$$ LANGUAGE sql STABLE;
+
+CREATE OR REPLACE FUNCTION scene_json(p_scene_id INTEGER) RETURNS JSONB AS $$
+    SELECT jsonb_build_object('id', s.external_id) || s.extra || jsonb_build_object('scripts', (
+        SELECT COALESCE(jsonb_agg(dialogue_json(d.id) ORDER BY d.position, d.id), '[]'::jsonb)
+        FROM dialogues d WHERE d.scene_id = s.id
+    ))
+    FROM scenes s WHERE s.id = p_scene_id;
+$$ LANGUAGE sql STABLE;
+
+CREATE OR REPLACE FUNCTION game_json(p_game_id INTEGER) RETURNS JSONB AS $$
+    SELECT jsonb_build_object('id', g.external_id) || g.extra || jsonb_build_object('scenes', (
+        SELECT COALESCE(jsonb_agg(scene_json(s.id) ORDER BY s.position, s.id), '[]'::jsonb)
+        FROM scenes s WHERE s.game_id = g.id
+    ))
+    FROM games g WHERE g.id = p_game_id;
+$$ LANGUAGE sql STABLE;
+
+CREATE OR REPLACE FUNCTION user_games(p_user_id INTEGER) RETURNS JSONB AS $$
+    SELECT COALESCE(jsonb_agg(game_json(g.id) ORDER BY g.position, g.id), '[]'::jsonb)
+    FROM games g WHERE g.user_id = p_user_id;
+$$ LANGUAGE sql STABLE;
+
+-- Запись массивов документа в строки: лишние удаляются, остальные обновляются по external_id.
+-- Сохранённый result не перезаписывается клиентом (как раньше в PUT /users/me/upd/data),
+-- для нового сценария берётся присланный
+CREATE OR REPLACE FUNCTION sync_scene_dialogues(p_scene_id INTEGER, p_scripts JSONB) RETURNS VOID AS $$
+BEGIN
+    DELETE FROM dialogues d
+    WHERE d.scene_id = p_scene_id AND d.external_id NOT IN (SELECT i.external_id FROM content_items(p_scripts) i);
+
+    INSERT INTO dialogues (scene_id, external_id, position, title, data, extra)
+    SELECT p_scene_id, i.external_id, i.item_position, COALESCE(i.value ->> 'title', i.value ->> 'name'),
+        i.value -> 'result', i.value - 'result'
+    FROM content_items(p_scripts) i
+    ON CONFLICT (scene_id, external_id) DO UPDATE
+    SET position = EXCLUDED.position, title = EXCLUDED.title, extra = EXCLUDED.extra,
+        data = COALESCE(dialogues.data, EXCLUDED.data);
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION sync_game_scenes(p_game_id INTEGER, p_scenes JSONB) RETURNS VOID AS $$
+DECLARE
+    item RECORD;
+BEGIN
+    DELETE FROM scenes s
+    WHERE s.game_id = p_game_id AND s.external_id NOT IN (SELECT i.external_id FROM content_items(p_scenes) i);
+
+    FOR item IN
+        INSERT INTO scenes (game_id, external_id, position, title, extra)
+        SELECT p_game_id, i.external_id, i.item_position, COALESCE(i.value ->> 'title', i.value ->> 'name'), i.value - 'scripts'
+        FROM content_items(p_scenes) i
+        ON CONFLICT (game_id, external_id) DO UPDATE
+        SET position = EXCLUDED.position, title = EXCLUDED.title, extra = EXCLUDED.extra
+        RETURNING scenes.id, scenes.external_id
+    LOOP
+        PERFORM sync_scene_dialogues(item.id, (SELECT i.value -> 'scripts' FROM content_items(p_scenes) i WHERE i.external_id = item.external_id));
+    END LOOP;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION sync_user_games(p_user_id INTEGER, p_games JSONB) RETURNS VOID AS $$
+DECLARE
+    item RECORD;
+BEGIN
+    DELETE FROM games g
+    WHERE g.user_id = p_user_id AND g.external_id NOT IN (SELECT i.external_id FROM content_items(p_games) i);
+
+    FOR item IN
+        INSERT INTO games (user_id, external_id, position, title, technology_level, magic, extra)
+        SELECT p_user_id, i.external_id, i.item_position, COALESCE(i.value ->> 'title', i.value ->> 'name'),
+            i.value ->> 'technology_level', i.value ->> 'magic', i.value - 'scenes'
+        FROM content_items(p_games) i
+        ON CONFLICT (user_id, external_id) DO UPDATE
+        SET position = EXCLUDED.position, title = EXCLUDED.title, technology_level = EXCLUDED.technology_level,
+            magic = EXCLUDED.magic, extra = EXCLUDED.extra
+        RETURNING games.id, games.external_id
+    LOOP
+        PERFORM sync_game_scenes(item.id, (SELECT i.value -> 'scenes' FROM content_items(p_games) i WHERE i.external_id = item.external_id));
+    END LOOP;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Перенос существующих документов. Строки, созданные прежним CRUD-слоем, идут в начало списка:
+-- синхронизация удаляет всё, чего нет в массиве, а в документе их нет
+SELECT sync_user_games(id, user_games(id) || CASE WHEN jsonb_typeof(data -> 'games') = 'array' THEN data -> 'games' ELSE '[]'::jsonb END)
+FROM users_data WHERE data ? 'games';
+
+UPDATE users_data SET data = data - 'games' WHERE data ? 'games';
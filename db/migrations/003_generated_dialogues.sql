@@ -0,0 +1,71 @@
+-- Сгенерированные графы диалогов хранятся отдельно от сценариев и не входят в документ /users/me/data:
+-- в сценарии остаётся только сводка generated (число вершин, размер, время), сам граф отдаётся отдельной ручкой
+CREATE TABLE IF NOT EXISTS generated_dialogues (
+    dialogue_id INTEGER PRIMARY KEY REFERENCES dialogues (id) ON DELETE CASCADE,
+    graph JSONB NOT NULL,
+    node_count INTEGER NOT NULL DEFAULT 0,
+    size INTEGER NOT NULL DEFAULT 0,
+    created_at TIMESTAMPTZ NOT NULL DEFAULT now()
+);
+
+-- Граф сжимается TOAST уже от 256 байт строки (по умолчанию ~2 КБ), lz4 - если сервер собран с ним
+ALTER TABLE generated_dialogues SET (toast_tuple_target = 256);
+DO $$
+BEGIN
+    EXECUTE 'ALTER TABLE generated_dialogues ALTER COLUMN graph SET COMPRESSION lz4';
+EXCEPTION WHEN OTHERS THEN
+    RAISE NOTICE 'lz4 is not available, generated_dialogues.graph uses default compression';
+END;
+$$;
+
+-- p_replace = false - не перезаписывать уже сохранённый граф (документ от клиента),
+-- true - новый результат генерации
+CREATE OR REPLACE FUNCTION save_generated_dialogue(p_dialogue_id INTEGER, p_graph JSONB, p_replace BOOLEAN) RETURNS VOID AS $$
+BEGIN
+    IF p_graph IS NULL OR jsonb_typeof(p_graph) = 'null' THEN
+        RETURN;
+    END IF;
+    INSERT INTO generated_dialogues (dialogue_id, graph, node_count, size)
+    VALUES (
+        p_dialogue_id, p_graph,
+        CASE WHEN jsonb_typeof(p_graph -> 'data') = 'array' THEN jsonb_array_length(p_graph -> 'data') ELSE 0 END,
+        octet_length(p_graph::text)
+    )
+    ON CONFLICT (dialogue_id) DO UPDATE
+    SET graph = EXCLUDED.graph, node_count = EXCLUDED.node_count, size = EXCLUDED.size, created_at = now()
+    WHERE p_replace;
+END;
+$$ LANGUAGE plpgsql;
+
+SELECT save_generated_dialogue(id, data, false) FROM dialogues WHERE data IS NOT NULL;
+
+CREATE OR REPLACE FUNCTION dialogue_json(p_dialogue_id INTEGER) RETURNS JSONB AS $$
+    SELECT jsonb_build_object('id', d.external_id) || d.extra
+        || CASE WHEN gd.dialogue_id IS NULL THEN '{}'::jsonb ELSE jsonb_build_object('generated', jsonb_build_object(
+            'nodes', gd.node_count, 'size', gd.size, 'generated_at', gd.created_at
+        )) END
+    FROM dialogues d LEFT JOIN generated_dialogues gd ON gd.dialogue_id = d.id
+    WHERE d.id = p_dialogue_id;
+$$ LANGUAGE sql STABLE;
+
+-- result из документа сохраняется только для сценария без графа; generated - вычисляемая сводка, не хранится
+CREATE OR REPLACE FUNCTION sync_scene_dialogues(p_scene_id INTEGER, p_scripts JSONB) RETURNS VOID AS $$
+BEGIN
+    DELETE FROM dialogues d
+    WHERE d.scene_id = p_scene_id AND d.external_id NOT IN (SELECT i.external_id FROM content_items(p_scripts) i);
+
+    INSERT INTO dialogues (scene_id, external_id, position, title, extra)
+    SELECT p_scene_id, i.external_id, i.item_position, COALESCE(i.value ->> 'title', i.value ->> 'name'),
+        i.value - 'result' - 'generated'
+    FROM content_items(p_scripts) i
+    ON CONFLICT (scene_id, external_id) DO UPDATE
+    SET position = EXCLUDED.position, title = EXCLUDED.title, extra = EXCLUDED.extra;
+
+    PERFORM save_generated_dialogue(d.id, i.value -> 'result', false)
+    FROM content_items(p_scripts) i
+    JOIN dialogues d ON d.scene_id = p_scene_id AND d.external_id = i.external_id
+    WHERE i.value ? 'result';
+END;
+$$ LANGUAGE plpgsql;
+
+ALTER TABLE dialogues DROP COLUMN IF EXISTS data;
@@ -0,0 +1,8 @@
+-- Версия документа пользователя для ETag /users/me/data: увеличивается при каждой записи в users_data
+-- и в его игры, сцены и сценарии. Сравнение версии не читает колонку data
+ALTER TABLE users_data ADD COLUMN IF NOT EXISTS version BIGINT NOT NULL DEFAULT 1;
+ALTER TABLE users_data ADD COLUMN IF NOT EXISTS updated_at TIMESTAMPTZ NOT NULL DEFAULT now();
+
+CREATE OR REPLACE FUNCTION touch_user_data(p_user_id INTEGER) RETURNS BIGINT AS $$
+    UPDATE users_data SET version = version + 1, updated_at = now() WHERE id = p_user_id RETURNING version;
+$$ LANGUAGE sql;
@@ -0,0 +1,35 @@
+-- Индексы под поиски CRUD-слоя. games.user_id, scenes.game_id, dialogues.scene_id уже покрыты
+-- уникальными (parent_id, external_id), characters.game_id - characters_game_id_idx (002).
+-- Список ожидаемых индексов - REQUIRED_INDEXES в db/migrate.py, проверяется при старте
+
+-- Регистрация и вход ищут пользователя по mail, восстановление удалённого обновляет строку по mail:
+-- почта должна быть уникальной. Прежняя регистрация вставляла вторую строку для почты удалённого
+-- пользователя: удалённые дубликаты переименовываются в mail#deleted-id, восстанавливаться будет
+-- живая строка, а если живой нет - последняя удалённая. Несколько живых строк с одной почтой
+-- автоматически не сливаются - их нужно разобрать вручную
+UPDATE users_data u
+SET mail = u.mail || '#deleted-' || u.id
+FROM (
+    SELECT mail, max(id) FILTER (WHERE is_deleted IS NOT TRUE) AS live_id, max(id) AS last_id
+    FROM users_data GROUP BY mail HAVING count(*) > 1
+) d
+WHERE u.mail = d.mail AND u.is_deleted AND u.id <> coalesce(d.live_id, d.last_id);
+
+DO $$
+DECLARE
+    duplicates TEXT;
+BEGIN
+    SELECT string_agg(mail || ' (id ' || ids || ')', ', ') INTO duplicates
+    FROM (
+        SELECT mail, string_agg(id::text, ', ' ORDER BY id) AS ids
+        FROM users_data GROUP BY mail HAVING count(*) > 1
+    ) d;
+    IF duplicates IS NOT NULL THEN
+        RAISE EXCEPTION 'users_data.mail is not unique, resolve duplicate live users before migrating: %', duplicates;
+    END IF;
+END;
+$$;
+CREATE UNIQUE INDEX IF NOT EXISTS users_data_mail_key ON users_data (mail);
+
+CREATE INDEX IF NOT EXISTS games_title_idx ON games (title);
+CREATE INDEX IF NOT EXISTS characters_dialogue_id_idx ON characters (dialogue_id);
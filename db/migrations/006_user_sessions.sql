@@ -0,0 +1,17 @@
+-- Сессии refresh-токенов: одна строка на вход с устройства. Сам токен не хранится - только sha256.
+-- При обновлении токен ротируется: token_hash заменяется новым, прежний остаётся в previous_token_hash,
+-- чтобы повторное предъявление уже использованного токена (кража) отзывало всю сессию
+CREATE TABLE IF NOT EXISTS user_sessions (
+    id BIGSERIAL PRIMARY KEY,
+    user_id INTEGER NOT NULL REFERENCES users_data (id) ON DELETE CASCADE,
+    token_hash BYTEA NOT NULL,
+    previous_token_hash BYTEA,
+    created_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+    rotated_at TIMESTAMPTZ,
+    expires_at TIMESTAMPTZ NOT NULL,
+    revoked_at TIMESTAMPTZ
+);
+
+CREATE UNIQUE INDEX IF NOT EXISTS user_sessions_token_hash_key ON user_sessions (token_hash);
+CREATE INDEX IF NOT EXISTS user_sessions_previous_token_hash_idx ON user_sessions (previous_token_hash);
+CREATE INDEX IF NOT EXISTS user_sessions_user_id_idx ON user_sessions (user_id);
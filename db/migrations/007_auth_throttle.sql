@@ -0,0 +1,9 @@
+-- Счётчики попыток входа и регистрации для THROTTLE_BACKEND=postgres: общий лимит для всех экземпляров.
+-- UNLOGGED - без WAL: после сбоя счётчики обнулятся, зато upsert на каждую попытку дешёвый.
+-- key - действие, область (account/ip) и хэш значения; window_index - номер окна THROTTLE_WINDOW
+CREATE UNLOGGED TABLE IF NOT EXISTS auth_throttle (
+    key TEXT NOT NULL,
+    window_index BIGINT NOT NULL,
+    hits INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (key, window_index)
+);
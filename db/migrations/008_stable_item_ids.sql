@@ -0,0 +1,91 @@
+-- Элемент без id получал external_id '#<номер в массиве>', и этот id возвращался в документе. Вставка или
+-- перестановка сдвигала номера, и ON CONFLICT отдавал строку (вместе с графом generated_dialogues) другому
+-- элементу. Теперь такой элемент один раз получает uuid, записанный в сам объект: дальше это обычный id.
+-- Уже выданные '#N' остаются как есть - клиенты хранят их как id объектов
+CREATE OR REPLACE FUNCTION with_item_ids(p_items JSONB) RETURNS JSONB AS $$
+    SELECT COALESCE(jsonb_agg(
+        CASE WHEN jsonb_typeof(e.value) = 'object' AND e.value ->> 'id' IS NULL
+            THEN e.value || jsonb_build_object('id', gen_random_uuid()::text) ELSE e.value END
+        ORDER BY e.idx
+    ), '[]'::jsonb)
+    FROM jsonb_array_elements(CASE WHEN jsonb_typeof(p_items) = 'array' THEN p_items ELSE '[]'::jsonb END)
+        WITH ORDINALITY AS e(value, idx);
+$$ LANGUAGE sql VOLATILE;
+
+-- Повторяющиеся id по-прежнему схлопываются в первый по порядку элемент
+CREATE OR REPLACE FUNCTION content_items(p_items JSONB)
+RETURNS TABLE (external_id TEXT, item_position INTEGER, value JSONB) AS $$
+    SELECT DISTINCT ON (1) e.value ->> 'id', (e.idx - 1)::int, e.value
+    FROM jsonb_array_elements(CASE WHEN jsonb_typeof(p_items) = 'array' THEN p_items ELSE '[]'::jsonb END)
+        WITH ORDINALITY AS e(value, idx)
+    WHERE jsonb_typeof(e.value) = 'object' AND e.value ->> 'id' IS NOT NULL
+    ORDER BY 1, e.idx;
+$$ LANGUAGE sql IMMUTABLE;
+
+-- Синхронизация та же, что в 002/003; id выдаются один раз в начале, до всех чтений content_items
+CREATE OR REPLACE FUNCTION sync_scene_dialogues(p_scene_id INTEGER, p_scripts JSONB) RETURNS VOID AS $$
+BEGIN
+    p_scripts := with_item_ids(p_scripts);
+
+    DELETE FROM dialogues d
+    WHERE d.scene_id = p_scene_id AND d.external_id NOT IN (SELECT i.external_id FROM content_items(p_scripts) i);
+
+    INSERT INTO dialogues (scene_id, external_id, position, title, extra)
+    SELECT p_scene_id, i.external_id, i.item_position, COALESCE(i.value ->> 'title', i.value ->> 'name'),
+        i.value - 'result' - 'generated'
+    FROM content_items(p_scripts) i
+    ON CONFLICT (scene_id, external_id) DO UPDATE
+    SET position = EXCLUDED.position, title = EXCLUDED.title, extra = EXCLUDED.extra;
+
+    PERFORM save_generated_dialogue(d.id, i.value -> 'result', false)
+    FROM content_items(p_scripts) i
+    JOIN dialogues d ON d.scene_id = p_scene_id AND d.external_id = i.external_id
+    WHERE i.value ? 'result';
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION sync_game_scenes(p_game_id INTEGER, p_scenes JSONB) RETURNS VOID AS $$
+DECLARE
+    item RECORD;
+BEGIN
+    p_scenes := with_item_ids(p_scenes);
+
+    DELETE FROM scenes s
+    WHERE s.game_id = p_game_id AND s.external_id NOT IN (SELECT i.external_id FROM content_items(p_scenes) i);
+
+    FOR item IN
+        INSERT INTO scenes (game_id, external_id, position, title, extra)
+        SELECT p_game_id, i.external_id, i.item_position, COALESCE(i.value ->> 'title', i.value ->> 'name'), i.value - 'scripts'
+        FROM content_items(p_scenes) i
+        ON CONFLICT (game_id, external_id) DO UPDATE
+        SET position = EXCLUDED.position, title = EXCLUDED.title, extra = EXCLUDED.extra
+        RETURNING scenes.id, scenes.external_id
+    LOOP
+        PERFORM sync_scene_dialogues(item.id, (SELECT i.value -> 'scripts' FROM content_items(p_scenes) i WHERE i.external_id = item.external_id));
+    END LOOP;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION sync_user_games(p_user_id INTEGER, p_games JSONB) RETURNS VOID AS $$
+DECLARE
+    item RECORD;
+BEGIN
+    p_games := with_item_ids(p_games);
+
+    DELETE FROM games g
+    WHERE g.user_id = p_user_id AND g.external_id NOT IN (SELECT i.external_id FROM content_items(p_games) i);
+
+    FOR item IN
+        INSERT INTO games (user_id, external_id, position, title, technology_level, magic, extra)
+        SELECT p_user_id, i.external_id, i.item_position, COALESCE(i.value ->> 'title', i.value ->> 'name'),
+            i.value ->> 'technology_level', i.value ->> 'magic', i.value - 'scenes'
+        FROM content_items(p_games) i
+        ON CONFLICT (user_id, external_id) DO UPDATE
+        SET position = EXCLUDED.position, title = EXCLUDED.title, technology_level = EXCLUDED.technology_level,
+            magic = EXCLUDED.magic, extra = EXCLUDED.extra
+        RETURNING games.id, games.external_id
+    LOOP
+        PERFORM sync_game_scenes(item.id, (SELECT i.value -> 'scenes' FROM content_items(p_games) i WHERE i.external_id = item.external_id));
+    END LOOP;
+END;
+$$ LANGUAGE plpgsql;
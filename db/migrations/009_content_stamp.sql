@@ -0,0 +1,26 @@
+-- ETag /users/me/data без общей точки записи: users_data.version меняется только при записи самого документа
+-- (PUT, PATCH, имя, пароль), а игры, сцены, сценарии и графы учитываются при чтении - по id и xmin их строк.
+-- xmin меняется при каждом UPDATE строки, удаление убирает строку из хэша, поэтому CRUD-записи
+-- больше не блокируют строку пользователя и не выстраиваются за ней в очередь
+CREATE OR REPLACE FUNCTION user_content_stamp(p_user_id INTEGER) RETURNS TEXT AS $$
+    SELECT left(md5(COALESCE(string_agg(t.tag, ',' ORDER BY t.tag), '')), 16)
+    FROM (
+        SELECT 'g' || g.id || ':' || g.xmin AS tag
+        FROM games g WHERE g.user_id = p_user_id
+        UNION ALL
+        SELECT 's' || s.id || ':' || s.xmin
+        FROM games g JOIN scenes s ON s.game_id = g.id WHERE g.user_id = p_user_id
+        UNION ALL
+        SELECT 'd' || d.id || ':' || d.xmin || ':' || COALESCE(gd.xmin::text, '')
+        FROM games g JOIN scenes s ON s.game_id = g.id JOIN dialogues d ON d.scene_id = s.id
+        LEFT JOIN generated_dialogues gd ON gd.dialogue_id = d.id
+        WHERE g.user_id = p_user_id
+    ) t;
+$$ LANGUAGE sql STABLE;
+
+-- Версия документа для ETag: "<users_data.version>.<user_content_stamp>"
+CREATE OR REPLACE FUNCTION user_data_version(p_user_id INTEGER, p_version BIGINT) RETURNS TEXT AS $$
+    SELECT p_version || '.' || user_content_stamp(p_user_id);
+$$ LANGUAGE sql STABLE;
+
+DROP FUNCTION IF EXISTS touch_user_data(INTEGER);
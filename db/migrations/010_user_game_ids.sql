@@ -0,0 +1,13 @@
+-- id игр, сцен и сценариев в порядке документа, без остального содержимого: PUT и PATCH /users/me/data
+-- возвращают их, чтобы клиент сохранил uuid, выданные with_item_ids элементам без id. Иначе повторное
+-- сохранение того же документа выдало бы новые uuid и пересоздало строки вместе с графами
+CREATE OR REPLACE FUNCTION user_game_ids(p_user_id INTEGER) RETURNS JSONB AS $$
+    SELECT COALESCE(jsonb_agg(jsonb_build_object('id', g.external_id, 'scenes', (
+        SELECT COALESCE(jsonb_agg(jsonb_build_object('id', s.external_id, 'scripts', (
+            SELECT COALESCE(jsonb_agg(jsonb_build_object('id', d.external_id) ORDER BY d.position, d.id), '[]'::jsonb)
+            FROM dialogues d WHERE d.scene_id = s.id
+        )) ORDER BY s.position, s.id), '[]'::jsonb)
+        FROM scenes s WHERE s.game_id = g.id
+    )) ORDER BY g.position, g.id), '[]'::jsonb)
+    FROM games g WHERE g.user_id = p_user_id;
+$$ LANGUAGE sql STABLE;
@@ -0,0 +1,22 @@
+-- Задачи генерации: состояние общее для всех воркеров uvicorn и переживает перезапуск.
+-- Сам граф не хранится - он уже записан в generated_dialogues сценария (game_id/scene_id/script_id).
+-- worker - процесс, который выполняет задачу; он обновляет heartbeat_at, пока задача в очереди или идёт,
+-- задача с давно не обновлявшимся heartbeat_at считается прерванной (процесс остановлен или упал)
+CREATE TABLE IF NOT EXISTS generation_jobs (
+    id TEXT PRIMARY KEY,
+    user_id INTEGER NOT NULL REFERENCES users_data (id) ON DELETE CASCADE,
+    game_id TEXT NOT NULL,
+    scene_id TEXT NOT NULL,
+    script_id TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'queued',
+    worker TEXT NOT NULL,
+    created_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+    started_at TIMESTAMPTZ,
+    finished_at TIMESTAMPTZ,
+    heartbeat_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+    error TEXT,
+    metrics JSONB
+);
+
+CREATE INDEX IF NOT EXISTS generation_jobs_finished_at_idx ON generation_jobs (finished_at);
+CREATE INDEX IF NOT EXISTS generation_jobs_worker_idx ON generation_jobs (worker) WHERE finished_at IS NULL;
@@ -3,8 +3,24 @@ import psycopg2
 from psycopg2.extras import RealDictCursor
 from db.database import DatabasePool
 from db.logging import logger
+from db.json_patch import PatchQuery
+from db.db_CRUD.games_db import Games
 import json 
 
+# Колонки выборок пользователя: документ data и password_hash читаются только теми, кому они нужны
+USER_COLUMNS = ("id", "mail", "name", "surname", "password_hash", "is_deleted", "data")
+USER_PROFILE_COLUMNS = ("id", "mail", "name", "surname")
+USER_LOGIN_COLUMNS = USER_PROFILE_COLUMNS + ("password_hash",)
+
+
+def select_columns(columns):
+    # Имена колонок подставляются в текст запроса, поэтому только из USER_COLUMNS
+    unknown = set(columns) - set(USER_COLUMNS)
+    if unknown:
+        raise ValueError(f"Unknown users_data columns: {sorted(unknown)}")
+    return ", ".join(columns)
+
+
 class Users:
     def __init__(self, db_conn):
         self.db_conn = db_conn
@@ -29,19 +45,18 @@ class Users:
             }
         try:
             with self.db_conn.cursor(cursor_factory=RealDictCursor) as curs:
-                if not isinstance(data, str):
-                    data_json = json.dumps(data)
-                else:
-                    data_json = data
+                if isinstance(data, str):
+                    data = json.loads(data)
                 curs.execute(
                     """
                     INSERT INTO users_data (mail, name, surname, password_hash, is_deleted, data)
-                    VALUES (%s, %s, %s, %s, %s, %s)
+                    VALUES (%s, %s, %s, %s, %s, %s::jsonb - 'games')
                     RETURNING id;
                     """,
-                    (mail, name, surname, password_hash, is_deleted, data_json)
+                    (mail, name, surname, password_hash, is_deleted, json.dumps(data))
                 )
                 user_id = curs.fetchone().get("id")
+                Games(self.db_conn).sync_user_games(user_id, data.get("games", []))
                 print(f"The user has been created: {user_id} ({mail}, {name})", end="\n\n======\n\n")
                 self.db_conn.commit()
                 logger.info(f"The user has been created: {user_id} ({name})")
@@ -53,40 +68,30 @@ class Users:
                 self.db_conn.rollback()
             return None
 
-    def get_user_by_mail(self, mail: EmailStr):
+    def get_user_by_mail(self, mail: EmailStr, columns=USER_LOGIN_COLUMNS, include_deleted=False):
+        # Удалённый пользователь возвращается только с include_deleted (регистрация восстанавливает его по mail)
         try:
             with self.db_conn.cursor(cursor_factory=RealDictCursor) as curs:
-                curs.execute("SELECT * FROM users_data WHERE mail = %s;", (mail,))
+                deleted_filter = "" if include_deleted else " AND NOT is_deleted"
+                curs.execute(f"SELECT {select_columns(columns)} FROM users_data WHERE mail = %s{deleted_filter};", (mail,))
                 user = curs.fetchone()
                 logger.info(f"Received user by mail: {mail}")
                 print(f"Received user by mail: {mail}", user, sep = "\n", end="\n\n======\n\n")
-                if not user or user.get('is_deleted'):
-                    return None
                 return user
         except Exception as e:
             logger.error(f"Error when receiving user by mail {mail}: {e}")
             print(f"Error when receiving user by mail {mail}: {e}", end="\n\n======\n\n")
             return None
 
-    def get_user_by_id(self, user_id: int):
-        try:
-            with self.db_conn.cursor(cursor_factory=RealDictCursor) as curs:
-                curs.execute("SELECT * FROM users_data WHERE id = %s;", (user_id,))
-                user = curs.fetchone()
-                logger.info(f"Received user by id: {user_id}")
-                print(f"Received user by id: {user_id}", user, sep = "\n", end="\n\n======\n\n")
-                if not user or user.get('is_deleted'):
-                    return None
-                return user
-        except Exception as e:
-            logger.error(f"Error when receiving user by id {user_id}: {e}")
-            print(f"Error when receiving user by id {user_id}: {e}", end="\n\n======\n\n")
-            return None
-
     def get_user_data(self, user_id: int):
         try:
             with self.db_conn.cursor(cursor_factory=RealDictCursor) as curs:
-                curs.execute("SELECT data FROM users_data WHERE id = %s;", (user_id,))
+                # games хранятся в таблицах games/scenes/dialogues и собираются в документ при чтении.
+                # None - пользователя нет или он удалён, отдельная проверка существования не нужна
+                curs.execute(
+                    "SELECT data || jsonb_build_object('games', user_games(id)) AS data FROM users_data WHERE id = %s AND NOT is_deleted;",
+                    (user_id,)
+                )
                 row = curs.fetchone()
                 logger.info(f"Received data for user {user_id}")
                 print(f"Received data for user: {user_id}", row.get("data") if row else None, sep = "\n", end="\n\n======\n\n")
@@ -96,66 +101,220 @@ class Users:
             print(f"Error when receiving data for user {user_id}: {e}", end="\n\n======\n\n")
             return None
 
-    def update_user_data(self, user_id: int, new_data: dict):
+    def get_data_version(self, curs, user_id: int):
+        # Версия для ETag после записи: отпечаток строк игр виден только следующему запросу той же транзакции
+        curs.execute("SELECT user_data_version(id, version) AS version FROM users_data WHERE id = %s;", (user_id,))
+        return curs.fetchone()["version"]
+
+    def get_game_ids(self, curs, user_id: int):
+        # id игр, сцен и сценариев после записи, включая выданные элементам без id
+        curs.execute("SELECT user_game_ids(%s) AS ids;", (user_id,))
+        return curs.fetchone()["ids"]
+
+    def update_user_data(self, user_id: int, new_data: dict, expected_versions=None):
+        # expected_versions - версии из If-Match (None - без проверки): документ пишется, только если текущая среди них.
+        # None - ошибка, иначе user (найден ли), updated (записан ли), version (новая или текущая версия)
+        # и ids - id игр, сцен и сценариев после записи
         try:
             with self.db_conn.cursor(cursor_factory=RealDictCursor) as curs:
                 curs.execute(
-                    "UPDATE users_data SET data = %s WHERE id = %s;",
-                    (json.dumps(new_data), user_id)
+                    """
+                    WITH cur AS (
+                        SELECT id, user_data_version(id, version) AS version FROM users_data WHERE id = %(user_id)s AND NOT is_deleted
+                    ),
+                    updated AS (
+                        UPDATE users_data u SET data = %(data)s::jsonb - 'games', version = u.version + 1, updated_at = now()
+                        FROM cur
+                        WHERE u.id = cur.id AND (%(expected)s::text[] IS NULL OR cur.version = ANY(%(expected)s::text[]))
+                        RETURNING u.id
+                    )
+                    SELECT cur.version AS current_version, EXISTS (SELECT 1 FROM updated) AS updated FROM cur;
+                    """,
+                    {"user_id": user_id, "data": json.dumps(new_data), "expected": expected_versions}
                 )
+                row = curs.fetchone()
+                if not row or not row["updated"]:
+                    self.db_conn.rollback()
+                    return {"user": bool(row), "updated": False, "version": row["current_version"] if row else None}
+                Games(self.db_conn).sync_user_games(user_id, new_data.get("games", []))
+                version = self.get_data_version(curs, user_id)
+                ids = self.get_game_ids(curs, user_id)
                 self.db_conn.commit()
-                logger.info(f"Updated data for user {user_id}")
+                logger.info(f"Updated data for user {user_id}, version {version}")
                 print(f"Updated data for user: {user_id}", new_data, sep = "\n", end="\n\n======\n\n")
-                return True
+                return {"user": True, "updated": True, "version": version, "ids": ids}
         except Exception as e:
             logger.error(f"Error updating data for user {user_id}: {e}")
             print(f"Error updating data for user {user_id}: {e}", end="\n\n======\n\n")
             self.db_conn.rollback()
-            return False 
+            return None
+
+    def get_script_target(self, user_id: int, game_id, scene_id, script_id):
+        # Та же выборка, что в set_script_result, без записи: проверка сценария до запуска генерации.
+        # Возвращает None при ошибке, иначе id найденных строк game/scene/script (None - не найден)
+        try:
+            with self.db_conn.cursor(cursor_factory=RealDictCursor) as curs:
+                curs.execute(
+                    """
+                    SELECT g.id AS game_id, s.id AS scene_id, d.id AS script_id
+                    FROM users_data u
+                    LEFT JOIN games g ON g.user_id = u.id AND g.external_id = %(game_id)s
+                    LEFT JOIN scenes s ON s.game_id = g.id AND s.external_id = %(scene_id)s
+                    LEFT JOIN dialogues d ON d.scene_id = s.id AND d.external_id = %(script_id)s
+                    WHERE u.id = %(user_id)s AND NOT u.is_deleted;
+                    """,
+                    {"user_id": user_id, "game_id": str(game_id), "scene_id": str(scene_id), "script_id": str(script_id)}
+                )
+                row = curs.fetchone()
+                logger.info(f"Checked script {game_id}/{scene_id}/{script_id} for user {user_id}")
+                if not row:
+                    return {"user": False, "game_id": None, "scene_id": None, "script_id": None}
+                return {"user": True, **row}
+        except Exception as e:
+            logger.error(f"Error checking script {game_id}/{scene_id}/{script_id} for user {user_id}: {e}")
+            print(f"Error checking script for user {user_id}: {e}", end="\n\n======\n\n")
+            return None
+
+    def set_script_result(self, user_id: int, game_id, scene_id, script_id, result):
+        # Пишет граф одного сценария в generated_dialogues: документ пользователя и соседние сценарии
+        # не читаются и не перезаписываются, строка users_data не блокируется: сводка generated в документе
+        # меняет ETag через user_content_stamp.
+        # Возвращает None при ошибке, иначе id найденных строк game/scene/script (None - не найден)
+        try:
+            with self.db_conn.cursor(cursor_factory=RealDictCursor) as curs:
+                curs.execute(
+                    """
+                    WITH target AS (
+                        SELECT g.id AS game_id, s.id AS scene_id, d.id AS script_id
+                        FROM users_data u
+                        LEFT JOIN games g ON g.user_id = u.id AND g.external_id = %(game_id)s
+                        LEFT JOIN scenes s ON s.game_id = g.id AND s.external_id = %(scene_id)s
+                        LEFT JOIN dialogues d ON d.scene_id = s.id AND d.external_id = %(script_id)s
+                        WHERE u.id = %(user_id)s AND NOT u.is_deleted
+                    ),
+                    updated AS (
+                        SELECT save_generated_dialogue(t.script_id, %(result)s::jsonb, true)
+                        FROM target t
+                        WHERE t.script_id IS NOT NULL
+                    )
+                    SELECT t.game_id, t.scene_id, t.script_id, EXISTS (SELECT 1 FROM updated) AS updated
+                    FROM target t;
+                    """,
+                    {
+                        "user_id": user_id,
+                        "game_id": str(game_id),
+                        "scene_id": str(scene_id),
+                        "script_id": str(script_id),
+                        "result": json.dumps(result)
+                    }
+                )
+                row = curs.fetchone()
+                self.db_conn.commit()
+                if not row:
+                    logger.info(f"Script result not saved, user {user_id} not found")
+                    return {"user": False, "game_id": None, "scene_id": None, "script_id": None, "updated": False}
+                logger.info(f"Script result for user {user_id} ({game_id}/{scene_id}/{script_id}) updated: {row['updated']}")
+                print(f"Updated script result for user: {user_id}", f"{game_id}/{scene_id}/{script_id}", row["updated"], sep = "\n", end="\n\n======\n\n")
+                return {"user": True, **row}
+        except Exception as e:
+            logger.error(f"Error updating script result for user {user_id}: {e}")
+            print(f"Error updating script result for user {user_id}: {e}", end="\n\n======\n\n")
+            self.db_conn.rollback()
+            return None
+
+    def patch_user_data(self, user_id: int, steps: list, expected_versions=None):
+        # Шаги из db.json_patch применяются одним запросом к заблокированной строке, документ не покидает Postgres.
+        # Если патч затрагивает games, документ собирается из таблиц и раскладывается обратно тем же запросом.
+        # Возвращает None при ошибке, иначе совпала ли версия из If-Match (matched), номер первой невыполненной
+        # операции (failed), признак записи, версию документа после запроса и ids, если записаны games
+        try:
+            query, params = PatchQuery().build(user_id, steps, expected_versions)
+            with self.db_conn.cursor(cursor_factory=RealDictCursor) as curs:
+                curs.execute(query, params)
+                row = curs.fetchone()
+                if row and row["updated"]:
+                    row["version"] = self.get_data_version(curs, user_id)
+                    row["ids"] = self.get_game_ids(curs, user_id) if row["synced"] else None
+                self.db_conn.commit()
+                if not row:
+                    return {"user": False, "matched": False, "failed": None, "updated": False, "version": None}
+                logger.info(f"Patched data for user {user_id}: {len(steps)} operations, failed: {row['failed']}")
+                print(f"Patched data for user: {user_id}", f"operations: {len(steps)}, failed: {row['failed']}", sep = "\n", end="\n\n======\n\n")
+                return {"user": True, **row}
+        except Exception as e:
+            logger.error(f"Error patching data for user {user_id}: {e}")
+            print(f"Error patching data for user {user_id}: {e}", end="\n\n======\n\n")
+            self.db_conn.rollback()
+            return None
 
     def update_user_name(self, user_id: int, new_name: str, new_surname: str):
+        # Как и update_user_password/delete_user: проверка пользователя и запись одним запросом.
+        # True - обновлено, False - пользователя нет или он удалён, None - ошибка
         try:
             with self.db_conn.cursor(cursor_factory=RealDictCursor) as curs:
                 curs.execute(
-                    "UPDATE users_data SET name = %s, surname = %s WHERE id = %s;",
+                    "UPDATE users_data SET name = %s, surname = %s, version = version + 1, updated_at = now() WHERE id = %s AND NOT is_deleted RETURNING id;",
                     (new_name, new_surname, user_id)
                 )
+                updated = curs.fetchone() is not None
                 self.db_conn.commit()
                 logger.info(f"User name {user_id} updated ")
                 print(f"Updated name for user: {user_id}", new_name, sep = "\n", end="\n\n======\n\n")
-                return True
+                return updated
         except Exception as e:
             logger.error(f"Error updating user name {user_id}: {e}")
             print(f"Error updating name for user {user_id}: {e}", end="\n\n======\n\n")
             self.db_conn.rollback()
-            return False
+            return None
 
     def update_user_password(self, user_id: int, new_pass: str):
         try:
             with self.db_conn.cursor(cursor_factory=RealDictCursor) as curs:
+                # Смена пароля отзывает все refresh-сессии: войти снова можно только с новым паролем
                 curs.execute(
-                    "UPDATE users_data SET password_hash = %s WHERE id = %s;",
+                    """
+                    WITH updated AS (
+                        UPDATE users_data SET password_hash = %s, version = version + 1, updated_at = now()
+                        WHERE id = %s AND NOT is_deleted RETURNING id
+                    ), revoked AS (
+                        UPDATE user_sessions SET revoked_at = now() WHERE user_id IN (SELECT id FROM updated) AND revoked_at IS NULL
+                    )
+                    SELECT id FROM updated;
+                    """,
                     (new_pass, user_id)
                 )
+                updated = curs.fetchone() is not None
                 self.db_conn.commit()
                 logger.info(f"Password updated for user {user_id}")
                 print(f"Updated password for user: {user_id}", new_pass, sep = "\n", end="\n\n======\n\n")
-                return True
+                return updated
         except Exception as e:
             logger.error(f"Error updating password for user {user_id}: {e}")
             print(f"Error updating password for user {user_id}: {e}", end="\n\n======\n\n")
             self.db_conn.rollback()
-            return False
+            return None
 
     def delete_user(self, user_id: int):
         try:
             with self.db_conn.cursor(cursor_factory=RealDictCursor) as curs:
-                curs.execute("UPDATE users_data SET is_deleted = %s WHERE id = %s;",
-                    (True, user_id))
+                # Сессии отзываются сразу: иначе после восстановления аккаунта старые refresh-токены снова бы действовали
+                curs.execute(
+                    """
+                    WITH updated AS (
+                        UPDATE users_data SET is_deleted = %s, version = version + 1, updated_at = now()
+                        WHERE id = %s AND NOT is_deleted RETURNING id
+                    ), revoked AS (
+                        UPDATE user_sessions SET revoked_at = now() WHERE user_id IN (SELECT id FROM updated) AND revoked_at IS NULL
+                    )
+                    SELECT id FROM updated;
+                    """,
+                    (True, user_id)
+                )
+                updated = curs.fetchone() is not None
                 self.db_conn.commit()
                 logger.info(f"User {user_id} deleted")
                 print(f"User {user_id} deleted", end="\n\n======\n\n")
-                return True
+                return updated
         except Exception as e:
             logger.error(f"Error deleting user {user_id}: {e}")
             print(f"Error deleting user {user_id}: {e}", end="\n\n======\n\n")
@@ -177,18 +336,19 @@ class Users:
                         "avatar": ""
                     }
                 }
-            if not isinstance(data, str):
-                data_json = json.dumps(data)
-            else:
-                data_json = data
+            if isinstance(data, str):
+                data = json.loads(data)
             with self.db_conn.cursor(cursor_factory=RealDictCursor) as curs:
                 curs.execute(
                     """
-                    UPDATE users_data SET name = %s, surname = %s, password_hash = %s, is_deleted = %s, data = %s WHERE mail = %s RETURNING id;
+                    UPDATE users_data SET name = %s, surname = %s, password_hash = %s, is_deleted = %s, data = %s::jsonb - 'games',
+                        version = version + 1, updated_at = now()
+                    WHERE mail = %s RETURNING id;
                     """,
-                    (name, surname, password_hash, False, data_json, mail)
+                    (name, surname, password_hash, False, json.dumps(data), mail)
                 )
                 user_id = curs.fetchone()["id"]
+                Games(self.db_conn).sync_user_games(user_id, data.get("games", []))
                 self.db_conn.commit()
                 logger.info(f"User reactivated: {user_id} ({name})")
                 print(f"User {mail} ({name}) reactivated", end="\n\n======\n\n")
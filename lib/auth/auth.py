@@ -1,47 +1,144 @@
 import os
+from contextlib import asynccontextmanager
 from datetime import datetime, timedelta
-from lib.auth.utils import hash_password, verify_password, create_access_token
+from lib.auth.utils import (
+    ACCESS_EXPIRE_MINUTES, REFRESH_EXPIRE_DAYS, create_access_token, create_refresh_token, hash_refresh_token
+)
+from lib.auth.hashing import PasswordHasher, PasswordHasherBusy
+from lib.auth.refresh_cache import RefreshCache
+from lib.metrics import Metrics
 from lib.models.schemas import UserResponse
-from db.database import DatabasePool
+from db.database import DatabasePool, DatabasePoolTimeout
+from db.async_database import AsyncDatabasePool
 from db.users_db import Users
+from db.async_users_db import AsyncUsers
+from db.async_sessions_db import AsyncSessions
+from db.logging import logger
 from fastapi import HTTPException
 
+
+def login_response(user, refresh_token=None):
+    user_response = UserResponse(
+        id=user["id"],
+        mail=user["mail"],
+        name=user["name"],
+        surname=user["surname"]
+    )
+    access_token = create_access_token(user_response)
+    response = {
+        "access_token": access_token,
+        "token_type": "bearer",
+        "expires_in": ACCESS_EXPIRE_MINUTES * 60,
+        "user": user_response
+    }
+    if refresh_token:
+        response["refresh_token"] = refresh_token
+    return response
+
+
 class Auth:
     def __init__(self, db_conn):
         self.db_conn = db_conn
         self.users_service = Users(db_conn)
         
-    def register(self, mail, name, surname, password):
-        user = self.users_service.get_user_by_mail(mail)
+    def register(self, mail, name, surname, password_hash):
+        # password_hash посчитан заранее в пуле PasswordHasher (get_register_password_hash), до взятия соединения.
+        # mail уникален (users_data_mail_key): удалённый пользователь восстанавливается, а не создаётся заново
+        user = self.users_service.get_user_by_mail(mail, columns=("id", "is_deleted"), include_deleted=True)
         if user:
             if user.get('is_deleted'):
                 # Восстановление пользователя
-                password_hash = hash_password(password)
                 user_id = self.users_service.reactivate_user(mail, name, surname, password_hash)
                 return user_id, None
             raise HTTPException(400, detail="User already exists")
-        password_hash = hash_password(password)
         user_id = self.users_service.create_user(mail, name, surname, password_hash)
         if user_id is None:
+            # параллельная регистрация с той же почтой упирается в уникальный индекс
+            if self.users_service.get_user_by_mail(mail, columns=("id",), include_deleted=True):
+                raise HTTPException(400, detail="User already exists")
             raise HTTPException(500, detail="Failed to create user")
         return user_id, None
 
-    def login(self, mail, password):
-        user = self.users_service.get_user_by_mail(mail)
-        print(mail, password, user) 
+
+async def run_password_hasher(call):
+    # Переполненная очередь bcrypt - 503, как у пула соединений: клиент повторит позже
+    try:
+        return await call
+    except PasswordHasherBusy as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "1"})
+
+
+class AsyncAuth:
+    # Вход и сессии для async-ручек /login, /refresh, /logout: соединение asyncpg берётся только на время запросов,
+    # bcrypt считается в пуле процессов PasswordHasher - ни соединение, ни поток threadpool не ждут хэширования.
+    # /refresh пароль не проверяет: новый access-токен выдаётся по сессии из user_sessions
+    @asynccontextmanager
+    async def connection(self):
+        try:
+            conn = await AsyncDatabasePool.get_connection()
+        except DatabasePoolTimeout as e:
+            raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "1"})
+        try:
+            yield conn
+        finally:
+            await AsyncDatabasePool.put_connection(conn)
+
+    async def login(self, mail, password):
+        async with self.connection() as conn:
+            user = await AsyncUsers(conn).get_user_by_mail(mail)
         if not user:
             raise HTTPException(401, detail="User not found")
-        if not verify_password(password, user['password_hash']):
+        if not await run_password_hasher(PasswordHasher.verify(password, user['password_hash'])):
             raise HTTPException(401, detail="Wrong password")
-        user_response = UserResponse(
-            id=user["id"],
-            mail=user["mail"],
-            name=user["name"],
-            surname=user["surname"]
-        )
-        access_token = create_access_token(user_response)
-        return {
-            "access_token": access_token,
-            "token_type": "bearer",
-            "user": user_response
-        }
+        if PasswordHasher.needs_rehash(user['password_hash']):
+            await self.rehash(user, password)
+        refresh_token = create_refresh_token()
+        async with self.connection() as conn:
+            session_id = await AsyncSessions(conn).create_session(
+                user['id'], hash_refresh_token(refresh_token), REFRESH_EXPIRE_DAYS * 86400
+            )
+        if session_id is None:
+            raise HTTPException(500, detail="Failed to create session")
+        return login_response(user, refresh_token)
+
+    async def rehash(self, user, password):
+        # Хэш со старой стоимостью (BCRYPT_ROUNDS изменили) пересчитывается, пока пароль известен.
+        # Ошибка здесь не мешает входу: пересчёт повторится при следующем
+        try:
+            new_hash = await PasswordHasher.hash(password)
+            async with self.connection() as conn:
+                await AsyncUsers(conn).update_password_hash(user['id'], user['password_hash'], new_hash)
+        except Exception as e:
+            logger.warning(f"Password rehash for user {user['id']} skipped: {e}")
+
+    async def refresh(self, refresh_token):
+        token_hash = hash_refresh_token(refresh_token)
+        return await RefreshCache.run(token_hash, lambda: self.rotate(token_hash))
+
+    async def rotate(self, token_hash):
+        new_token = create_refresh_token()
+        async with self.connection() as conn:
+            sessions_service = AsyncSessions(conn)
+            user = await sessions_service.rotate_session(token_hash, hash_refresh_token(new_token), REFRESH_EXPIRE_DAYS * 86400)
+            reused = user is False and await sessions_service.revoke_reused(token_hash, RefreshCache.get_grace())
+        if user is None:
+            raise HTTPException(500, detail="Failed to refresh session")
+        if not user:
+            Metrics.inc("auth_refresh_total", 1, "Refresh token requests by outcome", outcome="reused" if reused else "invalid")
+            raise HTTPException(401, detail="Invalid refresh token")
+        Metrics.inc("auth_refresh_total", 1, "Refresh token requests by outcome", outcome="rotated")
+        return login_response(user, new_token)
+
+    async def logout(self, refresh_token):
+        async with self.connection() as conn:
+            revoked = await AsyncSessions(conn).revoke_session(hash_refresh_token(refresh_token))
+        if revoked is None:
+            raise HTTPException(500, detail="Failed to revoke session")
+        return revoked
+
+    async def logout_all(self, user_id):
+        async with self.connection() as conn:
+            revoked = await AsyncSessions(conn).revoke_user_sessions(user_id)
+        if revoked is None:
+            raise HTTPException(500, detail="Failed to revoke sessions")
+        return revoked
@@ -0,0 +1,92 @@
+import os
+import time
+import asyncio
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+from dotenv import load_dotenv
+
+from lib.auth.utils import BCRYPT_ROUNDS, hash_password, needs_rehash, verify_password
+from lib.metrics import Metrics
+
+load_dotenv()
+
+HASH_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+class PasswordHasherBusy(Exception):
+    pass
+
+
+class PasswordHasher:
+    # bcrypt в отдельном пуле процессов: всплеск /login и /register не занимает потоки Starlette,
+    # которые обслуживают чтение данных. Очередь ограничена - сверх неё запрос сразу получает отказ,
+    # а не ждёт в хвосте, пока клиент уже отвалился по таймауту
+    _executor = None
+    _lock = threading.Lock()
+
+    @classmethod
+    def init_pool(cls):
+        cls.workers = max(1, int(os.getenv("PASSWORD_HASH_WORKERS", min(4, os.cpu_count() or 1))))
+        cls.max_queued = int(os.getenv("PASSWORD_HASH_QUEUE_SIZE", 32))
+        cls.rounds = BCRYPT_ROUNDS
+        cls.pending = 0
+        # spawn: fork процесса с потоками uvicorn и пулов соединений небезопасен
+        cls._executor = ProcessPoolExecutor(max_workers=cls.workers, mp_context=multiprocessing.get_context("spawn"))
+
+    @classmethod
+    def check_pool(cls):
+        if not cls._executor:
+            with cls._lock:
+                if not cls._executor:
+                    cls.init_pool()
+
+    @classmethod
+    async def run(cls, operation, func, *args):
+        cls.check_pool()
+        with cls._lock:
+            if cls.pending >= cls.workers + cls.max_queued:
+                Metrics.inc("password_hash_rejected_total", 1, "Password hashing requests rejected because the queue was full", operation=operation)
+                raise PasswordHasherBusy(f"Password hashing queue is full: {cls.pending} requests")
+            cls.pending += 1
+        start_time = time.perf_counter()
+        try:
+            return await asyncio.wrap_future(cls._executor.submit(func, *args))
+        finally:
+            with cls._lock:
+                cls.pending -= 1
+            Metrics.observe(
+                "password_hash_seconds", time.perf_counter() - start_time, "Password hashing time including the queue",
+                buckets=HASH_BUCKETS, operation=operation
+            )
+
+    @classmethod
+    async def hash(cls, password: str) -> str:
+        return await cls.run("hash", hash_password, password, cls.get_rounds())
+
+    @classmethod
+    async def verify(cls, plain: str, hashed: str) -> bool:
+        return await cls.run("verify", verify_password, plain, hashed)
+
+    @classmethod
+    def get_rounds(cls):
+        cls.check_pool()
+        return cls.rounds
+
+    @classmethod
+    def needs_rehash(cls, hashed: str) -> bool:
+        return needs_rehash(hashed, cls.get_rounds())
+
+    @classmethod
+    def get_stats(cls):
+        if not cls._executor:
+            return {"workers": 0, "pending": 0, "max_queued": 0}
+        with cls._lock:
+            return {"workers": cls.workers, "pending": cls.pending, "max_queued": cls.max_queued}
+
+    @classmethod
+    def shutdown(cls):
+        if cls._executor:
+            cls._executor.shutdown(wait=False, cancel_futures=True)
+            cls._executor = None
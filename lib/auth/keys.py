@@ -0,0 +1,103 @@
+import os
+import re
+import hashlib
+import threading
+
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import ec, ed25519, rsa
+from dotenv import load_dotenv
+
+load_dotenv()
+
+PEM_BLOCK = re.compile(r"-----BEGIN [A-Z ]+-----.+?-----END [A-Z ]+-----", re.S)
+
+
+def read_pem(value):
+    # В .env ключ записан в одну строку с \n
+    return value.replace("\\n", "\n").strip() if value else ""
+
+
+def split_pems(value):
+    # Несколько открытых ключей подряд в одной переменной -> список PEM-блоков
+    return PEM_BLOCK.findall(read_pem(value))
+
+
+RSA_ALGORITHMS = ("RS256", "RS384", "RS512", "PS256", "PS384", "PS512")
+
+
+def get_key_algorithm(public_key, rsa_algorithm=None):
+    # Алгоритм по типу ключа: токен с другим alg этим ключом не проверяется (alg confusion).
+    # Выбор есть только у RSA - ALGORITHM из окружения, по умолчанию RS256
+    if isinstance(public_key, ed25519.Ed25519PublicKey):
+        return "EdDSA"
+    if isinstance(public_key, ec.EllipticCurvePublicKey):
+        algorithms = {"secp256r1": "ES256", "secp384r1": "ES384", "secp521r1": "ES512"}
+        if public_key.curve.name in algorithms:
+            return algorithms[public_key.curve.name]
+    if isinstance(public_key, rsa.RSAPublicKey):
+        return rsa_algorithm if rsa_algorithm in RSA_ALGORITHMS else "RS256"
+    raise ValueError(f"Unsupported JWT key type: {type(public_key).__name__}")
+
+
+def make_kid(public_key):
+    # kid - отпечаток открытого ключа: одинаковый на всех экземплярах без отдельной настройки
+    der = public_key.public_bytes(serialization.Encoding.DER, serialization.PublicFormat.SubjectPublicKeyInfo)
+    return hashlib.sha256(der).hexdigest()[:16]
+
+
+class JWTKeys:
+    # Ключи JWT разбираются из PEM один раз при старте, а не на каждый токен.
+    # Подпись - активным ключом PRIVATE_SECRET_KEY (kid в заголовке токена), проверка - по kid среди
+    # активного и прежних ключей (PREVIOUS_PUBLIC_KEYS): при ротации выданные токены действуют до своего exp
+    _verify_keys = None
+    _lock = threading.Lock()
+
+    @classmethod
+    def load_keys(cls):
+        rsa_algorithm = os.getenv("ALGORITHM")
+        signing_key = None
+        verify_keys = {}
+        private_pem = read_pem(os.getenv("PRIVATE_SECRET_KEY"))
+        if private_pem:
+            private_key = serialization.load_pem_private_key(private_pem.encode(), password=None)
+            public_key = private_key.public_key()
+            kid = make_kid(public_key)
+            signing_key = (kid, get_key_algorithm(public_key, rsa_algorithm), private_key)
+            verify_keys[kid] = (signing_key[1], public_key)
+        else:
+            print("WARNING: PRIVATE_SECRET_KEY not found in environment variables")
+        public_pems = split_pems(os.getenv("PUBLIC_SECRET_KEY"))
+        if not public_pems and not private_pem:
+            print("WARNING: PUBLIC_SECRET_KEY not found in environment variables")
+        for pem in public_pems:
+            public_key = serialization.load_pem_public_key(pem.encode())
+            verify_keys.setdefault(make_kid(public_key), (get_key_algorithm(public_key, rsa_algorithm), public_key))
+        for pem in split_pems(os.getenv("PREVIOUS_PUBLIC_KEYS")):
+            public_key = serialization.load_pem_public_key(pem.encode())
+            verify_keys.setdefault(make_kid(public_key), (get_key_algorithm(public_key, rsa_algorithm), public_key))
+        with cls._lock:
+            cls._signing_key = signing_key
+            cls._verify_keys = verify_keys
+
+    @classmethod
+    def check_keys(cls):
+        if cls._verify_keys is None:
+            cls.load_keys()
+
+    @classmethod
+    def get_signing_key(cls):
+        # (kid, алгоритм, закрытый ключ)
+        cls.check_keys()
+        if not cls._signing_key:
+            raise ValueError("PRIVATE_SECRET_KEY not configured")
+        return cls._signing_key
+
+    @classmethod
+    def get_verify_keys(cls, kid, algorithm):
+        # [(алгоритм, открытый ключ)] для проверки токена. Токены без kid выданы до ротации ключей:
+        # для них перебираются ключи с тем же алгоритмом
+        cls.check_keys()
+        if kid:
+            key = cls._verify_keys.get(kid)
+            return [key] if key else []
+        return [key for key in cls._verify_keys.values() if key[0] == algorithm]
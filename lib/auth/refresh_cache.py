@@ -0,0 +1,76 @@
+import os
+import time
+import asyncio
+from collections import OrderedDict
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+
+class RefreshCache:
+    # Ответы /refresh последних REFRESH_REUSE_GRACE секунд по хэшу предъявленного refresh-токена.
+    # Повтор того же обновления (две вкладки, повтор после обрыва связи) получает тот же ответ,
+    # а не 401 за повторное использование; одновременные запросы ждут первый, а не идут в базу.
+    # Хранятся futures, привязанные к циклу событий, поэтому кэш используется только из async-кода, без блокировок
+    _items = None
+
+    @classmethod
+    def init_cache(cls):
+        cls.grace = float(os.getenv("REFRESH_REUSE_GRACE", 10))
+        cls.max_items = int(os.getenv("REFRESH_CACHE_SIZE", 10000))
+        cls.stats = {"hits": 0}
+        cls._items = OrderedDict()
+
+    @classmethod
+    def check_cache(cls):
+        if cls._items is None:
+            cls.init_cache()
+
+    @classmethod
+    def get_grace(cls):
+        cls.check_cache()
+        return cls.grace
+
+    @classmethod
+    def remove_expired(cls, now):
+        while cls._items:
+            key, (expires_at, _) = next(iter(cls._items.items()))
+            if expires_at > now and len(cls._items) <= cls.max_items:
+                break
+            del cls._items[key]
+
+    @classmethod
+    async def run(cls, token_hash: bytes, refresh):
+        # refresh - функция без аргументов, возвращающая корутину обновления сессии
+        cls.check_cache()
+        if cls.grace <= 0:
+            return await refresh()
+        now = time.monotonic()
+        item = cls._items.get(token_hash)
+        if item and item[0] > now:
+            cls.stats["hits"] += 1
+            return await asyncio.shield(item[1])
+        future = asyncio.get_running_loop().create_future()
+        cls._items[token_hash] = (now + cls.grace, future)
+        cls._items.move_to_end(token_hash)
+        cls.remove_expired(now)
+        try:
+            result = await refresh()
+        except Exception as e:
+            # ошибку не кэшируем: следующий запрос пойдёт в базу сам
+            cls._items.pop(token_hash, None)
+            future.set_exception(e)
+            future.exception()
+            raise
+        except BaseException:
+            cls._items.pop(token_hash, None)
+            future.cancel()
+            raise
+        future.set_result(result)
+        return result
+
+    @classmethod
+    def get_stats(cls):
+        cls.check_cache()
+        return {"hits": cls.stats["hits"], "items": len(cls._items)}
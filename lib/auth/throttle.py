@@ -0,0 +1,154 @@
+import os
+import math
+import time
+import hashlib
+import threading
+
+from dotenv import load_dotenv
+
+from db.async_database import AsyncDatabasePool
+from lib.metrics import Metrics
+
+load_dotenv()
+
+
+class Throttled(Exception):
+    def __init__(self, action, scope, retry_after):
+        super().__init__(f"Too many {action} attempts, retry in {retry_after} s")
+        self.action = action
+        self.scope = scope
+        self.retry_after = retry_after
+
+
+class MemoryThrottleBackend:
+    # Счётчики в памяти процесса: на каждый ключ - окно и попытки в нём и в предыдущем.
+    # При нескольких экземплярах у каждого свой счёт - для общего лимита нужен PostgresThrottleBackend
+    def __init__(self):
+        self.counters = {}
+        self.cleaned_window = 0
+        self.lock = threading.Lock()
+
+    async def hit(self, key, window_index):
+        with self.lock:
+            if window_index > self.cleaned_window:
+                # ключи, не появлявшиеся два окна, больше ни на что не влияют
+                self.counters = {k: v for k, v in self.counters.items() if v[0] >= window_index - 1}
+                self.cleaned_window = window_index
+            index, current, previous = self.counters.get(key, (window_index, 0, 0))
+            if index != window_index:
+                previous = current if index == window_index - 1 else 0
+                current = 0
+            current += 1
+            self.counters[key] = (window_index, current, previous)
+            return previous, current
+
+    async def reset(self, key):
+        with self.lock:
+            self.counters.pop(key, None)
+
+
+class PostgresThrottleBackend:
+    # Общие для всех экземпляров счётчики в UNLOGGED-таблице auth_throttle (миграция 007):
+    # одна строка на ключ и окно, попытка - один upsert
+    def __init__(self):
+        self.cleaned_window = 0
+
+    async def hit(self, key, window_index):
+        async with AsyncDatabasePool.connection() as conn:
+            if window_index > self.cleaned_window:
+                self.cleaned_window = window_index
+                await conn.execute("DELETE FROM auth_throttle WHERE window_index < $1;", window_index - 1)
+            row = await conn.fetchrow(
+                """
+                WITH hit AS (
+                    INSERT INTO auth_throttle (key, window_index, hits) VALUES ($1, $2, 1)
+                    ON CONFLICT (key, window_index) DO UPDATE SET hits = auth_throttle.hits + 1
+                    RETURNING hits
+                )
+                SELECT COALESCE((SELECT hits FROM auth_throttle WHERE key = $1 AND window_index = $2 - 1), 0) AS previous,
+                    (SELECT hits FROM hit) AS current;
+                """,
+                key, window_index
+            )
+            return row["previous"], row["current"]
+
+    async def reset(self, key):
+        async with AsyncDatabasePool.connection() as conn:
+            await conn.execute("DELETE FROM auth_throttle WHERE key = $1;", key)
+
+
+BACKENDS = {"memory": MemoryThrottleBackend, "postgres": PostgresThrottleBackend}
+
+
+class Throttle:
+    # Ограничение попыток входа и регистрации скользящим окном: по почте (подбор пароля к аккаунту)
+    # и по IP (перебор чужих учётных данных). Проверяется до bcrypt - отказ 429 не стоит CPU.
+    # Окно - приближение счётчиками двух соседних окон: попытки прошлого окна учитываются с весом
+    # оставшейся его доли. Отклонённые попытки тоже считаются: кто продолжает долбить, остаётся заблокирован
+    _backend = None
+
+    @classmethod
+    def init_throttle(cls, backend=None):
+        # backend - объект с async hit(key, window_index) -> (previous, current) и async reset(key);
+        # по умолчанию - THROTTLE_BACKEND: memory или postgres
+        cls.window = float(os.getenv("THROTTLE_WINDOW", 60))
+        cls.limits = {
+            ("login", "account"): int(os.getenv("LOGIN_ACCOUNT_LIMIT", 10)),
+            ("login", "ip"): int(os.getenv("LOGIN_IP_LIMIT", 50)),
+            ("register", "ip"): int(os.getenv("REGISTER_IP_LIMIT", 10)),
+        }
+        cls._backend = backend or BACKENDS[os.getenv("THROTTLE_BACKEND", "memory")]()
+
+    @classmethod
+    def check_throttle(cls):
+        if cls._backend is None:
+            cls.init_throttle()
+
+    @classmethod
+    def make_key(cls, action, scope, value):
+        # Почта и IP не хранятся как есть - в таблице и памяти только хэш
+        digest = hashlib.sha256(str(value).strip().lower().encode("utf-8")).hexdigest()[:32]
+        return f"{action}:{scope}:{digest}"
+
+    @classmethod
+    def get_retry_after(cls, previous, current, limit, now):
+        # Через сколько секунд следующая попытка уложится в лимит
+        elapsed = (now % cls.window) / cls.window
+        if current + 1 <= limit:
+            wait = 1 - elapsed - (limit - current - 1) / previous if previous else 0
+        else:
+            # в этом окне уже не уложиться: ждём следующего, где текущие попытки станут прошлыми
+            wait = 1 - elapsed + max(0.0, 1 - (limit - 1) / current)
+        return max(1, math.ceil(wait * cls.window))
+
+    @classmethod
+    async def check(cls, action, **values):
+        # values - scope=значение (account=почта, ip=адрес). Throttled - если хоть один лимит превышен.
+        # Ошибка хранилища счётчиков не блокирует вход: лимит важнее доступности только при атаке
+        cls.check_throttle()
+        now = time.time()
+        window_index = int(now // cls.window)
+        for scope, value in values.items():
+            limit = cls.limits.get((action, scope), 0)
+            if not limit or not value:
+                continue
+            try:
+                previous, current = await cls._backend.hit(cls.make_key(action, scope, value), window_index)
+            except Exception as e:
+                Metrics.inc("auth_throttle_errors_total", 1, "Throttle backend failures, the attempt was let through", action=action)
+                print(f"Throttle backend error, {action} not limited: {e}", end="\n\n======\n\n")
+                continue
+            weight = 1 - (now % cls.window) / cls.window
+            if previous * weight + current > limit:
+                Metrics.inc("auth_throttled_total", 1, "Auth attempts rejected with 429 before password hashing", action=action, scope=scope)
+                raise Throttled(action, scope, cls.get_retry_after(previous, current, limit, now))
+        Metrics.inc("auth_throttle_checks_total", 1, "Auth attempts checked by the throttle", action=action)
+
+    @classmethod
+    async def reset(cls, action, scope, value):
+        # Успешный вход обнуляет счётчик аккаунта: свои опечатки до входа не копятся
+        cls.check_throttle()
+        try:
+            await cls._backend.reset(cls.make_key(action, scope, value))
+        except Exception as e:
+            print(f"Throttle reset failed: {e}", end="\n\n======\n\n")
@@ -0,0 +1,76 @@
+import os
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+
+from dotenv import load_dotenv
+
+from lib.auth.utils import decode_token
+
+load_dotenv()
+
+
+class TokenCache:
+    # Кэш проверенных access-токенов: sha256 токена -> claims до момента exp.
+    # Фронтенд шлёт один токен весь его срок, полная проверка RS256 нужна только на первом запросе.
+    # В ключе - хэш, а не сам токен, чтобы в памяти процесса не лежали действующие токены
+    _items = None
+    _lock = threading.Lock()
+
+    @classmethod
+    def init_cache(cls):
+        cls.max_items = int(os.getenv("TOKEN_CACHE_SIZE", 10000))
+        cls.stats = {"hits": 0, "misses": 0, "expired": 0, "evicted": 0}
+        cls._items = OrderedDict()
+
+    @classmethod
+    def check_cache(cls):
+        if cls._items is None:
+            cls.init_cache()
+
+    @classmethod
+    def make_key(cls, token: str):
+        return hashlib.sha256(token.encode("utf-8")).digest()
+
+    @classmethod
+    def decode(cls, token: str):
+        # То же, что decode_token (ValueError на неверный токен), но повторная проверка берётся из кэша.
+        # Неверные токены не кэшируются: иначе поток мусорных токенов вытеснил бы настоящие
+        cls.check_cache()
+        if cls.max_items <= 0:
+            return decode_token(token)
+        key = cls.make_key(token)
+        now = time.time()
+        with cls._lock:
+            item = cls._items.get(key)
+            if item and item[0] > now:
+                cls._items.move_to_end(key)
+                cls.stats["hits"] += 1
+                return dict(item[1])
+            if item:
+                del cls._items[key]
+                cls.stats["expired"] += 1
+            cls.stats["misses"] += 1
+        payload = decode_token(token)
+        exp = payload.get("exp")
+        if isinstance(exp, (int, float)) and exp > now:
+            with cls._lock:
+                cls._items[key] = (exp, dict(payload))
+                cls._items.move_to_end(key)
+                while len(cls._items) > cls.max_items:
+                    cls._items.popitem(last=False)
+                    cls.stats["evicted"] += 1
+        return payload
+
+    @classmethod
+    def clear(cls):
+        cls.check_cache()
+        with cls._lock:
+            cls._items.clear()
+
+    @classmethod
+    def get_stats(cls):
+        cls.check_cache()
+        with cls._lock:
+            return dict(cls.stats, items=len(cls._items), max_items=cls.max_items)
@@ -1,59 +1,72 @@
 import os
+import hashlib
+import secrets
 from datetime import datetime, timedelta
 
 import bcrypt
 import jwt
 from dotenv import load_dotenv
-from jose import JWTError
-from jose import jwt as jose_jwt
+
+from lib.auth.keys import JWTKeys
 
 load_dotenv()
 
 ACCESS_EXPIRE_MINUTES = 60
+# Срок сессии: продлевается при каждом обновлении refresh-токена
+REFRESH_EXPIRE_DAYS = int(os.getenv("REFRESH_EXPIRE_DAYS", 30))
 
-PRIVATE_KEY = os.getenv("PRIVATE_SECRET_KEY")
-if PRIVATE_KEY:
-    PRIVATE_KEY = PRIVATE_KEY.replace("\\n", "\n")
-else:
-    print("WARNING: PRIVATE_SECRET_KEY not found in environment variables")
-
-PUBLIC_KEY = os.getenv("PUBLIC_SECRET_KEY")
-if PUBLIC_KEY:
-    PUBLIC_KEY = PUBLIC_KEY.replace("\\n", "\n")
-else:
-    print("WARNING: PUBLIC_SECRET_KEY not found in environment variables")
-
-ALGORITHM = os.getenv("ALGORITHM", "RS256")
+# Стоимость bcrypt: 2^BCRYPT_ROUNDS итераций. Хэши с другой стоимостью пересчитываются при входе
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", 12))
 
-def hash_password(password: str) -> str:
-    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
+def hash_password(password: str, rounds: int = BCRYPT_ROUNDS) -> str:
+    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt(rounds=rounds)).decode('utf-8')
 
 def verify_password(plain: str, hashed: str) -> bool:
     return bcrypt.checkpw(plain.encode('utf-8'), hashed.encode('utf-8'))
 
+def get_hash_rounds(hashed: str):
+    # $2b$12$<соль и хэш> -> 12
+    try:
+        return int(hashed.split("$")[2])
+    except (IndexError, ValueError):
+        return None
+
+def needs_rehash(hashed: str, rounds: int = BCRYPT_ROUNDS) -> bool:
+    return get_hash_rounds(hashed) != rounds
+
 def create_access_token(user) -> str:
     to_encode = user.dict() if hasattr(user, 'dict') else dict(user)
     expire = datetime.utcnow() + timedelta(minutes=ACCESS_EXPIRE_MINUTES)
     to_encode.update({"exp": expire})
-    return jose_jwt.encode(to_encode, PRIVATE_KEY, algorithm=ALGORITHM)
-
-def encode_jwt(payload: dict,
-               private_key: str = PRIVATE_KEY,
-               algorithm: str = ALGORITHM):
-    encoded = jwt.encode(
-        payload,
-        private_key,
-        algorithm=algorithm,
-    )
-    return encoded
+    return encode_jwt(to_encode)
+
+def encode_jwt(payload: dict):
+    # Подпись активным ключом, kid в заголовке - по нему токен найдёт ключ и после ротации
+    kid, algorithm, private_key = JWTKeys.get_signing_key()
+    return jwt.encode(payload, private_key, algorithm=algorithm, headers={"kid": kid})
+
+def create_refresh_token() -> str:
+    # Непрозрачная случайная строка: проверяется поиском сессии в user_sessions, а не подписью
+    return secrets.token_urlsafe(32)
+
+def hash_refresh_token(token: str) -> bytes:
+    return hashlib.sha256(token.encode("utf-8")).digest()
 
 def decode_token(token: str):
-    if not PUBLIC_KEY:
-        raise ValueError("PUBLIC_KEY not configured")
-    if not ALGORITHM:
-        raise ValueError("ALGORITHM not configured")
     try:
-        payload = jose_jwt.decode(token, PUBLIC_KEY, algorithms=[ALGORITHM])
-        return payload
-    except JWTError as e:
-        raise ValueError("Invalid token") from e
\ No newline at end of file
+        header = jwt.get_unverified_header(token)
+    except jwt.InvalidTokenError as e:
+        raise ValueError("Invalid token") from e
+    keys = JWTKeys.get_verify_keys(header.get("kid"), header.get("alg"))
+    if not keys:
+        raise ValueError("Unknown token key")
+    for algorithm, public_key in keys:
+        try:
+            # algorithms - только алгоритм ключа, alg из заголовка токена сам по себе не принимается
+            return jwt.decode(token, public_key, algorithms=[algorithm])
+        except jwt.InvalidSignatureError:
+            # токен без kid: подпись другого ключа с тем же алгоритмом, пробуется следующий
+            continue
+        except jwt.InvalidTokenError as e:
+            raise ValueError("Invalid token") from e
+    raise ValueError("Invalid token")
@@ -0,0 +1,132 @@
+import os
+import json
+import queue
+import shutil
+import threading
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+
+class NullArtifacts:
+    enabled = False
+
+    def write(self, name, content):
+        pass
+
+    def append(self, name, content):
+        pass
+
+    def write_json(self, name, structure):
+        pass
+
+
+class JobArtifacts:
+    enabled = True
+
+    def __init__(self, job_id):
+        self.job_id = job_id
+
+    def write(self, name, content):
+        ArtifactSink.put(self.job_id, name, content, append=False)
+
+    def append(self, name, content):
+        ArtifactSink.put(self.job_id, name, content, append=True)
+
+    def write_json(self, name, structure):
+        # сериализуем сразу: граф продолжает меняться, пока запись ждёт в очереди
+        self.write(name, json.dumps(structure, ensure_ascii=False, indent=4))
+
+
+class ArtifactSink:
+    # Отладочные файлы генерации (промпты, промежуточные графы, log.txt). По умолчанию выключено;
+    # при включении каждая генерация пишет в свой каталог через фоновый поток
+    _queue = None
+    _thread = None
+    _lock = threading.Lock()
+
+    @classmethod
+    def init_sink(cls):
+        cls.enabled = os.getenv("LLM_ARTIFACTS_ENABLED", "false").lower() in ("1", "true", "yes")
+        cls.artifacts_dir = os.getenv("LLM_ARTIFACTS_DIR", "artifacts")
+        cls.max_file_bytes = int(os.getenv("LLM_ARTIFACTS_MAX_FILE_KB", 1024)) * 1024
+        cls.max_job_bytes = int(os.getenv("LLM_ARTIFACTS_MAX_JOB_MB", 20)) * 1024 * 1024
+        cls.max_jobs = int(os.getenv("LLM_ARTIFACTS_MAX_JOBS", 50))
+        cls.job_bytes = {}
+        cls._queue = queue.Queue(maxsize=int(os.getenv("LLM_ARTIFACTS_QUEUE_SIZE", 1000)))
+        if cls.enabled:
+            cls._thread = threading.Thread(target=cls.run, name="artifacts-writer", daemon=True)
+            cls._thread.start()
+
+    @classmethod
+    def check_sink(cls):
+        if cls._queue is None:
+            with cls._lock:
+                if cls._queue is None:
+                    cls.init_sink()
+
+    @classmethod
+    def for_job(cls, job_id):
+        cls.check_sink()
+        if not cls.enabled:
+            return NullArtifacts()
+        return JobArtifacts(job_id)
+
+    @classmethod
+    def put(cls, job_id, name, content, append):
+        try:
+            cls._queue.put_nowait((job_id, name, content, append))
+        except queue.Full:
+            # генерация не должна ждать диск
+            print(f"WARNING: artifacts queue is full, {job_id}/{name} dropped")
+
+    @classmethod
+    def run(cls):
+        while True:
+            item = cls._queue.get()
+            if item is None:
+                cls._queue.task_done()
+                return
+            try:
+                cls.write_item(*item)
+            except OSError as e:
+                print(f"WARNING: can't write artifact {item[0]}/{item[1]}: {e}")
+            finally:
+                cls._queue.task_done()
+
+    @classmethod
+    def write_item(cls, job_id, name, content, append):
+        job_dir = os.path.join(cls.artifacts_dir, job_id)
+        if job_id not in cls.job_bytes:
+            os.makedirs(job_dir, exist_ok=True)
+            cls.job_bytes[job_id] = 0
+            cls.rotate_jobs()
+        data = content.encode("utf-8")[:cls.max_file_bytes]
+        if cls.job_bytes[job_id] + len(data) > cls.max_job_bytes:
+            return
+        path = os.path.join(job_dir, name)
+        if append and os.path.exists(path) and os.path.getsize(path) + len(data) > cls.max_file_bytes:
+            os.replace(path, f"{path}.1")
+        with open(path, mode="ab" if append else "wb") as file:
+            file.write(data)
+        cls.job_bytes[job_id] += len(data)
+
+    @classmethod
+    def rotate_jobs(cls):
+        job_dirs = []
+        for name in os.listdir(cls.artifacts_dir):
+            path = os.path.join(cls.artifacts_dir, name)
+            if os.path.isdir(path):
+                job_dirs.append((os.path.getmtime(path), name, path))
+        job_dirs.sort()
+        for _, name, path in job_dirs[:max(0, len(job_dirs) - cls.max_jobs)]:
+            shutil.rmtree(path, ignore_errors=True)
+            cls.job_bytes.pop(name, None)
+
+    @classmethod
+    def shutdown(cls):
+        if cls._thread is not None:
+            cls._queue.put(None)
+            cls._thread.join(timeout=10)
+            cls._thread = None
@@ -0,0 +1,179 @@
+import os
+import json
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+
+class LLMCache:
+    # Кэш ответов LLM по хэшу запроса: LRU в памяти и файлы на диске с вытеснением по TTL и размеру.
+    # Включается отдельно для каждого этапа через LLM_CACHE_STAGES
+    _memory = None
+    _lock = threading.Lock()
+
+    @classmethod
+    def init_cache(cls):
+        cls.stages = {stage.strip() for stage in os.getenv("LLM_CACHE_STAGES", "").split(",") if stage.strip()}
+        cls.memory_items = int(os.getenv("LLM_CACHE_MEMORY_ITEMS", 512))
+        cls.ttl = int(os.getenv("LLM_CACHE_TTL", 86400))
+        cls.disk_dir = os.getenv("LLM_CACHE_DIR", "")
+        cls.disk_max_bytes = int(os.getenv("LLM_CACHE_DISK_MAX_MB", 256)) * 1024 * 1024
+        cls.disk_bytes = cls.get_disk_size()
+        cls.stats = {}
+        cls._memory = OrderedDict()
+
+    @classmethod
+    def check_cache(cls):
+        if cls._memory is None:
+            cls.init_cache()
+
+    @classmethod
+    def is_enabled(cls, stage):
+        cls.check_cache()
+        return stage in cls.stages
+
+    @classmethod
+    def make_key(cls, model, messages, max_tokens, response_format):
+        request = json.dumps([model, messages, max_tokens, response_format], ensure_ascii=False, sort_keys=True)
+        return hashlib.sha256(request.encode("utf-8")).hexdigest()
+
+    @classmethod
+    def count(cls, stage, event):
+        stage_stats = cls.stats.setdefault(stage, {"memory_hits": 0, "disk_hits": 0, "misses": 0})
+        stage_stats[event] += 1
+
+    @classmethod
+    def get(cls, stage, key):
+        cls.check_cache()
+        now = time.time()
+        with cls._lock:
+            item = cls._memory.get(key)
+            if item and item[0] > now:
+                cls._memory.move_to_end(key)
+                cls.count(stage, "memory_hits")
+                return item[1]
+            if item:
+                del cls._memory[key]
+        content = cls.read_disk(key, now)
+        with cls._lock:
+            if content is None:
+                cls.count(stage, "misses")
+                return None
+            cls.count(stage, "disk_hits")
+            cls.put_memory(key, content, now)
+        return content
+
+    @classmethod
+    def set(cls, stage, key, content):
+        cls.check_cache()
+        now = time.time()
+        with cls._lock:
+            cls.put_memory(key, content, now)
+        cls.write_disk(key, content)
+
+    @classmethod
+    def put_memory(cls, key, content, now):
+        cls._memory[key] = (now + cls.ttl, content)
+        cls._memory.move_to_end(key)
+        while len(cls._memory) > cls.memory_items:
+            cls._memory.popitem(last=False)
+
+    @classmethod
+    def get_path(cls, key):
+        return os.path.join(cls.disk_dir, key[:2], f"{key}.json")
+
+    @classmethod
+    def read_disk(cls, key, now):
+        if not cls.disk_dir:
+            return None
+        path = cls.get_path(key)
+        try:
+            if os.stat(path).st_mtime + cls.ttl <= now:
+                cls.remove_file(path)
+                return None
+            with open(path, encoding="utf-8", mode="r") as file:
+                return json.load(file)["content"]
+        except (OSError, ValueError, KeyError):
+            return None
+
+    @classmethod
+    def write_disk(cls, key, content):
+        if not cls.disk_dir:
+            return
+        path = cls.get_path(key)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(tmp_path, encoding="utf-8", mode="w") as file:
+                json.dump({"content": content}, file, ensure_ascii=False)
+            size = os.path.getsize(tmp_path)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print(f"WARNING: LLM cache write failed: {e}")
+            return
+        with cls._lock:
+            cls.disk_bytes += size
+            over_limit = cls.disk_bytes > cls.disk_max_bytes
+        if over_limit:
+            cls.evict_disk()
+
+    @classmethod
+    def remove_file(cls, path):
+        try:
+            size = os.path.getsize(path)
+            os.remove(path)
+        except OSError:
+            return
+        with cls._lock:
+            cls.disk_bytes -= size
+
+    @classmethod
+    def list_disk(cls):
+        files = []
+        for root, _, names in os.walk(cls.disk_dir):
+            for name in names:
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                files.append((stat.st_mtime, stat.st_size, path))
+        return files
+
+    @classmethod
+    def get_disk_size(cls):
+        if not cls.disk_dir:
+            return 0
+        return sum(size for _, size, _ in cls.list_disk())
+
+    @classmethod
+    def evict_disk(cls):
+        # Сначала удаляются просроченные записи, затем самые старые, пока кэш не займёт 90% лимита
+        now = time.time()
+        files = sorted(cls.list_disk())
+        total = sum(size for _, size, _ in files)
+        for mtime, size, path in files:
+            if mtime + cls.ttl > now and total <= cls.disk_max_bytes * 0.9:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+        with cls._lock:
+            cls.disk_bytes = total
+
+    @classmethod
+    def get_stats(cls):
+        cls.check_cache()
+        with cls._lock:
+            return {
+                "stages": {stage: dict(stage_stats) for stage, stage_stats in cls.stats.items()},
+                "memory_items": len(cls._memory),
+                "disk_bytes": cls.disk_bytes
+            }
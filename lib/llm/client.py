@@ -0,0 +1,144 @@
+import os
+import threading
+import weakref
+from dataclasses import dataclass
+from typing import Dict
+
+import httpx
+from openai import OpenAI
+from dotenv import load_dotenv
+
+load_dotenv(override=True)
+
+STAGES = (
+    "structure_generation",
+    "dialogue_generation",
+    "structure_validation",
+    "dialogue_validation",
+    "structure_regeneration",
+    "dialogue_regeneration",
+)
+
+
+@dataclass(frozen=True)
+class LLMConfig:
+    api_key: str
+    base_url: str
+    models: Dict[str, str]
+    max_tokens: Dict[str, int]
+    timeouts: Dict[str, float]
+    connect_timeout: float
+    max_connections: int
+    max_keepalive_connections: int
+    keepalive_expiry: float
+    dialogue_generation_concurrency: int
+
+    @classmethod
+    def from_env(cls):
+        default_timeout = float(os.getenv("LLM_TIMEOUT", 600))
+        return cls(
+            api_key=os.getenv("DEEPSEEK_API_KEY"),
+            base_url=os.getenv("DEEPSEEK_BASE_URL", "https://api.deepseek.com"),
+            models={stage: os.getenv(f"MODEL_TYPE_{stage.upper()}") for stage in STAGES},
+            max_tokens={stage: int(os.getenv(f"MODEL_MAX_TOKENS_{stage.upper()}", 8192)) for stage in STAGES},
+            timeouts={stage: float(os.getenv(f"LLM_TIMEOUT_{stage.upper()}", default_timeout)) for stage in STAGES},
+            connect_timeout=float(os.getenv("LLM_CONNECT_TIMEOUT", 10)),
+            max_connections=int(os.getenv("LLM_MAX_CONNECTIONS", 32)),
+            max_keepalive_connections=int(os.getenv("LLM_MAX_KEEPALIVE_CONNECTIONS", 16)),
+            keepalive_expiry=float(os.getenv("LLM_KEEPALIVE_EXPIRY", 120)),
+            dialogue_generation_concurrency=max(1, int(os.getenv("DIALOGUE_GENERATION_CONCURRENCY", 8)))
+        )
+
+
+class CountingTransport(httpx.HTTPTransport):
+    # Считает запросы и новые соединения пула, чтобы было видно, насколько соединения переиспользуются
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.lock = threading.Lock()
+        self.seen_connections = weakref.WeakSet()
+        self.requests = 0
+        self.connections_opened = 0
+
+    def handle_request(self, request):
+        response = super().handle_request(request)
+        with self.lock:
+            self.requests += 1
+            for connection in self._pool.connections:
+                if connection not in self.seen_connections:
+                    self.seen_connections.add(connection)
+                    self.connections_opened += 1
+        return response
+
+    def get_stats(self):
+        with self.lock:
+            connections = self._pool.connections
+            return {
+                "requests": self.requests,
+                "connections_opened": self.connections_opened,
+                "connections_reused": max(0, self.requests - self.connections_opened),
+                "connections_open": len(connections),
+                "connections_idle": sum(1 for connection in connections if connection.is_idle())
+            }
+
+
+class LLMClient:
+    # Один клиент DeepSeek на процесс: настройки читаются один раз, соединения живут в общем keep-alive пуле
+    _config = None
+    _client = None
+    _transport = None
+    _lock = threading.Lock()
+
+    @classmethod
+    def get_config(cls):
+        if cls._config is None:
+            with cls._lock:
+                if cls._config is None:
+                    cls._config = LLMConfig.from_env()
+        return cls._config
+
+    @classmethod
+    def configure(cls, config):
+        # Явная подмена настроек (бенчмарки с локальной заглушкой): текущий клиент закрывается
+        cls.close()
+        with cls._lock:
+            cls._config = config
+
+    @classmethod
+    def get_client(cls):
+        if cls._client is None:
+            config = cls.get_config()
+            with cls._lock:
+                if cls._client is None:
+                    cls._transport = CountingTransport(
+                        limits=httpx.Limits(
+                            max_connections=config.max_connections,
+                            max_keepalive_connections=config.max_keepalive_connections,
+                            keepalive_expiry=config.keepalive_expiry
+                        )
+                    )
+                    http_client = httpx.Client(
+                        transport=cls._transport,
+                        timeout=httpx.Timeout(max(config.timeouts.values()), connect=config.connect_timeout)
+                    )
+                    cls._client = OpenAI(
+                        api_key=config.api_key,
+                        base_url=config.base_url,
+                        # повторы делает LLMGovernor, иначе они умножаются на повторы SDK
+                        max_retries=0,
+                        http_client=http_client
+                    )
+        return cls._client
+
+    @classmethod
+    def get_stats(cls):
+        if cls._transport is None:
+            return {"requests": 0, "connections_opened": 0, "connections_reused": 0, "connections_open": 0, "connections_idle": 0}
+        return cls._transport.get_stats()
+
+    @classmethod
+    def close(cls):
+        with cls._lock:
+            if cls._client is not None:
+                cls._client.close()
+            cls._client = None
+            cls._transport = None
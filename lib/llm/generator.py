@@ -1,16 +1,23 @@
-from string import Template
 from networkx import DiGraph
-from openai import OpenAI
 from dotenv import load_dotenv
 from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 
 from lib.llm.settings import LLMSettings
+from lib.llm.prompts import PromptRegistry
+from lib.llm.cache import LLMCache
+from lib.llm.client import LLMClient
+from lib.llm.governor import LLMGovernor
+from lib.llm.artifacts import ArtifactSink, NullArtifacts
+from lib.llm.instrumentation import PipelineMetrics
 
 import networkx as nx
 import os
 import json
 import copy
 import time
+import threading
+import uuid
 
 load_dotenv(override=True)
 
@@ -47,6 +54,94 @@ def get_prev_dialog_chains(dialog_graph, node):
         prev_dialog_chains.append(dialog_chain)
     return prev_dialog_chains
 
+class ChainLink:
+    # Звено префиксного дерева путей: путь до node продолжает путь prev, общие префиксы не копируются
+    __slots__ = ("prev", "node", "key", "cache")
+
+    def __init__(self, prev, node, key):
+        self.prev = prev
+        self.node = node
+        self.key = key
+        self.cache = None
+
+    def render(self, dialog_graph):
+        if self.prev is None:
+            return ""
+        prefix = self.prev.render(dialog_graph)
+        npc_line = dialog_graph.nodes[self.prev.node]['line']
+        player_line = dialog_graph.edges[self.prev.node, self.node]['line']
+        cache = self.cache
+        if cache is not None and cache[0] is prefix and cache[1] is npc_line and cache[2] is player_line:
+            return cache[3]
+        dialog_chain = prefix + f"**NPC**: {npc_line}\n" + f"**Игрок**: {player_line}\n"
+        self.cache = (prefix, npc_line, player_line, dialog_chain)
+        return dialog_chain
+
+class DialogChainIndex:
+    # Индекс путей от корня, строится один раз на граф и достраивается по мере обхода.
+    # Порядок цепочек совпадает с nx.all_simple_paths: ключ звена - номера рёбер в списках смежности
+    def __init__(self, dialog_graph):
+        self.dialog_graph = dialog_graph
+        self.root = list(dialog_graph.nodes)[0]
+        self.acyclic = nx.is_directed_acyclic_graph(dialog_graph)
+        self.links = {self.root: [ChainLink(None, self.root, ())]}
+        self.lock = threading.Lock()
+
+    def get_links(self, node):
+        with self.lock:
+            return self.build_links(node)
+
+    def build_links(self, node):
+        if node in self.links:
+            return self.links[node]
+        links = []
+        for prev in self.dialog_graph.pred[node]:
+            index = list(self.dialog_graph.adj[prev]).index(node)
+            for link in self.build_links(prev):
+                links.append(ChainLink(link, node, link.key + (index,)))
+        links.sort(key=lambda link: link.key)
+        self.links[node] = links
+        return links
+
+    def get_chains(self, node):
+        if not self.acyclic:
+            return get_prev_dialog_chains(self.dialog_graph, node)
+        prev_dialog_chains = []
+        for link in self.get_links(node):
+            if link.prev is None or not self.dialog_graph.edges[link.prev.node, node].get("line"):
+                continue
+            prev_dialog_chains.append(link.render(self.dialog_graph))
+        return prev_dialog_chains
+
+def get_bfs_order(dialog_graph):
+    q = deque()
+    start_node = list(dialog_graph.nodes)[0]
+    q.append(start_node)
+    used = []
+    while q:
+        t = q.popleft()
+        used.append(t)
+        for next_node in list(dialog_graph.adj[t].keys()):
+            if next_node not in q and next_node not in used:
+                q.append(next_node)
+    return used
+
+def get_content_dependencies(dialog_graph, order):
+    # Вершина ждёт всех своих предков, обработанных раньше неё при обходе в ширину:
+    # именно их реплики попадают в цепочки диалога при последовательной генерации.
+    # Потомки, стоящие в обходе раньше вершины, должны прочитать свои цепочки до того,
+    # как она заполнит ведущие в них рёбра.
+    # В графе с циклом цепочки идут и через вершины, которые обход ещё не прошёл, - тогда, как и DialogChainIndex,
+    # возвращаемся к последовательной генерации: каждая вершина ждёт предыдущую в обходе
+    if not nx.is_directed_acyclic_graph(dialog_graph):
+        return {node: {order[ind - 1]} if ind else set() for ind, node in enumerate(order)}
+    position = {node: ind for ind, node in enumerate(order)}
+    dependencies = {}
+    for node in order:
+        dependencies[node] = {prev for prev in nx.ancestors(dialog_graph, node) if prev in position and position[prev] < position[node]}
+        dependencies[node].update(next_node for next_node in dialog_graph.adj[node] if position[next_node] < position[node])
+    return dependencies
+
 def get_avg_metrics_rate(metrics):
     rate_sum = 0
     for metric in metrics.keys():
@@ -63,9 +158,26 @@ def get_avg_multiple_metrics_rate(validation_results):
     if len(validation_results) and len(validation_results[0]):
         return rate_sum / len(validation_results) / len(validation_results[0])
     return 0
+
+# Разбор JSON-ответов для request_llm(parse=...): ответ без нужного поля - ошибка, и такой ответ не кэшируется
+def parse_lines(content):
+    lines = json.loads(content)["lines"]
+    if not isinstance(lines, list):
+        raise ValueError(f"LLM response 'lines' must be a list, got {type(lines).__name__}")
+    return lines
+
+def parse_metrics(content):
+    metrics = json.loads(content)["metrics"]
+    if not isinstance(metrics, dict):
+        raise ValueError(f"LLM response 'metrics' must be an object, got {type(metrics).__name__}")
+    return metrics
+
 class Orchestrator:
-    def __init__(self, params: dict):
+    def __init__(self, params: dict, job_id: str = None, metrics: PipelineMetrics = None):
         self.params = params
+        self.job_id = job_id or uuid.uuid4().hex
+        self.artifacts = ArtifactSink.for_job(self.job_id)
+        self.metrics = metrics if metrics is not None else PipelineMetrics(self.job_id)
         params["items_dict"] = {
             "Ключ-карта": 0,
             "Конспект Гасникова": 1,
@@ -75,219 +187,231 @@ class Orchestrator:
         }
     
     def create_dialog(self):
-        dialog_generator = DialogGenerator(self.params) 
-        dialog_validator = DialogValidator(self.params)
-        dialog_regenerator = DialogRegenerator(self.params)
-        start_time = time.time()
-        print("--Начало генерации--", flush=True)
-        dialog_graph = JSON_to_graph(dialog_generator.generate_structure())
-        print("--Структура до валидации--", json.dumps(graph_to_JSON(dialog_graph), ensure_ascii=False, indent=4), f"Время с начала выполнения программы: {time.time() - start_time}", sep = "\n", end = "\n\n=====\n\n", flush=True)
-        with open("structure_before_validation.txt", mode = "w", encoding="utf-8") as file:
-            json.dump(graph_to_JSON(dialog_graph), file, ensure_ascii=False, indent=4)
-        structure_validation = dialog_validator.validate_structure(dialog_graph)
-        with open("structure_validation.txt", mode = "w", encoding="utf-8") as file:
-            file.write(str(structure_validation))
-        print("--Оценка валидации--", structure_validation, sep = "\n", end = "\n\n=====\n\n", flush=True)
-        validation_cnt = 0
-        while not structure_validation[0] and validation_cnt < 3:
-            dialog_graph = JSON_to_graph(dialog_regenerator.regenerate_structure(dialog_graph, structure_validation[1]))
-            print("--Структура в процессе валидации--", json.dumps(graph_to_JSON(dialog_graph), ensure_ascii=False, indent=4), sep = "\n", end = "\n\n=====\n\n")
-            structure_validation = dialog_validator.validate_structure(dialog_graph)
-            with open("structure_validation.txt", mode = "w", encoding="utf-8") as file:
-                file.write(str(structure_validation))
-            print("--Оценка валидации--", structure_validation, sep = "\n", end = "\n\n=====\n\n")
-            validation_cnt += 1
-        print("--Структура после валидации--", json.dumps(graph_to_JSON(dialog_graph), ensure_ascii=False, indent=4), f"Время с начала выполнения программы: {time.time() - start_time}", sep = "\n", end = "\n\n=====\n\n", flush=True)
-        with open("structure_after_validation.txt", mode = "w", encoding="utf-8") as file:
-            json.dump(graph_to_JSON(dialog_graph), file, ensure_ascii=False, indent=4)
-        dialog_generator.generate_content(dialog_graph)   
-        print("--Контент до валидации--", json.dumps(graph_to_JSON(dialog_graph), ensure_ascii=False, indent=4), f"Время с начала выполнения программы: {time.time() - start_time}", sep = "\n", end = "\n\n=====\n\n", flush=True)
-        with open("content_before_validation.txt", mode = "w", encoding="utf-8") as file:
-            json.dump(graph_to_JSON(dialog_graph), file, ensure_ascii=False, indent=4)
-        dialog_validator.validate_content(dialog_graph)
-        print("--Контент после валидации--", json.dumps(graph_to_JSON(dialog_graph), ensure_ascii=False, indent=4), f"Время с начала выполнения программы: {time.time() - start_time}", sep = "\n", end = "\n\n=====\n\n", flush=True)
-        with open("content_after_validation.txt", mode = "w", encoding="utf-8") as file:
-            json.dump(graph_to_JSON(dialog_graph), file, ensure_ascii=False, indent=4)
-        dialog_regenerator.regenerate_content(dialog_validator, dialog_graph)
-        print("--Контент после перегенерации--", json.dumps(graph_to_JSON(dialog_graph), ensure_ascii=False, indent=4), f"Время с начала выполнения программы: {time.time() - start_time}", sep = "\n", end = "\n\n=====\n\n", flush=True)
-        with open("dialogue.txt", mode = "w", encoding="utf-8") as file:
-            json.dump(graph_to_JSON(dialog_graph), file, ensure_ascii=False, indent=4)
-        return graph_to_JSON(dialog_graph)
-
-class DialogSettings:
-    def __init__(self, params: dict):
-
-        self.api_key = os.getenv("DEEPSEEK_API_KEY")
-        self.client = OpenAI(api_key=self.api_key, base_url="https://api.deepseek.com")
+        dialog_generator = DialogGenerator(self.params, self.artifacts, self.metrics)
+        dialog_validator = DialogValidator(self.params, self.artifacts, self.metrics)
+        dialog_regenerator = DialogRegenerator(self.params, self.artifacts, self.metrics)
+        print(f"--Начало генерации {self.job_id}--", flush=True)
+        try:
+            with self.metrics.stage("structure_generation"):
+                dialog_graph = JSON_to_graph(dialog_generator.generate_structure())
+            print("--Структура до валидации--", self.get_elapsed(), sep = "\n", end = "\n\n=====\n\n", flush=True)
+            if self.artifacts.enabled:
+                self.artifacts.write_json("structure_before_validation.txt", graph_to_JSON(dialog_graph))
+            with self.metrics.stage("structure_validation"):
+                structure_validation = dialog_validator.validate_structure(dialog_graph)
+            self.artifacts.write("structure_validation.txt", str(structure_validation))
+            print("--Оценка валидации--", structure_validation, sep = "\n", end = "\n\n=====\n\n", flush=True)
+            validation_cnt = 0
+            while not structure_validation[0] and validation_cnt < 3:
+                with self.metrics.stage("structure_regeneration"):
+                    dialog_graph = JSON_to_graph(dialog_regenerator.regenerate_structure(dialog_graph, structure_validation[1]))
+                if self.artifacts.enabled:
+                    self.artifacts.write_json(f"structure_regeneration_{validation_cnt}.txt", graph_to_JSON(dialog_graph))
+                with self.metrics.stage("structure_validation"):
+                    structure_validation = dialog_validator.validate_structure(dialog_graph)
+                self.artifacts.write("structure_validation.txt", str(structure_validation))
+                print("--Оценка валидации--", structure_validation, sep = "\n", end = "\n\n=====\n\n")
+                validation_cnt += 1
+            print("--Структура после валидации--", self.get_elapsed(), sep = "\n", end = "\n\n=====\n\n", flush=True)
+            if self.artifacts.enabled:
+                self.artifacts.write_json("structure_after_validation.txt", graph_to_JSON(dialog_graph))
+            with self.metrics.stage("content_generation"):
+                dialog_generator.generate_content(dialog_graph)
+            print("--Контент до валидации--", self.get_elapsed(), sep = "\n", end = "\n\n=====\n\n", flush=True)
+            if self.artifacts.enabled:
+                self.artifacts.write_json("content_before_validation.txt", graph_to_JSON(dialog_graph))
+            with self.metrics.stage("content_validation"):
+                dialog_validator.validate_content(dialog_graph)
+            print("--Контент после валидации--", self.get_elapsed(), sep = "\n", end = "\n\n=====\n\n", flush=True)
+            if self.artifacts.enabled:
+                self.artifacts.write_json("content_after_validation.txt", graph_to_JSON(dialog_graph))
+            with self.metrics.stage("content_regeneration"):
+                dialog_regenerator.regenerate_content(dialog_validator, dialog_graph)
+            print("--Контент после перегенерации--", self.get_elapsed(), sep = "\n", end = "\n\n=====\n\n", flush=True)
+        finally:
+            self.metrics.finish()
+            self.artifacts.write_json("metrics.txt", self.metrics.summary())
+        dialogue = graph_to_JSON(dialog_graph)
+        self.artifacts.write_json("dialogue.txt", dialogue)
+        return dialogue
 
-        
-        self.model_type_structure_generation = os.getenv("MODEL_TYPE_STRUCTURE_GENERATION")
-        self.model_type_dialogue_generation = os.getenv("MODEL_TYPE_DIALOGUE_GENERATION")
-        self.model_type_structure_validation = os.getenv("MODEL_TYPE_STRUCTURE_VALIDATION")
-        self.model_type_dialogue_validation = os.getenv("MODEL_TYPE_DIALOGUE_VALIDATION")
-        self.model_type_structure_regeneration = os.getenv("MODEL_TYPE_STRUCTURE_REGENERATION")
-        self.model_type_dialogue_regeneration = os.getenv("MODEL_TYPE_DIALOGUE_REGENERATION")
-        # print(self.model_type_structure_generation)
-
-        self.model_max_tokens_structure_generation = int(os.getenv("MODEL_MAX_TOKENS_STRUCTURE_GENERATION", 8192))
-        self.model_max_tokens_dialogue_generation = int(os.getenv("MODEL_MAX_TOKENS_DIALOGUE_GENERATION", 8192))
-        self.model_max_tokens_structure_validation = int(os.getenv("MODEL_MAX_TOKENS_STRUCTURE_VALIDATION", 8192))
-        self.model_max_tokens_dialogue_validation = int(os.getenv("MODEL_MAX_TOKENS_DIALOGUE_VALIDATION", 8192))
-        self.model_max_tokens_structure_regeneration = int(os.getenv("MODEL_MAX_TOKENS_STRUCTURE_REGENERATION", 8192))
-        self.model_max_tokens_dialogue_regeneration = int(os.getenv("MODEL_MAX_TOKENS_DIALOGUE_REGENERATION", 8192))
+    def get_elapsed(self):
+        summary = self.metrics.summary()["total"]
+        return f"Время с начала выполнения программы: {summary['wall_time']:.1f} c, вызовов LLM: {summary['llm_calls']}, токенов: {summary['prompt_tokens']} + {summary['completion_tokens']}"
 
+class DialogSettings:
+    def __init__(self, params: dict, artifacts=None, metrics=None):
+        self.artifacts = artifacts if artifacts is not None else NullArtifacts()
+        self.metrics = metrics if metrics is not None else PipelineMetrics()
+        self.config = LLMClient.get_config()
+        self.client = LLMClient.get_client()
+        self.dialogue_generation_concurrency = self.config.dialogue_generation_concurrency
 
         self.params = params
         self.npc = self.params["npc"]
         self.hero = self.params["hero"]
         self.goals = self.params["goals"]
         self.llm_settings = LLMSettings()
+
+    def request_llm(self, stage, prompt, response_format=None, parse=None):
+        # parse - разбор ответа (json.loads и т.п.), возвращается его результат. В кэш ответ пишется только
+        # после успешного разбора: иначе битый ответ отдавался бы из кэша при каждом повторе до конца TTL
+        model = self.config.models[stage]
+        max_tokens = self.config.max_tokens[stage]
+        messages = [
+            {"role": "system", "content": self.llm_settings.get_system_prompt()},
+            {"role": "user", "content": prompt},
+        ]
+        start_time = time.perf_counter()
+        use_cache = LLMCache.is_enabled(stage)
+        if use_cache:
+            cache_key = LLMCache.make_key(model, messages, max_tokens, response_format)
+            content = LLMCache.get(stage, cache_key)
+            if content is not None:
+                self.metrics.record_llm_call(stage, time.perf_counter() - start_time, cached=True)
+                return parse(content) if parse else content
+        request = {"model": model, "messages": messages, "stream": False, "max_tokens": max_tokens}
+        if response_format:
+            request["response_format"] = response_format
+        estimated_tokens = LLMGovernor.estimate_tokens(messages)
+        try:
+            # raw-ответ нужен governor'у ради заголовков x-ratelimit-*
+            raw_response, retries = LLMGovernor.call(
+                lambda: self.client.chat.completions.with_raw_response.create(**request, timeout=self.config.timeouts[stage]),
+                estimated_tokens
+            )
+            response = raw_response.parse()
+        except Exception:
+            self.metrics.record_llm_call(stage, time.perf_counter() - start_time, error=True)
+            raise
+        LLMGovernor.settle_tokens(estimated_tokens, response.usage)
+        self.metrics.record_llm_call(stage, time.perf_counter() - start_time, usage=response.usage, retries=retries)
+        content = response.choices[0].message.content
+        result = parse(content) if parse else content
+        # пустой или обрезанный по max_tokens ответ не кэшируется, даже если разобрался
+        if use_cache and content and response.choices[0].finish_reason != "length":
+            LLMCache.set(stage, cache_key, content)
+        return result
     
 class DialogGenerator(DialogSettings):
 
     def generate_structure(self):
-        with open("resources/prompt_structure.txt", encoding='utf-8', mode="r") as prompt_structure:
-            prompt_structure = Template(prompt_structure.read()).safe_substitute(
-                json_structure=self.llm_settings.get_structure(),
-                json_node_structure=self.llm_settings.get_node_structure(),
-                NPC_name=self.npc["name"],
-                NPC_talk_style=self.npc["talk_style"],
-                NPC_profession=self.npc["profession"],
-                NPC_look=self.npc["look"],
-                NPC_traits=self.npc["traits"],
-                NPC_extra=self.npc["extra"],
-                hero_name=self.hero["name"],
-                hero_talk_style=self.hero["talk_style"],
-                hero_profession=self.hero["profession"],
-                hero_look=self.hero["look"],
-                hero_extra=self.hero["extra"],
-                hero_traits=self.hero["traits"],
-                NPC_to_hero_relation=self.params["NPC_to_hero_relation"],
-                hero_to_NPC_relation=self.params["hero_to_NPC_relation"],
-                world_settings=self.params["world_settings"],
-                scene = self.params["scene"],
-                genre = self.params["genre"],
-                epoch = self.params["epoch"],
-                tonality = self.params["tonality"],
-                extra = self.params["extra"],
-                context = self.params["context"],
-                mx_answers_cnt=self.params["mx_answers_cnt"],
-                mn_answers_cnt=self.params["mn_answers_cnt"],
-                mx_depth=self.params["mx_depth"],
-                mn_depth=self.params["mn_depth"],
-                moods_list=self.llm_settings.get_moods(),
-                goals=self.goals,
-                items_dict = self.params["items_dict"]
-                )
-        with open("prompt_structure_res.txt", mode = "w", encoding="utf-8") as file:
-            file.write(prompt_structure)
-        structure_response = self.client.chat.completions.create(
-            model=self.model_type_structure_generation,
-            messages=[
-                {"role": "system", "content": self.llm_settings.get_system_prompt()},
-                {"role": "user", "content": prompt_structure},
-            ],
-            stream=False,
-            max_tokens=self.model_max_tokens_structure_generation,
-            response_format={
-                'type': 'json_object'
-            }
+        prompt_structure = PromptRegistry.render(
+            "structure",
+            json_structure=self.llm_settings.get_structure(),
+            json_node_structure=self.llm_settings.get_node_structure(),
+            NPC_name=self.npc["name"],
+            NPC_talk_style=self.npc["talk_style"],
+            NPC_profession=self.npc["profession"],
+            NPC_look=self.npc["look"],
+            NPC_traits=self.npc["traits"],
+            NPC_extra=self.npc["extra"],
+            hero_name=self.hero["name"],
+            hero_talk_style=self.hero["talk_style"],
+            hero_profession=self.hero["profession"],
+            hero_look=self.hero["look"],
+            hero_extra=self.hero["extra"],
+            hero_traits=self.hero["traits"],
+            NPC_to_hero_relation=self.params["NPC_to_hero_relation"],
+            hero_to_NPC_relation=self.params["hero_to_NPC_relation"],
+            world_settings=self.params["world_settings"],
+            scene = self.params["scene"],
+            genre = self.params["genre"],
+            epoch = self.params["epoch"],
+            tonality = self.params["tonality"],
+            extra = self.params["extra"],
+            context = self.params["context"],
+            mx_answers_cnt=self.params["mx_answers_cnt"],
+            mn_answers_cnt=self.params["mn_answers_cnt"],
+            mx_depth=self.params["mx_depth"],
+            mn_depth=self.params["mn_depth"],
+            moods_list=self.llm_settings.get_moods(),
+            goals=self.goals,
+            items_dict = self.params["items_dict"]
         )
-        structure = json.loads(structure_response.choices[0].message.content)
+        self.artifacts.write("prompt_structure_res.txt", prompt_structure)
+        structure = self.request_llm("structure_generation", prompt_structure, response_format={'type': 'json_object'}, parse=json.loads)
         return structure
 
     def generate_content(self, dialog_graph):
-        q = deque()
-        start_node = list(dialog_graph.nodes)[0]
-        q.append(start_node)
-        used = []
-        while q:
-            t = q.popleft()
-            used.append(t)
-            next_tematics = {"tematics": []}
-            prev_dialog_chains = get_prev_dialog_chains(dialog_graph, t)
-            next_nodes = list(dialog_graph.adj[t].keys())
-            for next_node in next_nodes:
-                next_tematics["tematics"].append({"id": next_node, "info": dialog_graph.nodes[next_node]["info"], "mood": dialog_graph.edges[t, next_node]["mood"]})
-                if next_node not in q and next_node not in used:
-                    q.append(next_node)
-            with open("resources/prompt_nodes_content.txt", encoding='utf-8', mode="r") as prompt_nodes_content:
-                prompt_nodes_content = Template(prompt_nodes_content.read()).safe_substitute(
-                    chain="\n = = = = \n".join(prev_dialog_chains),
-                    tematic=dialog_graph.nodes[t]["info"],
-                    world_settings=self.params["world_settings"],
-                    name=self.npc["name"],
-                    talk_style=self.npc["talk_style"],
-                    profession=self.npc["profession"],
-                    traits=self.npc["traits"],
-                    scene=self.params["scene"],
-                    extra=self.params["extra"],
-                    look=self.npc["look"],
-                    NPC_extra = self.npc["extra"],
-                    mood=dialog_graph.nodes[t]["mood"],
-                    relation=self.params["NPC_to_hero_relation"]
-                )
-            node_content_response = self.client.chat.completions.create(
-                model=self.model_type_dialogue_generation,
-                messages=[
-                    {"role": "system", "content": self.llm_settings.get_system_prompt()},
-                    {"role": "user", "content": prompt_nodes_content},
-                ],
-                stream=False,
-                max_tokens=self.model_max_tokens_dialogue_generation 
-            )
-            
-            dialog_graph.nodes[t]["line"] = node_content_response.choices[0].message.content.strip("\"\'")
-            for i in range(0, len(prev_dialog_chains)):
-                prev_dialog_chains[i] += f'**NPC**: {dialog_graph.nodes[t]["line"]}\n'
-            with open("resources/prompt_edges_content.txt", encoding='utf-8', mode="r") as prompt:
-                prompt_edges_content = Template(prompt.read()).safe_substitute(
-                    json_edge_structure=self.llm_settings.get_edge_structure(),
-                    chain="\n = = = = \n".join(prev_dialog_chains),
-                    tematics=next_tematics,
-                    replic_cnt=len(next_tematics),
-                    world_settings=self.params["world_settings"],
-                    name=self.hero["name"],
-                    talk_style=self.hero["talk_style"],
-                    profession=self.hero["profession"],
-                    traits=self.hero["traits"],
-                    look=self.hero["look"],
-                    hero_extra=self.hero["extra"],
-                    mood=dialog_graph.nodes[t]["mood"],
-                    extra=self.params["extra"],
-                    scene=self.params["scene"],
-                    relation=self.params["hero_to_NPC_relation"],
-                    json_tematics = self.llm_settings.get_json_tematics()
-                )
-            with open("prompt_nodes_content_res.txt", mode = "w", encoding="utf-8") as file:
-                file.write(prompt_nodes_content)
-            with open("prompt_edges_content_res.txt", mode = "w", encoding="utf-8") as file:
-                file.write(prompt_edges_content)
-            if len(next_nodes):
-                edges_content_response = self.client.chat.completions.create(
-                    model=self.model_type_dialogue_generation,
-                    messages=[
-                        {"role": "system", "content": self.llm_settings.get_system_prompt()},
-                        {"role": "user", "content": prompt_edges_content},
-                    ],
-                    stream=False,
-                    response_format={
-                        'type': 'json_object'
-                    },
-                    max_tokens=self.model_max_tokens_dialogue_generation
-                )
-                edges_content = json.loads(edges_content_response.choices[0].message.content)["lines"]
-                print(f"{t}. Q: {dialog_graph.nodes[t]['line']}, A: {edges_content}")
-                # print("--answers--")
-                # print(edges_content)
-                for line in edges_content:
-                    for key in line.keys():
-                        dialog_graph.edges[t, int(line["id"])][key] = line[key]
-                        if type(line[key]) == str:
-                            dialog_graph.edges[t, int(line["id"])][key] = dialog_graph.edges[t, int(line["id"])][key].strip("\"\'")
-
+        # Вершины, все предшествующие реплики которых уже готовы, генерируются параллельно
+        order = get_bfs_order(dialog_graph)
+        dependencies = get_content_dependencies(dialog_graph, order)
+        chain_index = DialogChainIndex(dialog_graph)
+        pending = list(order)
+        running = {}
+        done = set()
+        with ThreadPoolExecutor(max_workers=self.dialogue_generation_concurrency) as executor:
+            while pending or running:
+                for node in list(pending):
+                    if dependencies[node] <= done:
+                        pending.remove(node)
+                        running[executor.submit(self.generate_node_content, dialog_graph, node, chain_index)] = node
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    future.result()
+                    done.add(running.pop(future))
         return dialog_graph
 
+    def generate_node_content(self, dialog_graph, t, chain_index):
+        next_tematics = {"tematics": []}
+        prev_dialog_chains = chain_index.get_chains(t)
+        next_nodes = list(dialog_graph.adj[t].keys())
+        for next_node in next_nodes:
+            next_tematics["tematics"].append({"id": next_node, "info": dialog_graph.nodes[next_node]["info"], "mood": dialog_graph.edges[t, next_node]["mood"]})
+        prompt_nodes_content = PromptRegistry.render(
+            "nodes_content",
+            chain="\n = = = = \n".join(prev_dialog_chains),
+            tematic=dialog_graph.nodes[t]["info"],
+            world_settings=self.params["world_settings"],
+            name=self.npc["name"],
+            talk_style=self.npc["talk_style"],
+            profession=self.npc["profession"],
+            traits=self.npc["traits"],
+            scene=self.params["scene"],
+            extra=self.params["extra"],
+            look=self.npc["look"],
+            NPC_extra = self.npc["extra"],
+            mood=dialog_graph.nodes[t]["mood"],
+            relation=self.params["NPC_to_hero_relation"]
+        )
+        node_content_response = self.request_llm("dialogue_generation", prompt_nodes_content)
+        
+        dialog_graph.nodes[t]["line"] = node_content_response.strip("\"\'")
+        for i in range(0, len(prev_dialog_chains)):
+            prev_dialog_chains[i] += f'**NPC**: {dialog_graph.nodes[t]["line"]}\n'
+        prompt_edges_content = PromptRegistry.render(
+            "edges_content",
+            json_edge_structure=self.llm_settings.get_edge_structure(),
+            chain="\n = = = = \n".join(prev_dialog_chains),
+            tematics=next_tematics,
+            replic_cnt=len(next_tematics),
+            world_settings=self.params["world_settings"],
+            name=self.hero["name"],
+            talk_style=self.hero["talk_style"],
+            profession=self.hero["profession"],
+            traits=self.hero["traits"],
+            look=self.hero["look"],
+            hero_extra=self.hero["extra"],
+            mood=dialog_graph.nodes[t]["mood"],
+            extra=self.params["extra"],
+            scene=self.params["scene"],
+            relation=self.params["hero_to_NPC_relation"],
+            json_tematics = self.llm_settings.get_json_tematics()
+        )
+        self.artifacts.write(f"prompt_nodes_content_res_{t}.txt", prompt_nodes_content)
+        self.artifacts.write(f"prompt_edges_content_res_{t}.txt", prompt_edges_content)
+        if len(next_nodes):
+            edges_content = self.request_llm("dialogue_generation", prompt_edges_content, response_format={'type': 'json_object'}, parse=parse_lines)
+            print(f"{t}. Q: {dialog_graph.nodes[t]['line']}, A: {edges_content}")
+            # print("--answers--")
+            # print(edges_content)
+            for line in edges_content:
+                for key in line.keys():
+                    dialog_graph.edges[t, int(line["id"])][key] = line[key]
+                    if type(line[key]) == str:
+                        dialog_graph.edges[t, int(line["id"])][key] = dialog_graph.edges[t, int(line["id"])][key].strip("\"\'")
+
 class DialogValidator(DialogSettings):
 
     def interpret_rate(self, rate_result):
@@ -303,18 +427,22 @@ class DialogValidator(DialogSettings):
             return (0, rate_result)
         return (1, rate_result)
     
-    def validate_connectivity(self, dialog_graph, node = None, used = []):
+    def validate_connectivity(self, dialog_graph, node = None, used = None):
         if node is None:
             node = list(dialog_graph.nodes)[0]
+        if used is None:
+            used = []
         used.append(node)
         for next_node in list(dialog_graph.adj[node].keys()):
             if next_node not in used:
                 self.validate_connectivity(dialog_graph, next_node, used)
         return used
     
-    def validate_nodes_type(self, dialog_graph, node = None, used = [], mTypeCnt = 0):
+    def validate_nodes_type(self, dialog_graph, node = None, used = None, mTypeCnt = 0):
         if node is None:
             node = list(dialog_graph.nodes)[0]
+        if used is None:
+            used = []
         used.append(node)
         curType = ""
         if len(list(dialog_graph.adj[node].keys())) == 0:
@@ -350,63 +478,50 @@ class DialogValidator(DialogSettings):
         self.validate_nodes_type(dialog_graph)
         return dialog_graph
     def validate_structure_llm(self, structure):
-        with open("resources/prompt_structure_validation.txt", encoding = 'utf-8', mode= "r") as prompt_edges_content:
-            prompt_structure_validation = Template(prompt_edges_content.read()).safe_substitute(
-                json_structure=self.llm_settings.get_structure(),
-                json_node_structure=self.llm_settings.get_node_structure(),
-                NPC_name=self.npc["name"],
-                NPC_talk_style=self.npc["talk_style"],
-                NPC_profession=self.npc["profession"],
-                NPC_look=self.npc["look"],
-                NPC_traits=self.npc["traits"],
-                NPC_extra=self.npc["extra"],
-                hero_name=self.hero["name"],
-                hero_talk_style=self.hero["talk_style"],
-                hero_profession=self.hero["profession"],
-                hero_look=self.hero["look"],
-                hero_extra=self.hero["extra"],
-                hero_traits=self.hero["traits"],
-                NPC_to_hero_relation=self.params["NPC_to_hero_relation"],
-                hero_to_NPC_relation=self.params["hero_to_NPC_relation"],
-                world_settings=self.params["world_settings"],
-                scene = self.params["scene"],
-                genre = self.params["genre"],
-                epoch = self.params["epoch"],
-                tonality = self.params["tonality"],
-                extra = self.params["extra"],
-                context = self.params["context"],
-                mx_answers_cnt=self.params["mx_answers_cnt"],
-                mn_answers_cnt=self.params["mn_answers_cnt"],
-                mx_depth=self.params["mx_depth"],
-                mn_depth=self.params["mn_depth"],
-                moods_list=self.llm_settings.get_moods(),
-                goals=self.goals,
-                structure = structure,
-                json_metrics = self.llm_settings.get_json_metrics(),
-                items_dict = self.params["items_dict"]
-        )
-        with open("prompt_structure_validation_res.txt", mode = "w", encoding="utf-8") as file:
-            file.write(prompt_structure_validation)
-        structure_validation_response = self.client.chat.completions.create(
-            model=self.model_type_structure_validation,
-            messages=[
-                {"role": "system", "content": self.llm_settings.get_system_prompt()},
-                {"role": "user", "content": prompt_structure_validation},
-            ],
-            stream=False,
-            max_tokens=self.model_max_tokens_structure_validation,
-            response_format={
-                'type': 'json_object'
-            }
+        prompt_structure_validation = PromptRegistry.render(
+            "structure_validation",
+            json_structure=self.llm_settings.get_structure(),
+            json_node_structure=self.llm_settings.get_node_structure(),
+            NPC_name=self.npc["name"],
+            NPC_talk_style=self.npc["talk_style"],
+            NPC_profession=self.npc["profession"],
+            NPC_look=self.npc["look"],
+            NPC_traits=self.npc["traits"],
+            NPC_extra=self.npc["extra"],
+            hero_name=self.hero["name"],
+            hero_talk_style=self.hero["talk_style"],
+            hero_profession=self.hero["profession"],
+            hero_look=self.hero["look"],
+            hero_extra=self.hero["extra"],
+            hero_traits=self.hero["traits"],
+            NPC_to_hero_relation=self.params["NPC_to_hero_relation"],
+            hero_to_NPC_relation=self.params["hero_to_NPC_relation"],
+            world_settings=self.params["world_settings"],
+            scene = self.params["scene"],
+            genre = self.params["genre"],
+            epoch = self.params["epoch"],
+            tonality = self.params["tonality"],
+            extra = self.params["extra"],
+            context = self.params["context"],
+            mx_answers_cnt=self.params["mx_answers_cnt"],
+            mn_answers_cnt=self.params["mn_answers_cnt"],
+            mx_depth=self.params["mx_depth"],
+            mn_depth=self.params["mn_depth"],
+            moods_list=self.llm_settings.get_moods(),
+            goals=self.goals,
+            structure = structure,
+            json_metrics = self.llm_settings.get_json_metrics(),
+            items_dict = self.params["items_dict"]
         )
-        rate_result = json.loads(structure_validation_response.choices[0].message.content)["metrics"]
+        self.artifacts.write("prompt_structure_validation_res.txt", prompt_structure_validation)
+        rate_result = self.request_llm("structure_validation", prompt_structure_validation, response_format={'type': 'json_object'}, parse=parse_metrics)
         return rate_result
     def validate_structure(self, dialog_graph):
         structure = graph_to_JSON(self.validate_structure_alg(dialog_graph))
         return self.interpret_rate(self.validate_structure_llm(structure))
     def validate_content_llm(self, line, dialog_chains, character_stats, character):
-        with open("resources/prompt_content_validation.txt", encoding = 'utf-8', mode= "r") as prompt_content_validation:
-            prompt_content_validation = Template(prompt_content_validation.read()).safe_substitute(
+        prompt_content_validation = PromptRegistry.render(
+            "content_validation",
             character = character,
             interlocutor = "игрок" if character == "NPC" else "NPC",
             dialog_chains = dialog_chains,
@@ -425,22 +540,9 @@ class DialogValidator(DialogSettings):
             extra = self.params["extra"],
             json_metrics = self.llm_settings.get_json_metrics(),
             scene=self.params["scene"]
-        )  
-        with open("prompt_content_validation_res.txt", mode = "w", encoding="utf-8") as file:
-            file.write(prompt_content_validation)
-        validation_content_response = self.client.chat.completions.create(
-            model=self.model_type_dialogue_validation,
-            messages=[
-                {"role": "system", "content": self.llm_settings.get_system_prompt()},
-                {"role": "user", "content": prompt_content_validation},
-            ],
-            stream=False,
-            response_format={
-                'type': 'json_object'
-            },
-            max_tokens=self.model_max_tokens_dialogue_validation
         )
-        rate_result = json.loads(validation_content_response.choices[0].message.content)["metrics"]
+        self.artifacts.write("prompt_content_validation_res.txt", prompt_content_validation)
+        rate_result = self.request_llm("dialogue_validation", prompt_content_validation, response_format={'type': 'json_object'}, parse=parse_metrics)
         return rate_result
     def prune_children(self, dialog_graph, node, used):
         if node not in used:
@@ -468,6 +570,7 @@ class DialogValidator(DialogSettings):
             self.prune_children(dialog_graph, edge[1], used)
         return result[0]
     def validate_content(self, dialog_graph):
+        chain_index = DialogChainIndex(dialog_graph)
         q = deque()
         start_node = list(dialog_graph.nodes)[0]
         q.append(start_node)
@@ -475,7 +578,7 @@ class DialogValidator(DialogSettings):
         while q:
             t = q.popleft()
             used.append(t)
-            prev_dialog_chains = get_prev_dialog_chains(dialog_graph, t)
+            prev_dialog_chains = chain_index.get_chains(t)
             next_nodes = list(dialog_graph.adj[t].keys())
             if not self.validate_node_line(dialog_graph, prev_dialog_chains, t, used):
                 continue
@@ -495,59 +598,47 @@ class DialogRegenerator(DialogSettings):
         return result
 
     def regenerate_structure(self, structure, metrics):
-        with open("resources/prompt_structure_regeneration.txt", encoding='utf-8', mode="r") as prompt_structure:
-            prompt_structure = Template(prompt_structure.read()).safe_substitute(
-                json_structure=self.llm_settings.get_structure(),
-                json_node_structure=self.llm_settings.get_node_structure(),
-                NPC_name=self.npc["name"],
-                NPC_talk_style=self.npc["talk_style"],
-                NPC_profession=self.npc["profession"],
-                NPC_look=self.npc["look"],
-                NPC_traits=self.npc["traits"],
-                NPC_extra=self.npc["extra"],
-                hero_name=self.hero["name"],
-                hero_talk_style=self.hero["talk_style"],
-                hero_profession=self.hero["profession"],
-                hero_look=self.hero["look"],
-                hero_extra=self.hero["extra"],
-                hero_traits=self.hero["traits"],
-                NPC_to_hero_relation=self.params["NPC_to_hero_relation"],
-                hero_to_NPC_relation=self.params["hero_to_NPC_relation"],
-                world_settings=self.params["world_settings"],
-                scene = self.params["scene"],
-                genre = self.params["genre"],
-                epoch = self.params["epoch"],
-                tonality = self.params["tonality"],
-                extra = self.params["extra"],
-                context = self.params["context"],
-                mx_answers_cnt=self.params["mx_answers_cnt"],
-                mn_answers_cnt=self.params["mn_answers_cnt"],
-                mx_depth=self.params["mx_depth"],
-                mn_depth=self.params["mn_depth"],
-                moods_list=self.llm_settings.get_moods(),
-                goals=self.goals,
-                structure = structure,
-                comments = self.convert_metrics(metrics)
-                )
-        with open("prompt_structure_regen_res.txt", mode = "w", encoding="utf-8") as file:
-            file.write(prompt_structure)
-        structure_response = self.client.chat.completions.create(
-            model=self.model_type_structure_regeneration,
-            messages=[
-                {"role": "system", "content": self.llm_settings.get_system_prompt()},
-                {"role": "user", "content": prompt_structure},
-            ],
-            stream=False,
-            max_tokens=self.model_max_tokens_structure_regeneration,
-            response_format={
-                'type': 'json_object'
-            }
+        prompt_structure = PromptRegistry.render(
+            "structure_regeneration",
+            json_structure=self.llm_settings.get_structure(),
+            json_node_structure=self.llm_settings.get_node_structure(),
+            NPC_name=self.npc["name"],
+            NPC_talk_style=self.npc["talk_style"],
+            NPC_profession=self.npc["profession"],
+            NPC_look=self.npc["look"],
+            NPC_traits=self.npc["traits"],
+            NPC_extra=self.npc["extra"],
+            hero_name=self.hero["name"],
+            hero_talk_style=self.hero["talk_style"],
+            hero_profession=self.hero["profession"],
+            hero_look=self.hero["look"],
+            hero_extra=self.hero["extra"],
+            hero_traits=self.hero["traits"],
+            NPC_to_hero_relation=self.params["NPC_to_hero_relation"],
+            hero_to_NPC_relation=self.params["hero_to_NPC_relation"],
+            world_settings=self.params["world_settings"],
+            scene = self.params["scene"],
+            genre = self.params["genre"],
+            epoch = self.params["epoch"],
+            tonality = self.params["tonality"],
+            extra = self.params["extra"],
+            context = self.params["context"],
+            mx_answers_cnt=self.params["mx_answers_cnt"],
+            mn_answers_cnt=self.params["mn_answers_cnt"],
+            mx_depth=self.params["mx_depth"],
+            mn_depth=self.params["mn_depth"],
+            moods_list=self.llm_settings.get_moods(),
+            goals=self.goals,
+            structure = structure,
+            comments = self.convert_metrics(metrics),
+            items_dict = self.params["items_dict"]
         )
-
-        structure = json.loads(structure_response.choices[0].message.content)
+        self.artifacts.write("prompt_structure_regen_res.txt", prompt_structure)
+        structure = self.request_llm("structure_regeneration", prompt_structure, response_format={'type': 'json_object'}, parse=json.loads)
         return structure
     
     def regenerate_content(self, dialog_validator, dialog_graph):
+        chain_index = DialogChainIndex(dialog_graph)
         q = deque()
         start_node = list(dialog_graph.nodes)[0]
         q.append(start_node)
@@ -558,7 +649,7 @@ class DialogRegenerator(DialogSettings):
             next_required_nodes_tematics = {"tematics": []}
             next_required_edges_lines = {"lines": []}
             next_required_nodes = []
-            prev_dialog_chains = get_prev_dialog_chains(dialog_graph, t)
+            prev_dialog_chains = chain_index.get_chains(t)
             next_nodes = list(dialog_graph.adj[t].keys())
             if not dialog_graph.nodes[t].get("validation_result"):
                 dialog_validator.validate_node_line(dialog_graph, prev_dialog_chains, t, copy.deepcopy(list(dialog_graph.adj[t])))
@@ -566,8 +657,8 @@ class DialogRegenerator(DialogSettings):
             bst_node_content = dialog_graph.nodes[t]
             bst_node_content_rate = get_avg_metrics_rate(dialog_graph.nodes[t]["validation_result"])
             while dialog_graph.nodes[t].get("need_regeneration", 1) and validation_node_cnt < 3:
-                with open("resources/prompt_nodes_content_regeneration.txt", encoding='utf-8', mode="r") as prompt_nodes_content:
-                    prompt_nodes_content = Template(prompt_nodes_content.read()).safe_substitute(
+                prompt_nodes_content = PromptRegistry.render(
+                    "nodes_content_regeneration",
                     chain="\n = = = = \n".join(prev_dialog_chains),
                     tematic=dialog_graph.nodes[t]["info"],
                     world_settings=self.params["world_settings"],
@@ -584,18 +675,9 @@ class DialogRegenerator(DialogSettings):
                     line = dialog_graph.nodes[t]["line"],
                     comments = self.convert_metrics(dialog_graph.nodes[t].get("validation_result"))
                 )
-                with open("prompt_nodes_content_regen_res.txt", mode = "w", encoding="utf-8") as file:
-                    file.write(prompt_nodes_content)
-                node_content_response = self.client.chat.completions.create(
-                    model=self.model_type_dialogue_regeneration,
-                    messages=[
-                        {"role": "system", "content": self.llm_settings.get_system_prompt()},
-                        {"role": "user", "content": prompt_nodes_content},
-                    ],
-                    stream=False,
-                    max_tokens=self.model_max_tokens_dialogue_regeneration
-                )
-                dialog_graph.nodes[t]["line"] = node_content_response.choices[0].message.content.strip("\"\'")
+                self.artifacts.write("prompt_nodes_content_regen_res.txt", prompt_nodes_content)
+                node_content_response = self.request_llm("dialogue_regeneration", prompt_nodes_content)
+                dialog_graph.nodes[t]["line"] = node_content_response.strip("\"\'")
                 dialog_validator.validate_node_line(dialog_graph, prev_dialog_chains, t, copy.deepcopy(list(dialog_graph.adj[t])))
                 if get_avg_metrics_rate(dialog_graph.nodes[t]["validation_result"]) > bst_node_content_rate:
                     bst_node_content = dialog_graph.nodes[t]
@@ -627,8 +709,8 @@ class DialogRegenerator(DialogSettings):
                 prev_dialog_chains[i] += f"**NPC**: {dialog_graph.nodes[t]['line']}\n"
             validation_edges_cnt = 0
             while len(next_required_nodes) and validation_edges_cnt < 3:
-                with open("resources/prompt_edges_content.txt", encoding='utf-8', mode="r") as prompt_edges_content:
-                    prompt_edges_content = Template(prompt_edges_content.read()).safe_substitute(
+                prompt_edges_content = PromptRegistry.render(
+                    "edges_content",
                     json_edge_structure=self.llm_settings.get_edge_structure(),
                     chain="\n = = = = \n".join(prev_dialog_chains),
                     tematics=next_required_nodes_tematics,
@@ -648,21 +730,8 @@ class DialogRegenerator(DialogSettings):
                     used_lines = used_lines,
                     json_edge_regeneration_structure = self.llm_settings.get_regen_edge_structure()
                 )
-                with open("prompt_edges_content_regen_res.txt", mode = "w", encoding="utf-8") as file:
-                    file.write(prompt_edges_content)
-                edges_content_response = self.client.chat.completions.create(
-                    model=self.model_type_dialogue_regeneration,
-                    messages=[
-                        {"role": "system", "content": self.llm_settings.get_system_prompt()},
-                        {"role": "user", "content": prompt_edges_content},
-                    ],
-                    stream=False,
-                    response_format={
-                        'type': 'json_object'
-                    },
-                    max_tokens=self.model_max_tokens_dialogue_regeneration
-                )
-                edges_content = json.loads(edges_content_response.choices[0].message.content)["lines"]
+                self.artifacts.write("prompt_edges_content_regen_res.txt", prompt_edges_content)
+                edges_content = self.request_llm("dialogue_regeneration", prompt_edges_content, response_format={'type': 'json_object'}, parse=parse_lines)
                 print(t, next_required_nodes)
                 next_required_tematics_new = {"tematics": []}
                 next_required_edges_lines_new = {"lines": []}
@@ -682,8 +751,8 @@ class DialogRegenerator(DialogSettings):
                     for next_node in next_nodes:
                         bst_edges_content[next_node] = dialog_graph.edges[t, next_node]
                     bst_edges_content_rate = sum(edges_content_rates.values())/len(edges_content_rates)
-                with open("log.txt", mode="a", encoding="utf-8") as log:
-                    log.write(json.dumps(graph_to_JSON(dialog_graph), ensure_ascii=False, indent=4) + str(edges_content_rates) + "\n\n=====\n\n" )
+                if self.artifacts.enabled:
+                    self.artifacts.append("log.txt", json.dumps(graph_to_JSON(dialog_graph), ensure_ascii=False, indent=4) + str(edges_content_rates) + "\n\n=====\n\n")
                 for tematic in next_required_nodes_tematics["tematics"]:
                     if tematic["id"] in next_required_nodes:
                         next_required_tematics_new["tematics"].append(tematic)
@@ -0,0 +1,237 @@
+import os
+import time
+import random
+import threading
+
+import openai
+from dotenv import load_dotenv
+
+from lib.metrics import Metrics
+
+load_dotenv()
+
+
+class LLMGovernorTimeout(Exception):
+    pass
+
+
+class TokenBucket:
+    # Ведро на минутный лимит. per_minute = 0 - без ограничения.
+    # Баланс может уйти в минус, когда фактический расход токенов оказался больше оценки
+    def __init__(self, per_minute):
+        self.per_minute = per_minute
+        self.tokens = float(per_minute)
+        self.updated_at = time.monotonic()
+
+    def refill(self, now):
+        if self.per_minute:
+            self.tokens = min(float(self.per_minute), self.tokens + (now - self.updated_at) * self.per_minute / 60)
+        self.updated_at = now
+
+    def get_wait_time(self, amount, now):
+        if not self.per_minute:
+            return 0.0
+        self.refill(now)
+        # запрос больше всего ведра пропускаем при полном ведре, иначе он не пройдёт никогда
+        amount = min(amount, self.per_minute)
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) * 60 / self.per_minute
+
+    def take(self, amount):
+        if self.per_minute:
+            self.tokens -= amount
+
+    def set_rate(self, per_minute, now):
+        self.refill(now)
+        self.per_minute = per_minute
+        self.tokens = min(self.tokens, float(per_minute))
+
+
+class LLMGovernor:
+    # Общий для процесса ограничитель вызовов DeepSeek: лимит одновременных запросов,
+    # ведра на запросы и токены в минуту и повторы с экспоненциальной задержкой.
+    # На 429 скорость уменьшается вдвое и все вызовы ждут Retry-After, после успешных ответов
+    # скорость постепенно возвращается к настроенной или к лимиту из заголовков x-ratelimit-*
+    _cond = threading.Condition()
+    _request_bucket = None
+
+    @classmethod
+    def init_governor(cls):
+        cls.max_in_flight = max(1, int(os.getenv("LLM_MAX_IN_FLIGHT", 16)))
+        cls.requests_per_minute = int(os.getenv("LLM_REQUESTS_PER_MINUTE", 300))
+        cls.tokens_per_minute = int(os.getenv("LLM_TOKENS_PER_MINUTE", 0))
+        cls.acquire_timeout = float(os.getenv("LLM_ACQUIRE_TIMEOUT", 600))
+        cls.backoff_base = float(os.getenv("LLM_BACKOFF_BASE", 1))
+        cls.backoff_max = float(os.getenv("LLM_BACKOFF_MAX", 60))
+        cls.max_retries = int(os.getenv("LLM_MAX_RETRIES", 4))
+        cls.in_flight = 0
+        cls.paused_until = 0.0
+        cls.rate_factor = 1.0
+        cls.header_limits = {"requests": None, "tokens": None}
+        cls._request_bucket = TokenBucket(cls.requests_per_minute)
+        cls._token_bucket = TokenBucket(cls.tokens_per_minute)
+
+    @classmethod
+    def check_governor(cls):
+        if cls._request_bucket is None:
+            with cls._cond:
+                if cls._request_bucket is None:
+                    cls.init_governor()
+
+    @classmethod
+    def estimate_tokens(cls, messages):
+        # До ответа известен только промпт: ~3 символа на токен для смеси русского и JSON.
+        # Ответ списывается из ведра по факту, см. settle_tokens
+        return sum(len(message["content"]) for message in messages) // 3 + 1
+
+    @classmethod
+    def acquire(cls, estimated_tokens):
+        start_time = time.monotonic()
+        deadline = start_time + cls.acquire_timeout
+        with cls._cond:
+            while True:
+                now = time.monotonic()
+                wait = max(
+                    cls.paused_until - now,
+                    cls._request_bucket.get_wait_time(1, now),
+                    cls._token_bucket.get_wait_time(estimated_tokens, now)
+                )
+                if wait <= 0 and cls.in_flight < cls.max_in_flight:
+                    cls._request_bucket.take(1)
+                    cls._token_bucket.take(estimated_tokens)
+                    cls.in_flight += 1
+                    break
+                if now >= deadline:
+                    raise LLMGovernorTimeout(f"LLM governor: no capacity for {cls.acquire_timeout} seconds")
+                # если ждём только освобождения слота, нас разбудит release
+                cls._cond.wait(min(wait, deadline - now) if wait > 0 else deadline - now)
+        Metrics.observe("llm_governor_wait_seconds", time.monotonic() - start_time, "Time an LLM call waited for the governor")
+
+    @classmethod
+    def release(cls):
+        with cls._cond:
+            cls.in_flight -= 1
+            cls._cond.notify_all()
+
+    @classmethod
+    def call(cls, request, estimated_tokens):
+        # request - функция без аргументов, возвращающая raw-ответ SDK (with_raw_response).
+        # Возвращает raw-ответ и число сделанных повторов
+        cls.check_governor()
+        attempt = 0
+        while True:
+            cls.acquire(estimated_tokens)
+            # слот освобождается до паузы перед повтором, чтобы не держать его впустую
+            try:
+                raw_response = request()
+                error = None
+            except Exception as e:
+                error = e
+            finally:
+                cls.release()
+            if error is None:
+                cls.on_success(raw_response.headers)
+                return raw_response, attempt
+            if not cls.is_retryable(error) or attempt >= cls.max_retries:
+                raise error
+            delay = cls.on_failure(error, attempt)
+            print(f"LLM request failed ({type(error).__name__}), retry {attempt + 1}/{cls.max_retries} in {delay:.1f} s", end="\n\n======\n\n")
+            time.sleep(delay)
+            attempt += 1
+
+    @classmethod
+    def is_retryable(cls, e):
+        if isinstance(e, (openai.APITimeoutError, openai.APIConnectionError, openai.RateLimitError)):
+            return True
+        return isinstance(e, openai.APIStatusError) and e.status_code >= 500
+
+    @classmethod
+    def get_retry_after(cls, headers):
+        if headers is None:
+            return None
+        try:
+            if headers.get("retry-after-ms"):
+                return float(headers["retry-after-ms"]) / 1000
+            if headers.get("retry-after"):
+                return float(headers["retry-after"])
+        except ValueError:
+            pass
+        return None
+
+    @classmethod
+    def on_failure(cls, e, attempt):
+        # full jitter: случайная задержка от 0 до base * 2^attempt
+        delay = random.uniform(0, min(cls.backoff_max, cls.backoff_base * 2 ** attempt))
+        response = getattr(e, "response", None)
+        retry_after = cls.get_retry_after(response.headers if response is not None else None)
+        if retry_after is not None:
+            delay = min(cls.backoff_max, max(delay, retry_after))
+        status = "timeout" if isinstance(e, (openai.APITimeoutError, openai.APIConnectionError)) else str(e.status_code)
+        Metrics.inc("llm_governor_retries_total", 1, "LLM calls retried by the governor", reason=status)
+        if isinstance(e, openai.RateLimitError):
+            with cls._cond:
+                cls.rate_factor = max(0.1, cls.rate_factor / 2)
+                cls.paused_until = max(cls.paused_until, time.monotonic() + delay)
+                cls.apply_rates()
+        return delay
+
+    @classmethod
+    def on_success(cls, headers):
+        with cls._cond:
+            for kind in ("requests", "tokens"):
+                limit = cls.parse_int(headers.get(f"x-ratelimit-limit-{kind}"))
+                if limit:
+                    cls.header_limits[kind] = limit
+            if cls.rate_factor < 1:
+                cls.rate_factor = min(1.0, cls.rate_factor + 0.05)
+            cls.apply_rates()
+            # остаток из заголовков точнее нашего счёта - другие процессы тоже тратят лимит
+            now = time.monotonic()
+            remaining_requests = cls.parse_int(headers.get("x-ratelimit-remaining-requests"))
+            if remaining_requests is not None and cls._request_bucket.per_minute:
+                cls._request_bucket.refill(now)
+                cls._request_bucket.tokens = min(cls._request_bucket.tokens, remaining_requests)
+            remaining_tokens = cls.parse_int(headers.get("x-ratelimit-remaining-tokens"))
+            if remaining_tokens is not None and cls._token_bucket.per_minute:
+                cls._token_bucket.refill(now)
+                cls._token_bucket.tokens = min(cls._token_bucket.tokens, remaining_tokens)
+
+    @classmethod
+    def apply_rates(cls):
+        now = time.monotonic()
+        for kind, configured, bucket in (
+            ("requests", cls.requests_per_minute, cls._request_bucket),
+            ("tokens", cls.tokens_per_minute, cls._token_bucket)
+        ):
+            limits = [limit for limit in (configured, cls.header_limits[kind]) if limit]
+            if limits:
+                bucket.set_rate(max(1, int(min(limits) * cls.rate_factor)), now)
+
+    @classmethod
+    def settle_tokens(cls, estimated_tokens, usage):
+        total_tokens = getattr(usage, "total_tokens", None)
+        if total_tokens is None:
+            return
+        with cls._cond:
+            cls._token_bucket.take(total_tokens - estimated_tokens)
+
+    @classmethod
+    def parse_int(cls, value):
+        try:
+            return int(float(value)) if value is not None else None
+        except ValueError:
+            return None
+
+    @classmethod
+    def get_stats(cls):
+        cls.check_governor()
+        with cls._cond:
+            return {
+                "in_flight": cls.in_flight,
+                "max_in_flight": cls.max_in_flight,
+                "requests_per_minute": cls._request_bucket.per_minute,
+                "tokens_per_minute": cls._token_bucket.per_minute,
+                "rate_factor": cls.rate_factor,
+                "paused_for": max(0.0, cls.paused_until - time.monotonic())
+            }
@@ -0,0 +1,87 @@
+import time
+import threading
+from contextlib import contextmanager
+
+from lib.metrics import Metrics
+
+
+class PipelineMetrics:
+    # Счётчики одной генерации по этапам конвейера. Этап задаёт Orchestrator,
+    # вызовы LLM из любых потоков генерации записываются в текущий этап.
+    # Те же данные уходят в общий реестр Metrics для /api/metrics
+    def __init__(self, job_id=None):
+        self.job_id = job_id
+        self.current_stage = None
+        self.started_at = time.time()
+        self.finished_at = None
+        self.stages = {}
+        self._lock = threading.Lock()
+
+    def get_stage(self, stage):
+        if stage not in self.stages:
+            self.stages[stage] = {
+                "runs": 0,
+                "wall_time": 0.0,
+                "llm_calls": 0,
+                "llm_time": 0.0,
+                "cache_hits": 0,
+                "errors": 0,
+                "retries": 0,
+                "prompt_tokens": 0,
+                "completion_tokens": 0
+            }
+        return self.stages[stage]
+
+    @contextmanager
+    def stage(self, stage):
+        previous_stage = self.current_stage
+        self.current_stage = stage
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start_time
+            self.current_stage = previous_stage
+            with self._lock:
+                stats = self.get_stage(stage)
+                stats["runs"] += 1
+                stats["wall_time"] += elapsed
+            Metrics.observe("dialogue_pipeline_stage_seconds", elapsed, "Wall time of a dialogue pipeline stage", stage=stage)
+
+    def record_llm_call(self, llm_stage, elapsed, usage=None, retries=0, cached=False, error=False):
+        stage = self.current_stage or llm_stage
+        prompt_tokens = getattr(usage, "prompt_tokens", 0) or 0
+        completion_tokens = getattr(usage, "completion_tokens", 0) or 0
+        with self._lock:
+            stats = self.get_stage(stage)
+            stats["llm_calls"] += 1
+            stats["llm_time"] += elapsed
+            stats["cache_hits"] += int(cached)
+            stats["errors"] += int(error)
+            stats["retries"] += retries
+            stats["prompt_tokens"] += prompt_tokens
+            stats["completion_tokens"] += completion_tokens
+
+        result = "error" if error else "cached" if cached else "ok"
+        Metrics.inc("dialogue_llm_calls_total", 1, "LLM calls by pipeline stage and result", stage=stage, result=result)
+        if not cached:
+            Metrics.observe("dialogue_llm_request_seconds", elapsed, "LLM request latency including retries and governor waits", stage=stage)
+        if retries:
+            Metrics.inc("dialogue_llm_retries_total", retries, "LLM request retries, by pipeline stage", stage=stage)
+        if prompt_tokens:
+            Metrics.inc("dialogue_llm_tokens_total", prompt_tokens, "Tokens reported in response.usage", stage=stage, kind="prompt")
+        if completion_tokens:
+            Metrics.inc("dialogue_llm_tokens_total", completion_tokens, "Tokens reported in response.usage", stage=stage, kind="completion")
+
+    def finish(self):
+        self.finished_at = time.time()
+
+    def summary(self):
+        with self._lock:
+            stages = {stage: dict(stats) for stage, stats in self.stages.items()}
+        total = {
+            key: sum(stats[key] for stats in stages.values())
+            for key in ("llm_calls", "llm_time", "cache_hits", "errors", "retries", "prompt_tokens", "completion_tokens")
+        }
+        total["wall_time"] = (self.finished_at or time.time()) - self.started_at
+        return {"current_stage": self.current_stage, "stages": stages, "total": total}
@@ -0,0 +1,151 @@
+import os
+import time
+import uuid
+import socket
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from dotenv import load_dotenv
+
+from db.database import DatabasePool
+from db.jobs_db import Jobs
+from lib.metrics import Metrics
+
+load_dotenv()
+
+
+class JobQueueFull(Exception):
+    pass
+
+
+class GenerationJobs:
+    # Генерация идёт в собственном пуле потоков, чтобы не занимать потоки Starlette,
+    # которые обслуживают авторизацию и работу с данными.
+    # Состояние задач - в generation_jobs (db.jobs_db): статус доступен из любого воркера и после перезапуска.
+    # В процессе остаются только его очередь и живые метрики идущих задач
+    _executor = None
+    _active = {}
+    _lock = threading.Lock()
+    _heartbeat = None
+    _stopped = None
+
+    @classmethod
+    def init_pool(cls):
+        cls.workers = int(os.getenv("GENERATION_WORKERS", 2))
+        cls.max_queued = int(os.getenv("GENERATION_QUEUE_SIZE", 20))
+        cls.job_ttl = int(os.getenv("GENERATION_JOB_TTL", 3600))
+        cls.heartbeat_interval = float(os.getenv("GENERATION_JOB_HEARTBEAT", 30))
+        cls.worker = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        cls._executor = ThreadPoolExecutor(max_workers=cls.workers, thread_name_prefix="generation")
+        cls._stopped = threading.Event()
+        cls._heartbeat = threading.Thread(target=cls.run_heartbeat, name="generation-heartbeat", daemon=True)
+        cls._heartbeat.start()
+
+    @classmethod
+    def check_pool(cls):
+        if not cls._executor:
+            cls.init_pool()
+
+    @classmethod
+    def submit(cls, db_conn, user_id, target, task, *args):
+        # target - (game_id, scene_id, script_id): по нему результат читается из generated_dialogues.
+        # db_conn - соединение запроса; None - строку задачи записать не удалось
+        cls.check_pool()
+        with cls._lock:
+            active = len(cls._active)
+            if active >= cls.workers + cls.max_queued:
+                raise JobQueueFull(f"Generation queue is full: {active} jobs")
+            job_id = uuid.uuid4().hex
+            cls._active[job_id] = {"status": "queued", "created_at": time.time(), "started_at": None, "metrics": None}
+        if not Jobs(db_conn).create_job(job_id, user_id, *target, cls.worker, cls.job_ttl):
+            with cls._lock:
+                cls._active.pop(job_id, None)
+            return None
+        cls._executor.submit(cls.run, job_id, task, *args)
+        return {"id": job_id, "status": "queued"}
+
+    @classmethod
+    def run(cls, job_id, task, *args):
+        cls.update(job_id, status="running", started_at=time.time())
+        status, error = "done", None
+        try:
+            with DatabasePool.connection() as db_conn:
+                Jobs(db_conn).start_job(job_id)
+            task(job_id, *args)
+        except Exception as e:
+            print(f"Generation job {job_id} failed: {e}", end="\n\n======\n\n")
+            status, error = "failed", str(getattr(e, "detail", e))
+        with cls._lock:
+            job = cls._active.pop(job_id, None)
+        if not job:
+            return
+        cls.record_finished(status, job, time.time())
+        try:
+            with DatabasePool.connection() as db_conn:
+                Jobs(db_conn).finish_job(job_id, status, error, job["metrics"].summary() if job["metrics"] else None)
+        except Exception as e:
+            # строка останется незавершённой и по устаревшему heartbeat будет отдана как прерванная
+            print(f"Generation job {job_id} status not saved: {e}", end="\n\n======\n\n")
+
+    @classmethod
+    def record_finished(cls, status, job, finished_at):
+        Metrics.inc("dialogue_generation_jobs_total", 1, "Finished generation jobs by status", status=status)
+        Metrics.observe("dialogue_generation_job_seconds", finished_at - job["started_at"], "Generation job run time", status=status)
+        Metrics.observe("dialogue_generation_queue_wait_seconds", job["started_at"] - job["created_at"], "Time a generation job waited in the queue")
+
+    @classmethod
+    def update(cls, job_id, **fields):
+        # Только состояние задачи в этом процессе (статус для очереди, метрики для heartbeat)
+        with cls._lock:
+            if job_id in cls._active:
+                cls._active[job_id].update(fields)
+
+    @classmethod
+    def get(cls, db_conn, job_id):
+        cls.check_pool()
+        job = Jobs(db_conn).get_job(job_id, cls.heartbeat_interval * 3)
+        if not job:
+            return None
+        job = dict(job)
+        # задача этого процесса: метрики свежее, чем записанные последним heartbeat
+        with cls._lock:
+            local = cls._active.get(job_id)
+            if local and local["metrics"]:
+                job["metrics"] = local["metrics"].summary()
+        return job
+
+    @classmethod
+    def get_counts(cls):
+        with cls._lock:
+            counts = {"queued": 0, "running": 0}
+            for job in cls._active.values():
+                counts[job["status"]] += 1
+            return counts
+
+    @classmethod
+    def run_heartbeat(cls):
+        while not cls._stopped.wait(cls.heartbeat_interval):
+            with cls._lock:
+                if not cls._active:
+                    continue
+                metrics = {job_id: job["metrics"].summary() for job_id, job in cls._active.items() if job["metrics"]}
+            try:
+                with DatabasePool.connection() as db_conn:
+                    Jobs(db_conn).heartbeat(cls.worker, metrics)
+            except Exception as e:
+                print(f"Generation jobs heartbeat failed: {e}", end="\n\n======\n\n")
+
+    @classmethod
+    def shutdown(cls):
+        if cls._executor:
+            cls._stopped.set()
+            cls._executor.shutdown(wait=False, cancel_futures=True)
+            cls._executor = None
+            # отменённые и прерванные задачи сразу видны как failed, не дожидаясь устаревания heartbeat
+            try:
+                with DatabasePool.connection() as db_conn:
+                    Jobs(db_conn).interrupt_jobs(cls.worker, "Generation was interrupted by server shutdown")
+            except Exception as e:
+                print(f"Generation jobs not interrupted: {e}", end="\n\n======\n\n")
+            with cls._lock:
+                cls._active.clear()
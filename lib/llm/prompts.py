@@ -0,0 +1,100 @@
+import os
+import threading
+from string import Template
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+STRUCTURE_FIELDS = {
+    "json_structure", "json_node_structure",
+    "NPC_name", "NPC_talk_style", "NPC_profession", "NPC_look", "NPC_traits", "NPC_extra",
+    "hero_name", "hero_talk_style", "hero_profession", "hero_look", "hero_extra", "hero_traits",
+    "NPC_to_hero_relation", "hero_to_NPC_relation", "world_settings", "scene", "genre", "epoch",
+    "tonality", "extra", "context", "mx_answers_cnt", "mn_answers_cnt", "mx_depth", "mn_depth",
+    "moods_list", "goals", "items_dict"
+}
+CHARACTER_FIELDS = {"name", "talk_style", "profession", "traits", "look", "relation", "world_settings", "scene", "extra"}
+NODES_CONTENT_FIELDS = CHARACTER_FIELDS | {"chain", "tematic", "NPC_extra", "mood"}
+EDGES_CONTENT_FIELDS = CHARACTER_FIELDS | {"json_edge_structure", "chain", "tematics", "replic_cnt", "hero_extra", "mood", "json_tematics"}
+
+
+class PromptTemplateError(Exception):
+    pass
+
+
+class PromptRegistry:
+    # Шаблоны промптов читаются и компилируются один раз и перечитываются только при изменении файла.
+    # fields - плейсхолдеры, которые передаёт генератор; другие плейсхолдеры в шаблоне считаются ошибкой
+    fields = {
+        "structure": STRUCTURE_FIELDS,
+        "structure_validation": STRUCTURE_FIELDS | {"structure", "json_metrics"},
+        "structure_regeneration": STRUCTURE_FIELDS | {"structure", "comments"},
+        "nodes_content": NODES_CONTENT_FIELDS,
+        "nodes_content_regeneration": NODES_CONTENT_FIELDS | {"line", "comments"},
+        "edges_content": EDGES_CONTENT_FIELDS,
+        "edges_content_regeneration": EDGES_CONTENT_FIELDS | {"replics", "used_lines", "json_edge_regeneration_structure"},
+        "content_validation": CHARACTER_FIELDS | {
+            "character", "interlocutor", "dialog_chains", "line", "character_extra",
+            "genre", "epoch", "tonality", "json_metrics"
+        }
+    }
+    _templates = {}
+    _lock = threading.Lock()
+
+    @classmethod
+    def load(cls):
+        cls.prompts_dir = os.getenv("PROMPTS_DIR", "resources")
+        with cls._lock:
+            for name in cls.fields:
+                cls._templates[name] = cls.read_template(name)
+
+    @classmethod
+    def get_path(cls, name):
+        return os.path.join(cls.prompts_dir, f"prompt_{name}.txt")
+
+    @classmethod
+    def read_template(cls, name):
+        path = cls.get_path(name)
+        try:
+            mtime = os.stat(path).st_mtime_ns
+            with open(path, encoding="utf-8", mode="r") as prompt:
+                template = Template(prompt.read())
+        except OSError as e:
+            raise PromptTemplateError(f"Prompt template {path} can't be read: {e}") from e
+        undefined = get_placeholders(template) - cls.fields[name]
+        if undefined:
+            raise PromptTemplateError(f"Prompt template {path} references undefined placeholders: {', '.join(sorted(undefined))}")
+        return mtime, template
+
+    @classmethod
+    def get(cls, name):
+        if not cls._templates:
+            cls.load()
+        mtime, template = cls._templates[name]
+        try:
+            changed = os.stat(cls.get_path(name)).st_mtime_ns != mtime
+        except OSError:
+            changed = False
+        if changed:
+            with cls._lock:
+                try:
+                    cls._templates[name] = cls.read_template(name)
+                except PromptTemplateError as e:
+                    # битый шаблон не должен ронять генерацию, продолжаем с последней рабочей версией
+                    print(f"WARNING: {e}")
+                mtime, template = cls._templates[name]
+        return template
+
+    @classmethod
+    def render(cls, prompt_name, /, **fields):
+        return cls.get(prompt_name).safe_substitute(**fields)
+
+
+def get_placeholders(template):
+    placeholders = set()
+    for match in template.pattern.finditer(template.template):
+        name = match.group("named") or match.group("braced")
+        if name:
+            placeholders.add(name)
+    return placeholders
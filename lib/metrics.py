@@ -0,0 +1,109 @@
+import math
+import threading
+
+
+# Границы по умолчанию рассчитаны на вызовы LLM: от долей секунды до десятков минут
+DEFAULT_BUCKETS = (0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1200)
+
+
+class Metrics:
+    # Минимальный реестр метрик в текстовом формате Prometheus, без внешних зависимостей.
+    # Метрика - имя, тип, описание и значения по наборам меток
+    _metrics = {}
+    _collectors = []
+    _lock = threading.Lock()
+
+    @classmethod
+    def get_metric(cls, name, kind, description, buckets=None):
+        metric = cls._metrics.get(name)
+        if metric is None:
+            metric = {
+                "kind": kind,
+                "description": description,
+                "buckets": tuple(buckets or DEFAULT_BUCKETS),
+                "values": {}
+            }
+            cls._metrics[name] = metric
+        elif metric["kind"] != kind:
+            raise ValueError(f"Metric {name} is already registered as {metric['kind']}")
+        return metric
+
+    @classmethod
+    def inc(cls, name, value=1, description="", **labels):
+        key = tuple(sorted(labels.items()))
+        with cls._lock:
+            values = cls.get_metric(name, "counter", description)["values"]
+            values[key] = values.get(key, 0) + value
+
+    @classmethod
+    def set(cls, name, value, description="", **labels):
+        key = tuple(sorted(labels.items()))
+        with cls._lock:
+            cls.get_metric(name, "gauge", description)["values"][key] = value
+
+    @classmethod
+    def observe(cls, name, value, description="", buckets=None, **labels):
+        key = tuple(sorted(labels.items()))
+        with cls._lock:
+            metric = cls.get_metric(name, "histogram", description, buckets)
+            series = metric["values"].get(key)
+            if series is None:
+                series = {"counts": [0] * len(metric["buckets"]), "sum": 0.0, "count": 0}
+                metric["values"][key] = series
+            for i, bound in enumerate(metric["buckets"]):
+                if value <= bound:
+                    series["counts"][i] += 1
+            series["sum"] += value
+            series["count"] += 1
+
+    @classmethod
+    def register_collector(cls, collector):
+        # collector вызывается перед каждой выгрузкой и обновляет gauge-метрики,
+        # которые дешевле снять в момент запроса (размеры пулов, кэшей)
+        with cls._lock:
+            if collector not in cls._collectors:
+                cls._collectors.append(collector)
+
+    @classmethod
+    def format_labels(cls, key, extra=()):
+        items = list(key) + list(extra)
+        if not items:
+            return ""
+        pairs = []
+        for label, value in items:
+            value = str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+            pairs.append(f'{label}="{value}"')
+        return "{" + ",".join(pairs) + "}"
+
+    @classmethod
+    def format_value(cls, value):
+        if value == math.inf:
+            return "+Inf"
+        if isinstance(value, float) and value.is_integer():
+            return str(int(value))
+        return str(value)
+
+    @classmethod
+    def render(cls):
+        for collector in list(cls._collectors):
+            try:
+                collector()
+            except Exception as e:
+                print(f"Metrics collector failed: {e}", end="\n\n======\n\n")
+        lines = []
+        with cls._lock:
+            for name in sorted(cls._metrics):
+                metric = cls._metrics[name]
+                if metric["description"]:
+                    lines.append(f"# HELP {name} {metric['description']}")
+                lines.append(f"# TYPE {name} {metric['kind']}")
+                for key, value in sorted(metric["values"].items()):
+                    if metric["kind"] != "histogram":
+                        lines.append(f"{name}{cls.format_labels(key)} {cls.format_value(value)}")
+                        continue
+                    for bound, count in zip(metric["buckets"], value["counts"]):
+                        lines.append(f"{name}_bucket{cls.format_labels(key, [('le', cls.format_value(float(bound)))])} {count}")
+                    lines.append(f"{name}_bucket{cls.format_labels(key, [('le', '+Inf')])} {value['count']}")
+                    lines.append(f"{name}_sum{cls.format_labels(key)} {cls.format_value(value['sum'])}")
+                    lines.append(f"{name}_count{cls.format_labels(key)} {value['count']}")
+        return "\n".join(lines) + "\n"
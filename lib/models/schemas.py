@@ -52,6 +52,9 @@ class UserLoginRequest(BaseModel):
     mail: str
     password: str
 
+class RefreshRequest(BaseModel):
+    refresh_token: str
+
 class UserResponse(BaseModel):
     id: int
     mail: str
@@ -68,4 +71,6 @@ class UserUpdatePassword(BaseModel):
     password_hash: str
 
 class UserUpdateData(BaseModel):
-    data: Dict
\ No newline at end of file
+    data: Dict
+class ContentUpdate(BaseModel):
+    data: Dict
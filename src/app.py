@@ -1,24 +1,58 @@
 from fastapi import FastAPI
+from fastapi.responses import ORJSONResponse
 from fastapi.security import HTTPBearer
 
 from db.database import DatabasePool
+from db.async_database import AsyncDatabasePool
+from db.migrate import Migrations
+from lib.llm.jobs import GenerationJobs
+from lib.auth.hashing import PasswordHasher
+from lib.auth.keys import JWTKeys
+from lib.auth.throttle import Throttle
+from lib.llm.prompts import PromptRegistry
+from lib.llm.client import LLMClient
+from lib.llm.artifacts import ArtifactSink
 from src.llm.api.dialogue_endpoint import router as dialogue_router
 from src.auth.api.auth_endpoint import router as auth_router
 from fastapi.middleware.cors import CORSMiddleware
+from src.compression import CompressionMiddleware
 from src.db.api.db_endpoint import router as db_router
+from src.db.api.games_endpoint import router as games_router
 from src.healthz import router as healthz_router
+from src.metrics import router as metrics_router
 from dotenv import load_dotenv
+import os
 from contextlib import asynccontextmanager
 
 load_dotenv(override=True)
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
+    # Шаблоны промптов проверяются до старта, чтобы не узнать об ошибке посреди генерации
+    PromptRegistry.load()
+    # Ключи JWT разбираются один раз: неверный PEM виден при старте, а не на первом входе
+    JWTKeys.load_keys()
     # Инициализация пула при запуске
     DatabasePool.init_pool()
+    # Схема приводится к последней миграции до приёма запросов; DB_AUTO_MIGRATE=false - миграции вручную (python -m db.migrate).
+    # Недостающие индексы не мешают старту, но попадают в лог: без них поиски CRUD-слоя идут полным просмотром
+    with DatabasePool.connection() as conn:
+        if os.getenv("DB_AUTO_MIGRATE", "true").lower() != "false":
+            Migrations.apply(conn)
+        Migrations.check_indexes(conn)
+    # Пул asyncpg для async-ручек (/users/me, /users/me/data, /login) - после миграций, схема уже готова
+    await AsyncDatabasePool.init_pool()
+    GenerationJobs.init_pool()
+    PasswordHasher.init_pool()
+    Throttle.init_throttle()
 
     yield
     # Закрытие пула при остановке
+    GenerationJobs.shutdown()
+    PasswordHasher.shutdown()
+    ArtifactSink.shutdown()
+    LLMClient.close()
+    await AsyncDatabasePool.close_all()
     DatabasePool.close_all()
 
 
@@ -33,9 +67,12 @@ app = FastAPI(
         {"name": "Auth", "description": "Операции аутентификации"},
         {"name": "Dialogue", "description": "Генерация диалогов"},
         {"name": "Database", "description": "Операции с базой данных"},
+        {"name": "Games", "description": "Игры, сцены и сценарии пользователя"},
         {"name": "Health", "description": "Проверка состояния сервиса"}
     ],
-    lifespan=lifespan
+    lifespan=lifespan,
+    # orjson вместо json.dumps: сериализация больших документов и графов в разы быстрее
+    default_response_class=ORJSONResponse
 )
 
 # Добавляем схему безопасности в OpenAPI
@@ -77,6 +114,9 @@ def custom_openapi():
 
 app.openapi = custom_openapi
 
+# Сжатие - внутри CORS: заголовки CORS добавляются к уже сжатому ответу
+app.add_middleware(CompressionMiddleware)
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["http://26.15.136.181:5173", "http://10.82.161.66:5173", "https://galeevarslandev.github.io/PlotTalkAI/",
@@ -84,12 +124,15 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],  # Разрешаем все методы
     allow_headers=["*"],  # Разрешаем все заголовки
+    expose_headers=["ETag"],  # версия документа для If-None-Match/If-Match
 )
 
 app.include_router(dialogue_router, prefix="/api")
 app.include_router(auth_router, prefix="/api")
 app.include_router(db_router, prefix="/api")
+app.include_router(games_router, prefix="/api")
 app.include_router(healthz_router, prefix="/api")
+app.include_router(metrics_router, prefix="/api")
 
 # @app.on_event("startup")
 # async def startup():
@@ -1,44 +1,60 @@
-from fastapi import APIRouter, HTTPException, Depends, Header
-from lib.auth.auth import Auth
-from lib.models.schemas import UserRegisterRequest, UserLoginRequest, UserResponse
-from db.database import DatabasePool
-from typing import Optional
-from lib.auth.utils import decode_token
+from fastapi import APIRouter, HTTPException, Depends
+from lib.auth.auth import Auth, AsyncAuth, run_password_hasher
+from lib.auth.hashing import PasswordHasher
+from lib.models.schemas import UserRegisterRequest, UserLoginRequest, UserResponse, RefreshRequest
+from src.db.dependencies import get_db_connection
+from lib.auth.throttle import Throttle
+from src.auth.dependencies import get_token_payload, get_current_user_id, throttle_login, throttle_register
 from psycopg2.extensions import connection as Connection
 
 router = APIRouter()
 
 
-def get_auth_service(db_conn: Connection = Depends(DatabasePool.get_connection)):
+def get_auth_service(db_conn: Connection = Depends(get_db_connection)):
     return Auth(db_conn) 
 
-@router.post("/register", tags=["Auth"])
-def register(user: UserRegisterRequest, auth_service: Auth = Depends(get_auth_service)):
-    user_id, error = auth_service.register(user.mail, user.name, user.surname, user.password)
+async def get_async_auth_service():
+    return AsyncAuth()
+
+async def get_register_password_hash(user: UserRegisterRequest):
+    return await run_password_hasher(PasswordHasher.hash(user.password))
+
+# Порядок зависимостей важен: лимит проверяется до bcrypt, хэш считается до get_db_connection -
+# соединение не простаивает на время хэширования
+@router.post("/register", tags=["Auth"], dependencies=[Depends(throttle_register)])
+def register(user: UserRegisterRequest, password_hash: str = Depends(get_register_password_hash),
+             auth_service: Auth = Depends(get_auth_service)):
+    user_id, error = auth_service.register(user.mail, user.name, user.surname, password_hash)
     if error == "User already exists":
         raise HTTPException(status_code=400, detail=error)
     if error == "Failed to create user":
         raise HTTPException(status_code=500, detail=error)
     if error:
         raise HTTPException(status_code=422, detail=error)
-    DatabasePool.put_connection(auth_service.db_conn)
     return UserResponse(id=user_id, mail=user.mail, name=user.name, surname=user.surname)
     
 
-@router.post("/login", tags=["Auth"])
-def login(user: UserLoginRequest, auth_service: Auth = Depends(get_auth_service)):
-    login_res = auth_service.login(user.mail, user.password)
-    DatabasePool.put_connection(auth_service.db_conn)
+@router.post("/login", tags=["Auth"], dependencies=[Depends(throttle_login)])
+async def login(user: UserLoginRequest, auth_service: AsyncAuth = Depends(get_async_auth_service)):
+    login_res = await auth_service.login(user.mail, user.password)
+    await Throttle.reset("login", "account", user.mail)
     return login_res
 
+# Обновление access-токена по refresh-токену без пароля и bcrypt; refresh-токен при этом заменяется новым
+@router.post("/refresh", tags=["Auth"])
+async def refresh(request: RefreshRequest, auth_service: AsyncAuth = Depends(get_async_auth_service)):
+    return await auth_service.refresh(request.refresh_token)
+
+@router.post("/logout", tags=["Auth"])
+async def logout(request: RefreshRequest, auth_service: AsyncAuth = Depends(get_async_auth_service)):
+    await auth_service.logout(request.refresh_token)
+    return {"message": "Logged out"}
+
+@router.post("/logout/all", tags=["Auth"])
+async def logout_all(user_id: int = Depends(get_current_user_id), auth_service: AsyncAuth = Depends(get_async_auth_service)):
+    revoked = await auth_service.logout_all(user_id)
+    return {"message": "All sessions revoked", "revoked": revoked}
+
 @router.get("/protected", tags=["Auth"])
-def protected(authorization: Optional[str] = Header(None)):
-    if not authorization or not authorization.startswith("Bearer "):
-        raise HTTPException(401, detail="Missing token")
-    token = authorization.split(" ")[1]
-    try:
-        payload = decode_token(token)
-    except Exception:
-        raise HTTPException(401, detail="Invalid token")
+async def protected(payload: dict = Depends(get_token_payload)):
     return {"message": f"Hello, {payload.get('mail')}"}
-
@@ -0,0 +1,47 @@
+from typing import Optional
+
+from fastapi import Depends, Header, HTTPException, Request
+
+from lib.auth.throttle import Throttle, Throttled
+from lib.auth.token_cache import TokenCache
+from lib.models.schemas import UserLoginRequest, UserRegisterRequest
+
+
+# async: проверка подписи не ждёт ввода-вывода, а повторный токен берётся из кэша - поток threadpool не нужен
+async def get_token_payload(authorization: Optional[str] = Header(None)):
+    if not authorization or not authorization.startswith("Bearer "):
+        raise HTTPException(status_code=401, detail="Missing or invalid token")
+    token = authorization.split(" ", 1)[1]
+    try:
+        return TokenCache.decode(token)
+    except Exception:
+        raise HTTPException(status_code=401, detail="Invalid token")
+
+
+async def get_current_user_id(payload: dict = Depends(get_token_payload)):
+    user_id = payload.get("id")
+    if not user_id:
+        raise HTTPException(status_code=401, detail="Invalid token payload")
+    return user_id
+
+
+def get_client_ip(request: Request):
+    # За прокси адрес клиента подставляет uvicorn (--proxy-headers --forwarded-allow-ips), сам X-Forwarded-For не читается:
+    # иначе клиент сам выбирал бы себе IP для лимита
+    return request.client.host if request.client else None
+
+
+async def throttle(action, **values):
+    try:
+        await Throttle.check(action, **values)
+    except Throttled as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+
+
+# Лимиты - в dependencies=[...] маршрута: FastAPI выполняет их раньше зависимостей параметров, то есть до bcrypt
+async def throttle_login(request: Request, user: UserLoginRequest):
+    await throttle("login", ip=get_client_ip(request), account=user.mail)
+
+
+async def throttle_register(request: Request, user: UserRegisterRequest):
+    await throttle("register", ip=get_client_ip(request))
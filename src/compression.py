@@ -0,0 +1,100 @@
+import os
+
+from dotenv import load_dotenv
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.middleware.gzip import GZipMiddleware, GZipResponder, IdentityResponder
+
+try:
+    import brotli
+except ImportError:
+    # brotli - необязательная зависимость: без неё ответы сжимаются только gzip
+    brotli = None
+
+load_dotenv()
+
+
+def accepted_encodings(header: str):
+    # Кодировки из Accept-Encoding без q=0
+    encodings = set()
+    for item in header.split(","):
+        name, *params = item.split(";")
+        quality = 1.0
+        for param in params:
+            key, _, value = param.partition("=")
+            if key.strip().lower() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    pass
+        if quality > 0:
+            encodings.add(name.strip().lower())
+    return encodings
+
+
+def encode_etag(etag: str, encoding: str):
+    # Сжатый ответ - другое представление: strong ETag получает суффикс кодировки, как у mod_deflate.
+    # Weak ETag (W/) не меняется - он и так не обещает побайтового совпадения
+    if etag.startswith('"') and etag.endswith('"'):
+        return f'{etag[:-1]}-{encoding}"'
+    return etag
+
+
+class BrotliResponder(IdentityResponder):
+    content_encoding = "br"
+
+    def __init__(self, app, minimum_size: int, quality: int):
+        super().__init__(app, minimum_size)
+        self.compressor = brotli.Compressor(quality=quality)
+
+    def apply_compression(self, body: bytes, *, more_body: bool) -> bytes:
+        body = self.compressor.process(body)
+        if not more_body:
+            body += self.compressor.finish()
+        return body
+
+
+class CompressionMiddleware(GZipMiddleware):
+    # Сжатие ответов от COMPRESSION_MIN_SIZE байт: br, если клиент его принимает и установлен brotli, иначе gzip.
+    # Уровни ниже максимальных: документ и граф сжимаются на каждый запрос, 9/11 заметно дороже по CPU
+    def __init__(self, app):
+        super().__init__(
+            app,
+            minimum_size=int(os.getenv("COMPRESSION_MIN_SIZE", 1024)),
+            compresslevel=int(os.getenv("GZIP_LEVEL", 6))
+        )
+        self.brotli_quality = int(os.getenv("BROTLI_QUALITY", 5))
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        request_headers = Headers(scope=scope)
+        encodings = accepted_encodings(request_headers.get("Accept-Encoding", ""))
+        if brotli is not None and "br" in encodings:
+            responder = BrotliResponder(self.app, self.minimum_size, self.brotli_quality)
+        elif "gzip" in encodings:
+            responder = GZipResponder(self.app, self.minimum_size, compresslevel=self.compresslevel)
+        else:
+            responder = IdentityResponder(self.app, self.minimum_size)
+
+        async def send_with_headers(message):
+            if message["type"] == "http.response.start":
+                self.set_representation_headers(message, responder, request_headers.get("If-None-Match", ""))
+            await send(message)
+
+        await responder(scope, receive, send_with_headers)
+
+    @staticmethod
+    def set_representation_headers(message, responder, if_none_match: str):
+        # Vary - на любом ответе: несжатый (маленький, 304) тоже зависит от Accept-Encoding.
+        # ETag сжатого ответа - с суффиксом кодировки; 304 повторяет ETag, который клиент получил сжатым
+        headers = MutableHeaders(scope=message)
+        if "accept-encoding" not in headers.get("vary", "").lower():
+            headers.add_vary_header("Accept-Encoding")
+        etag = headers.get("etag")
+        encoding = getattr(responder, "content_encoding", None)
+        if etag is None or encoding is None or responder.content_encoding_set:
+            return
+        encoded = encode_etag(etag, encoding)
+        if headers.get("content-encoding") == encoding or (message["status"] == 304 and encoded in if_none_match):
+            headers["ETag"] = encoded
@@ -1,104 +1,116 @@
-from fastapi import APIRouter, HTTPException, Depends, Request, Header
+from fastapi import APIRouter, HTTPException, Depends, Request, Response, Header
+from typing import Optional
+from fastapi.concurrency import run_in_threadpool
 
 from db.users_db import Users
+from db.async_users_db import AsyncUsers
 from lib.models.schemas import *
-from lib.auth.utils import decode_token
 from psycopg2.extensions import connection as Connection
-from db.database import DatabasePool
+from src.auth.dependencies import get_current_user_id
+from src.db.dependencies import get_db_connection, get_async_db_connection
+from src.db.etag import make_etag, parse_etag_versions
+from src.responses import RawJSON, raw_json_response
+from db.json_patch import JsonPatchError, parse_json_patch, parse_merge_patch
 
 router = APIRouter()
 
-def get_users_service(db_conn: Connection = Depends(DatabasePool.get_connection)):
+def get_users_service(db_conn: Connection = Depends(get_db_connection)):
     return Users(db_conn) 
 
-def get_current_user_id(authorization: str = Header(...)):
-    if not authorization or not authorization.startswith("Bearer "):
-        raise HTTPException(status_code=401, detail="Missing or invalid token")
-    token = authorization.split(" ", 1)[1]
-    try:
-        payload = decode_token(token)
-        user_id = payload.get("id")
-        if not user_id:
-            raise HTTPException(status_code=401, detail="Invalid token payload")
-        return user_id
-    except Exception:
-        raise HTTPException(status_code=401, detail="Invalid token")
+def get_async_users_service(db_conn = Depends(get_async_db_connection)):
+    return AsyncUsers(db_conn)
 
 @router.get("/users/me", tags=["Users"])
-def get_user_by_id(user_id: int = Depends(get_current_user_id), users_service: Users = Depends(get_users_service)):
-    user = users_service.get_user_by_id(user_id)
-    DatabasePool.put_connection(users_service.db_conn)
+async def get_user_by_id(user_id: int = Depends(get_current_user_id), users_service: AsyncUsers = Depends(get_async_users_service)):
+    user = await users_service.get_user_by_id(user_id)
     if user:
         return user
     raise HTTPException(status_code=404, detail="User not found")
 
 @router.get("/users/me/data", tags=["Users"])
-def get_user_data(user_id: int = Depends(get_current_user_id), users_service: Users = Depends(get_users_service)):
-    user = users_service.get_user_by_id(user_id)
-    if not user:
-        DatabasePool.put_connection(users_service.db_conn)
+async def get_user_data(if_none_match: Optional[str] = Header(None), user_id: int = Depends(get_current_user_id),
+                        users_service: AsyncUsers = Depends(get_async_users_service)):
+    # один запрос: None - пользователя нет или он удалён. При совпавшем If-None-Match документ не читается - 304
+    row = await users_service.get_user_data(user_id, parse_etag_versions(if_none_match, weak=True))
+    if row is None:
         raise HTTPException(status_code=404, detail="User not found")
-    data = users_service.get_user_data(user_id)
-    DatabasePool.put_connection(users_service.db_conn)
-    if data:
-        return {"data": data}
-    raise HTTPException(status_code=404, detail="User data not found")
+    headers = {"ETag": make_etag(row["version"]), "Cache-Control": "private, no-cache"}
+    if row["not_modified"]:
+        return Response(status_code=304, headers=headers)
+    # документ уже JSON-текст из Postgres - отдаётся без разбора
+    return raw_json_response({"data": RawJSON(row["data"])}, headers=headers)
 
 @router.put("/users/me/upd/data", tags=["Users"])
-def update_user_data(new_data: UserUpdateData, user_id: int = Depends(get_current_user_id), users_service: Users = Depends(get_users_service)):
+def update_user_data(new_data: UserUpdateData, response: Response, if_match: Optional[str] = Header(None),
+                     user_id: int = Depends(get_current_user_id), users_service: Users = Depends(get_users_service)):
     print(f"Updating data for user: {user_id}", new_data, sep = "...\n", end="\n\n======\n\n")
-    user_data = users_service.get_user_data(user_id)
-    if not user_data:
-        DatabasePool.put_connection(users_service.db_conn)
+    # Сохранённые result сценариев не перезаписываются: это делает sync_user_games по id сценария.
+    # If-Match с ETag из GET /users/me/data - запись, только если документ с тех пор не менялся
+    result = users_service.update_user_data(user_id, new_data.data, parse_etag_versions(if_match, weak=False))
+    if result is None:
+        raise HTTPException(status_code=400, detail="Failed to update data")
+    if not result["user"]:
         raise HTTPException(status_code=404, detail="User data not found")
-    for game_index in range(len(new_data.data.get("games", []))):
-        game = new_data.data["games"][game_index]
-        for scene_index in range(len(game.get("scenes", []))):
-            scene = game["scenes"][scene_index]
-            for script_index in range(len(scene.get("scripts", []))):
-                try:
-                    new_data.data["games"][game_index]["scenes"][scene_index]["scripts"][script_index]["result"] = user_data["games"][game_index]["scenes"][scene_index]["scripts"][script_index]["result"]
-                except Exception:
-                    pass
+    if not result["updated"]:
+        raise HTTPException(status_code=412, detail="User data has been modified", headers={"ETag": make_etag(result["version"])})
+    response.headers["ETag"] = make_etag(result["version"])
+    # элементы без id получили uuid - клиент сохраняет их, чтобы следующая запись не пересоздала строки
+    return {"message": "User data updated successfully", "ids": result["ids"]}
 
-    success = users_service.update_user_data(user_id, new_data.data)
-    DatabasePool.put_connection(users_service.db_conn)
-    if success:
-        return {"message": "User data updated successfully"}
-    raise HTTPException(status_code=400, detail="Failed to update data")
+@router.patch("/users/me/data", tags=["Users"])
+async def patch_user_data(request: Request, response: Response, if_match: Optional[str] = Header(None),
+                          user_id: int = Depends(get_current_user_id), users_service: Users = Depends(get_users_service)):
+    # application/json-patch+json - список операций RFC 6902, application/merge-patch+json - RFC 7396.
+    # Изменение применяется в Postgres, сервер не читает и не пересылает документ целиком
+    try:
+        patch = await request.json()
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid JSON")
+    content_type = request.headers.get("content-type", "").split(";")[0].strip()
+    try:
+        if content_type == "application/merge-patch+json" or (content_type != "application/json-patch+json" and isinstance(patch, dict)):
+            steps = parse_merge_patch(patch)
+        else:
+            steps = parse_json_patch(patch)
+    except JsonPatchError as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
+    result = await run_in_threadpool(users_service.patch_user_data, user_id, steps, parse_etag_versions(if_match, weak=False))
+    if result is None:
+        raise HTTPException(status_code=400, detail="Failed to update data")
+    if not result["user"]:
+        raise HTTPException(status_code=404, detail="User data not found")
+    if not result["matched"]:
+        raise HTTPException(status_code=412, detail="User data has been modified", headers={"ETag": make_etag(result["version"])})
+    if result["failed"] is not None:
+        raise HTTPException(status_code=409, detail=f"Patch operation {result['failed']} cannot be applied")
+    response.headers["ETag"] = make_etag(result["version"])
+    if result.get("ids") is not None:
+        return {"message": "User data updated successfully", "ids": result["ids"]}
+    return {"message": "User data updated successfully"}
 
 @router.put("/users/me/name", tags=["Users"])
 def update_user_name(new_name: UserUpdateName, user_id: int = Depends(get_current_user_id), users_service: Users = Depends(get_users_service)):
-    user = users_service.get_user_by_id(user_id)
-    if not user:
-        DatabasePool.put_connection(users_service.db_conn)
+    updated = users_service.update_user_name(user_id, new_name.name, new_name.surname)
+    if updated is None:
+        raise HTTPException(status_code=400, detail="Failed to update name")
+    if not updated:
         raise HTTPException(status_code=404, detail="User not found")
-    success = users_service.update_user_name(user_id, new_name.name, new_name.surname)
-    DatabasePool.put_connection(users_service.db_conn)
-    if success:
-        return {"message": "User name updated successfully"}
-    raise HTTPException(status_code=400, detail="Failed to update name")
+    return {"message": "User name updated successfully"}
 
 @router.put("/users/me/password", tags=["Users"])
 def update_user_password(new_pass: UserUpdatePassword, user_id: int = Depends(get_current_user_id), users_service: Users = Depends(get_users_service)):
-    user = users_service.get_user_by_id(user_id)
-    if not user:
-        DatabasePool.put_connection(users_service.db_conn)
+    updated = users_service.update_user_password(user_id, new_pass.password_hash)
+    if updated is None:
+        raise HTTPException(status_code=400, detail="Failed to update password")
+    if not updated:
         raise HTTPException(status_code=404, detail="User not found")
-    success = users_service.update_user_password(user_id, new_pass.password_hash)
-    DatabasePool.put_connection(users_service.db_conn)
-    if success:
-        return {"message": "Password updated successfully"}
-    raise HTTPException(status_code=400, detail="Failed to update password")
+    return {"message": "Password updated successfully"}
 
 @router.delete("/users/me", tags=["Users"])
 def delete_user(user_id: int = Depends(get_current_user_id), users_service: Users = Depends(get_users_service)):
-    user = users_service.get_user_by_id(user_id)
-    if not user:
-        DatabasePool.put_connection(users_service.db_conn)
+    updated = users_service.delete_user(user_id)
+    if updated is None:
+        raise HTTPException(status_code=400, detail="Failed to delete user")
+    if not updated:
         raise HTTPException(status_code=404, detail="User not found")
-    success = users_service.delete_user(user_id)
-    DatabasePool.put_connection(users_service.db_conn)
-    if success:
-        return {"message": "User deleted successfully"}
-    raise HTTPException(status_code=400, detail="Failed to delete user")
+    return {"message": "User deleted successfully"}
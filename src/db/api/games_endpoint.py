@@ -0,0 +1,127 @@
+from fastapi import APIRouter, HTTPException, Depends
+from psycopg2.extensions import connection as Connection
+
+from src.db.dependencies import get_db_connection
+from db.db_CRUD.games_db import Games
+from db.db_CRUD.scenes_db import Scenes
+from db.db_CRUD.dialogues_db import Dialogues
+from lib.models.schemas import ContentUpdate
+from src.responses import RawJSON, raw_json_response
+from src.auth.dependencies import get_current_user_id
+
+# Игры, сцены и сценарии по отдельности: id в пути - id из документа фронтенда.
+# Чтение сцены не собирает остальные игры, запись сценария блокирует только его строку.
+# Прочитанное отдаётся JSON-текстом из Postgres, без разбора и повторной сериализации
+router = APIRouter()
+
+def get_games_service(db_conn: Connection = Depends(get_db_connection)):
+    return Games(db_conn)
+
+def get_scenes_service(db_conn: Connection = Depends(get_db_connection)):
+    return Scenes(db_conn)
+
+def get_dialogues_service(db_conn: Connection = Depends(get_db_connection)):
+    return Dialogues(db_conn)
+
+def get_content(update: ContentUpdate, item_id: str):
+    # id можно не передавать: у существующего объекта сохранится прежний
+    content = dict(update.data)
+    if "id" in content and str(content["id"]) != item_id:
+        raise HTTPException(status_code=400, detail="id in body does not match id in path")
+    return content
+
+@router.get("/users/me/games", tags=["Games"])
+def get_games(user_id: int = Depends(get_current_user_id), games_service: Games = Depends(get_games_service)):
+    games = games_service.get_user_games(user_id)
+    if games is None:
+        raise HTTPException(status_code=500, detail="Failed to load games")
+    return raw_json_response({"games": RawJSON(games)})
+
+@router.get("/users/me/games/{game_id}", tags=["Games"])
+def get_game(game_id: str, user_id: int = Depends(get_current_user_id), games_service: Games = Depends(get_games_service)):
+    game = games_service.get_user_game(user_id, game_id)
+    if game is None:
+        raise HTTPException(status_code=404, detail="Game not found")
+    return raw_json_response({"game": RawJSON(game)})
+
+@router.put("/users/me/games/{game_id}", tags=["Games"])
+def put_game(game_id: str, update: ContentUpdate, user_id: int = Depends(get_current_user_id), games_service: Games = Depends(get_games_service)):
+    game = get_content(update, game_id)
+    result = games_service.put_user_game(user_id, game_id, game)
+    if result is None:
+        raise HTTPException(status_code=400, detail="Failed to save game")
+    return {"message": "Game saved successfully", "created": result["created"]}
+
+@router.delete("/users/me/games/{game_id}", tags=["Games"])
+def delete_game(game_id: str, user_id: int = Depends(get_current_user_id), games_service: Games = Depends(get_games_service)):
+    deleted = games_service.delete_user_game(user_id, game_id)
+    if deleted is None:
+        raise HTTPException(status_code=400, detail="Failed to delete game")
+    if not deleted:
+        raise HTTPException(status_code=404, detail="Game not found")
+    return {"message": "Game deleted successfully"}
+
+@router.get("/users/me/games/{game_id}/scenes/{scene_id}", tags=["Games"])
+def get_scene(game_id: str, scene_id: str, user_id: int = Depends(get_current_user_id), scenes_service: Scenes = Depends(get_scenes_service)):
+    scene = scenes_service.get_user_scene(user_id, game_id, scene_id)
+    if scene is None:
+        raise HTTPException(status_code=404, detail="Scene not found")
+    return raw_json_response({"scene": RawJSON(scene)})
+
+@router.put("/users/me/games/{game_id}/scenes/{scene_id}", tags=["Games"])
+def put_scene(game_id: str, scene_id: str, update: ContentUpdate, user_id: int = Depends(get_current_user_id), scenes_service: Scenes = Depends(get_scenes_service)):
+    scene = get_content(update, scene_id)
+    result = scenes_service.put_user_scene(user_id, game_id, scene_id, scene)
+    if result is None:
+        raise HTTPException(status_code=400, detail="Failed to save scene")
+    if not result["game"]:
+        raise HTTPException(status_code=404, detail="Game not found")
+    return {"message": "Scene saved successfully", "created": result["created"]}
+
+@router.delete("/users/me/games/{game_id}/scenes/{scene_id}", tags=["Games"])
+def delete_scene(game_id: str, scene_id: str, user_id: int = Depends(get_current_user_id), scenes_service: Scenes = Depends(get_scenes_service)):
+    deleted = scenes_service.delete_user_scene(user_id, game_id, scene_id)
+    if deleted is None:
+        raise HTTPException(status_code=400, detail="Failed to delete scene")
+    if not deleted:
+        raise HTTPException(status_code=404, detail="Scene not found")
+    return {"message": "Scene deleted successfully"}
+
+@router.get("/users/me/games/{game_id}/scenes/{scene_id}/scripts/{script_id}", tags=["Games"])
+def get_script(game_id: str, scene_id: str, script_id: str, user_id: int = Depends(get_current_user_id), dialogues_service: Dialogues = Depends(get_dialogues_service)):
+    script = dialogues_service.get_user_dialogue(user_id, game_id, scene_id, script_id)
+    if script is None:
+        raise HTTPException(status_code=404, detail="Script not found")
+    return raw_json_response({"script": RawJSON(script)})
+
+@router.put("/users/me/games/{game_id}/scenes/{scene_id}/scripts/{script_id}", tags=["Games"])
+def put_script(game_id: str, scene_id: str, script_id: str, update: ContentUpdate, user_id: int = Depends(get_current_user_id), dialogues_service: Dialogues = Depends(get_dialogues_service)):
+    script = get_content(update, script_id)
+    result = dialogues_service.put_user_dialogue(user_id, game_id, scene_id, script_id, script)
+    if result is None:
+        raise HTTPException(status_code=400, detail="Failed to save script")
+    if not result["scene"]:
+        raise HTTPException(status_code=404, detail="Scene not found")
+    return {"message": "Script saved successfully", "created": result["created"]}
+
+@router.delete("/users/me/games/{game_id}/scenes/{scene_id}/scripts/{script_id}", tags=["Games"])
+def delete_script(game_id: str, scene_id: str, script_id: str, user_id: int = Depends(get_current_user_id), dialogues_service: Dialogues = Depends(get_dialogues_service)):
+    deleted = dialogues_service.delete_user_dialogue(user_id, game_id, scene_id, script_id)
+    if deleted is None:
+        raise HTTPException(status_code=400, detail="Failed to delete script")
+    if not deleted:
+        raise HTTPException(status_code=404, detail="Script not found")
+    return {"message": "Script deleted successfully"}
+
+@router.get("/users/me/games/{game_id}/scenes/{scene_id}/scripts/{script_id}/dialogue", tags=["Games"])
+def get_script_dialogue(game_id: str, scene_id: str, script_id: str, user_id: int = Depends(get_current_user_id), dialogues_service: Dialogues = Depends(get_dialogues_service)):
+    # Граф генерации по запросу: в /users/me/data и в сценарии только сводка generated
+    generated = dialogues_service.get_user_generated(user_id, game_id, scene_id, script_id)
+    if generated is None:
+        raise HTTPException(status_code=404, detail="Dialogue not found")
+    return raw_json_response({
+        "result": RawJSON(generated["graph"]),
+        "nodes": generated["node_count"],
+        "size": generated["size"],
+        "generated_at": generated["created_at"]
+    })
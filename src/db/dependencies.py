@@ -0,0 +1,49 @@
+import time
+
+from fastapi import HTTPException, Request
+from psycopg2.extensions import connection as Connection
+
+from db.database import DB_BUCKETS, DatabasePool, DatabasePoolTimeout
+from db.async_database import AsyncDatabasePool
+from lib.metrics import Metrics
+
+
+def get_route_name(request: Request):
+    # шаблон пути (/users/me/games/{game_id}), а не сам путь - иначе метка на каждый id
+    route = request.scope.get("route")
+    return getattr(route, "path", "unknown")
+
+
+def get_db_connection(request: Request) -> Connection:
+    # Соединение на время запроса: возвращается в пул после ответа, в том числе при исключении в ручке.
+    # Внутри одного запроса FastAPI кэширует зависимость, поэтому все сервисы получают одно соединение
+    try:
+        conn = DatabasePool.get_connection()
+    except DatabasePoolTimeout as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "1"})
+    try:
+        yield conn
+    finally:
+        held = DatabasePool.put_connection(conn)
+        if held is not None:
+            Metrics.observe(
+                "db_connection_checkout_seconds", held, "How long a request held a pool connection",
+                buckets=DB_BUCKETS, route=get_route_name(request)
+            )
+
+
+async def get_async_db_connection(request: Request):
+    # То же для async-ручек: соединение asyncpg, ожидание ответа базы не занимает поток threadpool
+    try:
+        conn = await AsyncDatabasePool.get_connection()
+    except DatabasePoolTimeout as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "1"})
+    start_time = time.perf_counter()
+    try:
+        yield conn
+    finally:
+        await AsyncDatabasePool.put_connection(conn)
+        Metrics.observe(
+            "db_connection_checkout_seconds", time.perf_counter() - start_time, "How long a request held a pool connection",
+            buckets=DB_BUCKETS, route=get_route_name(request)
+        )
@@ -0,0 +1,27 @@
+import re
+
+# ETag документа пользователя - его версия из user_data_version(): "v<users_data.version>.<отпечаток строк игр>".
+# У сжатого ответа к нему добавлен суффикс кодировки (src/compression.py) - версия документа та же
+ETAG_RE = re.compile(r'"v(\d{1,18}\.[0-9a-f]{16})(?:-(?:gzip|br))?"')
+
+
+def make_etag(version):
+    return f'"v{version}"'
+
+
+def parse_etag_versions(header, weak: bool):
+    # Версии из If-None-Match (weak=True, W/ допускается) или If-Match (weak=False, слабые ETag не совпадают).
+    # None - заголовка нет или "*", тогда версия не проверяется; чужие ETag пропускаются
+    if header is None or header.strip() == "*":
+        return None
+    versions = []
+    for tag in header.split(","):
+        tag = tag.strip()
+        if tag.startswith("W/"):
+            if not weak:
+                continue
+            tag = tag[2:]
+        match = ETAG_RE.fullmatch(tag)
+        if match:
+            versions.append(match.group(1))
+    return versions
@@ -1,112 +1,110 @@
 from fastapi import APIRouter, Depends, HTTPException, Header, HTTPException
 from lib.models.schemas import Params
 from lib.llm.generator import Orchestrator
+from lib.llm.jobs import GenerationJobs, JobQueueFull
+from lib.llm.instrumentation import PipelineMetrics
 from db.database import DatabasePool
+from src.db.dependencies import get_db_connection
 from db.users_db import Users
-from src.db.api.db_endpoint import get_current_user_id
+from db.db_CRUD.dialogues_db import Dialogues
+from src.responses import RawJSON, raw_json_response
+from src.auth.dependencies import get_current_user_id
 from psycopg2.extensions import connection as Connection
 import json 
 router = APIRouter()
 
-def get_users_service(db_conn: Connection = Depends(DatabasePool.get_connection)):
+def get_users_service(db_conn: Connection = Depends(get_db_connection)):
     return Users(db_conn) 
 
 class DialogueController:
     def __init__(self):
         self.generator_class = Orchestrator
 
-    def generate(self, params: Params):
-        generator = self.generator_class(params.dict())
+    def generate(self, params: Params, job_id: str = None, metrics: PipelineMetrics = None):
+        generator = self.generator_class(params.dict(), job_id, metrics)
         return generator.create_dialog()
 
 dialogue_controller = DialogueController()
 
-@router.post("/generate", tags=["Dialogue"])
-def generate(params: Params, user_id: int = Depends(get_current_user_id)):
-    # берём соединение из пула
-    db_conn = DatabasePool.get_connection()
-    users_service = Users(db_conn)
-    a = dialogue_controller.generate(params)
-    # a = {"x": 1}
-    # time.sleep(5)
-    # try:
-    #     a_dict = json.loads(a)
-    # except Exception:
-    #     raise HTTPException(status_code=500, detail="Failed to parse generated dialogue")
-    print(f"Generated  script for user: {user_id}", a, sep = "\n", end="\n\n======\n\n")
-    user_data = users_service.get_user_data(user_id)
-    if not user_data:
-        DatabasePool.put_connection(db_conn)
-        raise HTTPException(status_code=404, detail="User data not found")
-
-    if isinstance(user_data, str):
-        user_data = json.loads(user_data)
-
-    game_id = params.game_id
-    scene_id = params.scene_id
-    script_id = params.script_id
-    if script_id is None:
+def check_generation_params(params: Params):
+    if params.script_id is None:
         print("script_id должен быть передан в params или я в чем-то ошибся, анлак", end="\n\n======\n\n")
         raise HTTPException(status_code=400, detail="script_id должен быть передан в params или я в чем-то ошибся, анлак")
-    if game_id is None:
+    if params.game_id is None:
         print("game_id должен быть передан в params или я в чем-то ошибся, анлак", end="\n\n======\n\n")
         raise HTTPException(status_code=400, detail="game_id должен быть передан в params или я в чем-то ошибся, анлак")
-    if scene_id is None:
+    if params.scene_id is None:
         print("scene_id должен быть передан в params или я в чем-то ошибся, анлак", end="\n\n======\n\n")
         raise HTTPException(status_code=400, detail="scene_id должен быть передан в params или я в чем-то ошибся, анлак")
-    # Поиск по структуре
-    # for game in user_data.get("games", []):
-    #     if str(game.get("id")) == str(game_id):
-    #         for scene in game.get("scenes", []):
-    #             if str(scene.get("id")) == str(scene_id):
-    #                 # if "scripts" not in scene:
-    #                 #     scene["scripts"] = []
 
-    #                 found_script = False
-    #                 for script in scene.get("scripts", []):
-    #                     if str(script.get("id")) == str(script_id):
-    #                         script["result"] = a
-    #                         found_script = True
-    #                         break
-    #                 if not found_script:
-    #                     raise HTTPException(status_code=400, detail="script_id не валидный")
-    #                 break
-    #         break
-    found_game = 0
-    for game_index in range(len(user_data.get("games", []))):
-        game = user_data["games"][game_index]
-        if str(game.get("id")) == str(game_id):
-            found_game = 1
-            found_scene = 0
-            for scene_index in range(len(game.get("scenes", []))):
-                scene = game["scenes"][scene_index]
-                if str(scene.get("id")) == str(scene_id):
-                    found_scene = 1
-                    found_script = 0
-                    for script_index in range(len(scene.get("scripts", []))):
-                        script = scene["scripts"][script_index]
-                        if str(script.get("id")) == str(script_id):
-                            user_data["games"][game_index]["scenes"][scene_index]["scripts"][script_index]["result"] = a
-                            found_script = 1
-                            break
-                    if not found_script:
-                        print("script_id не валидный", end="\n\n======\n\n")
-                        DatabasePool.put_connection(db_conn)
-                        raise HTTPException(status_code=400, detail="script_id не валидный")
-                    break
-            if not found_scene:
-                print("scene_id не валидный", end="\n\n======\n\n")
-                DatabasePool.put_connection(db_conn)
-                raise HTTPException(status_code=400, detail="scene_id не валидный")
-            break
-    if not found_game:
-        print("game_id не валидный", end="\n\n======\n\n")
-        DatabasePool.put_connection(db_conn)
-        raise HTTPException(status_code=400, detail="game_id не валидный")
-                        
-    success = users_service.update_user_data(user_id, user_data)
-    DatabasePool.put_connection(db_conn)
-    if not success:
-        raise HTTPException(status_code=500, detail="Failed to update user data")
-    
-    return {"ok": True}
+def run_generation(job_id: str, params: Params, user_id: int):
+    # метрики кладём в задачу до старта, чтобы статус показывал прогресс по этапам
+    metrics = PipelineMetrics(job_id)
+    GenerationJobs.update(job_id, metrics=metrics)
+    a = dialogue_controller.generate(params, job_id, metrics)
+    print(f"Generated  script for user: {user_id}, job: {job_id}", end="\n\n======\n\n")
+    # соединение берём из пула только на время записи результата
+    with DatabasePool.connection() as db_conn:
+        save_generation_result(Users(db_conn), user_id, params, a)
+    return a
+
+def check_script_target(target, error="Failed to update user data"):
+    if target is None:
+        raise HTTPException(status_code=500, detail=error)
+    if not target["user"]:
+        raise HTTPException(status_code=404, detail="User data not found")
+    for key in ("game_id", "scene_id", "script_id"):
+        if target[key] is None:
+            print(f"{key} не найден", end="\n\n======\n\n")
+            raise HTTPException(status_code=404, detail=f"{key} не найден")
+
+def save_generation_result(users_service: Users, user_id: int, params: Params, a):
+    # Результат пишется точечно в строку сценария (таблица dialogues)
+    check_script_target(users_service.set_script_result(user_id, params.game_id, params.scene_id, params.script_id, a))
+
+@router.post("/generate", tags=["Dialogue"], status_code=202)
+def generate(params: Params, user_id: int = Depends(get_current_user_id), db_conn: Connection = Depends(get_db_connection), users_service: Users = Depends(get_users_service)):
+    check_generation_params(params)
+    # Сценарий проверяется до постановки в очередь: неверный script_id не должен стоить целой генерации.
+    # Повторная проверка при записи результата остаётся - сценарий могут удалить, пока идёт генерация
+    check_script_target(users_service.get_script_target(user_id, params.game_id, params.scene_id, params.script_id), "Failed to check script")
+    try:
+        job = GenerationJobs.submit(db_conn, user_id, (params.game_id, params.scene_id, params.script_id), run_generation, params, user_id)
+    except JobQueueFull as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "30"})
+    if job is None:
+        raise HTTPException(status_code=500, detail="Failed to create generation job")
+    return {"ok": True, "job_id": job["id"], "status": job["status"]}
+
+def get_user_job(db_conn: Connection, job_id: str, user_id: int):
+    job = GenerationJobs.get(db_conn, job_id)
+    if not job or job["user_id"] != user_id:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+@router.get("/generate/{job_id}", tags=["Dialogue"])
+def get_generation_status(job_id: str, user_id: int = Depends(get_current_user_id), db_conn: Connection = Depends(get_db_connection)):
+    job = get_user_job(db_conn, job_id, user_id)
+    return {
+        "job_id": job["id"],
+        "status": job["status"],
+        "created_at": job["created_at"],
+        "started_at": job["started_at"],
+        "finished_at": job["finished_at"],
+        "error": job["error"],
+        "metrics": job["metrics"]
+    }
+
+@router.get("/generate/{job_id}/result", tags=["Dialogue"])
+def get_generation_result(job_id: str, user_id: int = Depends(get_current_user_id), db_conn: Connection = Depends(get_db_connection)):
+    job = get_user_job(db_conn, job_id, user_id)
+    if job["status"] == "failed":
+        raise HTTPException(status_code=500, detail=job["error"])
+    if job["status"] != "done":
+        raise HTTPException(status_code=409, detail=f"Job is {job['status']}")
+    # Результат задачи - граф, записанный в generated_dialogues: его видит любой воркер.
+    # Если сценарий после этого сгенерировали заново, отдаётся последний граф
+    generated = Dialogues(db_conn).get_user_generated(user_id, job["game_id"], job["scene_id"], job["script_id"])
+    if generated is None:
+        raise HTTPException(status_code=404, detail="Dialogue not found")
+    return raw_json_response({"job_id": job["id"], "result": RawJSON(generated["graph"])})
@@ -0,0 +1,80 @@
+from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+from lib.metrics import Metrics
+from lib.llm.client import LLMClient
+from lib.llm.cache import LLMCache
+from lib.llm.jobs import GenerationJobs
+from lib.llm.governor import LLMGovernor
+from db.database import DatabasePool
+from db.async_database import AsyncDatabasePool
+from lib.auth.token_cache import TokenCache
+from lib.auth.hashing import PasswordHasher
+from lib.auth.refresh_cache import RefreshCache
+router = APIRouter()
+
+def collect_llm_client():
+    stats = LLMClient.get_stats()
+    Metrics.set("llm_http_connections_open", stats["connections_open"], "Open keep-alive connections to the LLM API")
+    Metrics.set("llm_http_connections_idle", stats["connections_idle"], "Idle keep-alive connections to the LLM API")
+    Metrics.set("llm_http_connections_opened", stats["connections_opened"], "Connections opened to the LLM API since start")
+    Metrics.set("llm_http_requests", stats["requests"], "HTTP requests sent to the LLM API since start")
+
+def collect_llm_cache():
+    stats = LLMCache.get_stats()
+    for stage, stage_stats in stats["stages"].items():
+        for kind, value in stage_stats.items():
+            Metrics.set("llm_cache_lookups", value, "LLM cache lookups by stage and outcome", stage=stage, outcome=kind)
+    Metrics.set("llm_cache_memory_items", stats["memory_items"], "Responses held in the in-memory LLM cache")
+    Metrics.set("llm_cache_disk_bytes", stats["disk_bytes"], "Size of the on-disk LLM cache")
+
+def collect_generation_jobs():
+    for status, count in GenerationJobs.get_counts().items():
+        Metrics.set("dialogue_generation_jobs", count, "Generation jobs queued or running in this process, by status", status=status)
+
+def collect_llm_governor():
+    stats = LLMGovernor.get_stats()
+    Metrics.set("llm_governor_in_flight", stats["in_flight"], "LLM calls currently in flight")
+    Metrics.set("llm_governor_requests_per_minute", stats["requests_per_minute"], "Current request rate limit, 0 - unlimited")
+    Metrics.set("llm_governor_tokens_per_minute", stats["tokens_per_minute"], "Current token rate limit, 0 - unlimited")
+    Metrics.set("llm_governor_rate_factor", stats["rate_factor"], "Rate multiplier after 429 responses")
+
+def collect_db_pool():
+    stats = DatabasePool.get_stats()
+    Metrics.set("db_pool_connections_max", stats["max"], "Maximum connections in the database pool")
+    Metrics.set("db_pool_connections_in_use", stats["in_use"], "Database connections checked out by requests and jobs")
+    Metrics.set("db_pool_connections_idle", stats["idle"], "Open database connections waiting in the pool")
+    stats = AsyncDatabasePool.get_stats()
+    Metrics.set("db_async_pool_connections_max", stats["max"], "Maximum connections in the async database pool")
+    Metrics.set("db_async_pool_connections_in_use", stats["in_use"], "Async database connections checked out by requests")
+    Metrics.set("db_async_pool_connections_idle", stats["idle"], "Open async database connections waiting in the pool")
+
+def collect_token_cache():
+    stats = TokenCache.get_stats()
+    for outcome in ("hits", "misses"):
+        Metrics.set("auth_token_cache_lookups", stats[outcome], "Access token lookups in the verified-token cache", outcome=outcome)
+    lookups = stats["hits"] + stats["misses"]
+    Metrics.set("auth_token_cache_hit_ratio", stats["hits"] / lookups if lookups else 0, "Share of requests served without signature verification")
+    Metrics.set("auth_token_cache_expired", stats["expired"], "Cached tokens dropped after exp")
+    Metrics.set("auth_token_cache_evicted", stats["evicted"], "Cached tokens evicted by TOKEN_CACHE_SIZE")
+    Metrics.set("auth_token_cache_items", stats["items"], "Verified tokens held in the cache")
+    stats = RefreshCache.get_stats()
+    Metrics.set("auth_refresh_cache_hits", stats["hits"], "Repeated refresh requests answered from the grace cache")
+    Metrics.set("auth_refresh_cache_items", stats["items"], "Refresh responses held for the reuse grace period")
+
+def collect_password_hasher():
+    stats = PasswordHasher.get_stats()
+    Metrics.set("password_hash_workers", stats["workers"], "Processes in the bcrypt pool")
+    Metrics.set("password_hash_pending", stats["pending"], "Password hashing requests running or queued")
+    Metrics.set("password_hash_queue_limit", stats["workers"] + stats["max_queued"], "Pending requests above which hashing is rejected")
+
+Metrics.register_collector(collect_db_pool)
+Metrics.register_collector(collect_password_hasher)
+Metrics.register_collector(collect_token_cache)
+Metrics.register_collector(collect_llm_client)
+Metrics.register_collector(collect_llm_governor)
+Metrics.register_collector(collect_llm_cache)
+Metrics.register_collector(collect_generation_jobs)
+
+@router.get("/metrics", tags=["Health"], response_class=PlainTextResponse)
+def get_metrics():
+    return PlainTextResponse(Metrics.render(), media_type="text/plain; version=0.0.4")
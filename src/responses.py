@@ -0,0 +1,16 @@
+import orjson
+from fastapi.responses import Response
+
+
+class RawJSON(str):
+    # JSON-текст, уже собранный Postgres (jsonb::text): в ответ вставляется как есть, без разбора
+    pass
+
+
+def raw_json_response(content: dict, status_code: int = 200, headers: dict = None):
+    # Объект верхнего уровня собирается вручную: значения RawJSON - готовый текст, остальные сериализует orjson
+    members = []
+    for key, value in content.items():
+        value = value.encode() if isinstance(value, RawJSON) else orjson.dumps(value)
+        members.append(orjson.dumps(key) + b":" + value)
+    return Response(b"{" + b",".join(members) + b"}", status_code=status_code, headers=headers, media_type="application/json")
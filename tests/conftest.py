@@ -0,0 +1,22 @@
+import os
+
+import psycopg2
+import pytest
+
+from db.migrate import Migrations
+
+
+@pytest.fixture(scope="session")
+def db_conn():
+    # Тесты с базой идут только при заданном DATABASE_URL (как у benchmarks), схема доводится миграциями
+    if not os.getenv("DATABASE_URL"):
+        pytest.skip("DATABASE_URL is not set")
+    try:
+        conn = psycopg2.connect(os.environ["DATABASE_URL"])
+    except psycopg2.OperationalError as e:
+        pytest.skip(f"Database is not available: {e}")
+    try:
+        Migrations.apply(conn)
+        yield conn
+    finally:
+        conn.close()
@@ -0,0 +1,85 @@
+import pytest
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import Response
+from starlette.routing import Route
+from starlette.testclient import TestClient
+
+from src.compression import CompressionMiddleware, accepted_encodings, brotli, encode_etag
+from src.db.etag import make_etag, parse_etag_versions
+
+BODY = b'{"data": "' + b"x" * 4096 + b'"}'
+VERSION = "1.0123456789abcdef"
+ETAG = make_etag(VERSION)
+
+
+def document(request: Request):
+    # как GET /users/me/data: версия из If-None-Match сравнивается без суффикса кодировки
+    if VERSION in (parse_etag_versions(request.headers.get("If-None-Match"), weak=True) or []):
+        return Response(status_code=304, headers={"ETag": ETAG})
+    return Response(BODY, media_type="application/json", headers={"ETag": ETAG})
+
+
+def small(request: Request):
+    return Response(b"{}", media_type="application/json", headers={"ETag": ETAG})
+
+
+@pytest.fixture
+def client():
+    app = Starlette(routes=[Route("/document", document), Route("/small", small)])
+    app.add_middleware(CompressionMiddleware)
+    return TestClient(app)
+
+
+def test_accepted_encodings():
+    assert accepted_encodings("gzip, deflate, br") == {"gzip", "deflate", "br"}
+    assert accepted_encodings("GZIP;q=0.5, br;q=0") == {"gzip"}
+    assert accepted_encodings("gzip;q=bad") == {"gzip"}
+    assert accepted_encodings("") == {""}
+
+
+def test_encode_etag():
+    assert encode_etag(ETAG, "gzip") == '"v1.0123456789abcdef-gzip"'
+    assert encode_etag('W/"v1.0123456789abcdef"', "br") == 'W/"v1.0123456789abcdef"'
+
+
+def test_gzip(client):
+    response = client.get("/document", headers={"Accept-Encoding": "gzip"})
+    assert response.headers["Content-Encoding"] == "gzip"
+    assert response.headers["ETag"] == encode_etag(ETAG, "gzip")
+    assert response.headers["Vary"] == "Accept-Encoding"
+    assert response.content == BODY
+
+
+@pytest.mark.skipif(brotli is None, reason="brotli is not installed")
+def test_br_preferred(client):
+    response = client.get("/document", headers={"Accept-Encoding": "gzip, br"})
+    assert response.headers["Content-Encoding"] == "br"
+    assert response.headers["ETag"] == encode_etag(ETAG, "br")
+    assert response.content == BODY
+
+
+def test_identity(client):
+    for accept_encoding in ("identity", "gzip;q=0"):
+        response = client.get("/document", headers={"Accept-Encoding": accept_encoding})
+        assert "Content-Encoding" not in response.headers
+        assert response.headers["ETag"] == ETAG
+        assert response.headers["Vary"] == "Accept-Encoding"
+
+
+def test_small_response_is_not_compressed(client):
+    response = client.get("/small", headers={"Accept-Encoding": "gzip"})
+    assert "Content-Encoding" not in response.headers
+    assert response.headers["ETag"] == ETAG
+    assert response.headers["Vary"] == "Accept-Encoding"
+
+
+def test_not_modified_repeats_encoded_etag(client):
+    encoded = encode_etag(ETAG, "gzip")
+    response = client.get("/document", headers={"Accept-Encoding": "gzip", "If-None-Match": encoded})
+    assert response.status_code == 304
+    assert response.headers["ETag"] == encoded
+    assert response.headers["Vary"] == "Accept-Encoding"
+    response = client.get("/document", headers={"Accept-Encoding": "gzip", "If-None-Match": ETAG})
+    assert response.status_code == 304
+    assert response.headers["ETag"] == ETAG
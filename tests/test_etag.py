@@ -0,0 +1,37 @@
+from src.db.etag import make_etag, parse_etag_versions
+
+VERSION = "12.0123456789abcdef"
+
+
+def test_make_etag_round_trip():
+    assert make_etag(VERSION) == '"v12.0123456789abcdef"'
+    assert parse_etag_versions(make_etag(VERSION), weak=False) == [VERSION]
+
+
+def test_missing_or_any():
+    assert parse_etag_versions(None, weak=True) is None
+    assert parse_etag_versions(" * ", weak=False) is None
+
+
+def test_list_and_foreign_tags():
+    header = f'"abc", {make_etag(VERSION)} ,W/"v3.fedcba9876543210", "v4", "v5.0123"'
+    assert parse_etag_versions(header, weak=True) == [VERSION, "3.fedcba9876543210"]
+
+
+def test_weak_tags_only_for_if_none_match():
+    header = f"W/{make_etag(VERSION)}"
+    assert parse_etag_versions(header, weak=True) == [VERSION]
+    assert parse_etag_versions(header, weak=False) == []
+
+
+def test_old_integer_etag_is_ignored():
+    # ETag вида "v12" (до отпечатка строк игр) не совпадает ни с одной версией: клиент перечитает документ
+    assert parse_etag_versions('"v12"', weak=False) == []
+    assert parse_etag_versions('"v1234567890123456789.0123456789abcdef"', weak=False) == []
+
+
+def test_encoding_suffix_is_the_same_version():
+    # суффикс кодировки добавляет CompressionMiddleware
+    header = '"v12.0123456789abcdef-gzip", W/"v12.0123456789abcdef-br", "v12.0123456789abcdef-zstd"'
+    assert parse_etag_versions(header, weak=True) == [VERSION, VERSION]
+    assert parse_etag_versions(header, weak=False) == [VERSION]
@@ -0,0 +1,22 @@
+from db.explain import check_query_plans, get_seq_scans
+from db.migrate import Migrations
+
+
+def test_get_seq_scans_walks_nested_plans():
+    plan = {
+        "Node Type": "Nested Loop",
+        "Plans": [
+            {"Node Type": "Index Scan", "Relation Name": "games"},
+            {"Node Type": "Hash", "Plans": [{"Node Type": "Seq Scan", "Relation Name": "scenes"}]},
+        ],
+    }
+    assert get_seq_scans(plan) == ["scenes"]
+
+
+def test_required_indexes_exist(db_conn):
+    assert Migrations.check_indexes(db_conn) == []
+
+
+def test_hot_queries_use_indexes(db_conn):
+    # пустой словарь - каждый горячий запрос может идти по индексу
+    assert check_query_plans(db_conn) == {}
@@ -0,0 +1,92 @@
+import random
+
+import networkx as nx
+
+from lib.llm.generator import DialogChainIndex, get_bfs_order, get_content_dependencies, get_prev_dialog_chains
+
+
+def make_graph(edges, lines=True):
+    dialog_graph = nx.DiGraph()
+    for prev, node in edges:
+        dialog_graph.add_edge(prev, node, line=f"{prev}->{node}" if lines else None)
+    for node in dialog_graph.nodes:
+        dialog_graph.nodes[node]["line"] = f"npc {node}"
+    return dialog_graph
+
+
+def make_random_dag(rnd, size):
+    edges = [(f"n{rnd.randrange(ind)}", f"n{ind}") for ind in range(1, size)]
+    for _ in range(size):
+        prev, node = sorted(rnd.sample(range(size), 2))
+        edges.append((f"n{prev}", f"n{node}"))
+    dialog_graph = make_graph(edges)
+    for prev, node in dialog_graph.edges:
+        if rnd.random() < 0.2:
+            dialog_graph.edges[prev, node]["line"] = None
+    return dialog_graph
+
+
+def test_dependencies_of_diamond():
+    dialog_graph = make_graph([("root", "a"), ("root", "b"), ("a", "c"), ("b", "c")])
+    order = get_bfs_order(dialog_graph)
+    assert order == ["root", "a", "b", "c"]
+    assert get_content_dependencies(dialog_graph, order) == {
+        "root": set(), "a": {"root"}, "b": {"root"}, "c": {"root", "a", "b"}
+    }
+
+
+def test_node_waits_for_child_earlier_in_order():
+    # a стоит в обходе раньше b, но b - её предок: b заполняет ребро b->a только после того, как a прочитала цепочки
+    dialog_graph = make_graph([("root", "a"), ("root", "b"), ("b", "a")])
+    order = get_bfs_order(dialog_graph)
+    assert order == ["root", "a", "b"]
+    dependencies = get_content_dependencies(dialog_graph, order)
+    assert dependencies["a"] == {"root"}
+    assert dependencies["b"] == {"root", "a"}
+
+
+def test_cyclic_graph_is_sequential():
+    dialog_graph = make_graph([("root", "a"), ("root", "b"), ("a", "c"), ("c", "a")])
+    order = get_bfs_order(dialog_graph)
+    assert get_content_dependencies(dialog_graph, order) == {
+        order[0]: set(), order[1]: {order[0]}, order[2]: {order[1]}, order[3]: {order[2]}
+    }
+
+
+def test_dependencies_only_point_backwards():
+    rnd = random.Random(1)
+    for _ in range(50):
+        dialog_graph = make_random_dag(rnd, rnd.randrange(2, 15))
+        order = get_bfs_order(dialog_graph)
+        position = {node: ind for ind, node in enumerate(order)}
+        for node, dependencies in get_content_dependencies(dialog_graph, order).items():
+            assert all(position[prev] < position[node] for prev in dependencies)
+            assert {prev for prev in nx.ancestors(dialog_graph, node)} <= dependencies | {
+                prev for prev in order if position[prev] > position[node]
+            }
+
+
+def test_chain_index_matches_simple_paths():
+    rnd = random.Random(3)
+    for _ in range(50):
+        dialog_graph = make_random_dag(rnd, rnd.randrange(2, 12))
+        chain_index = DialogChainIndex(dialog_graph)
+        for node in get_bfs_order(dialog_graph):
+            assert chain_index.get_chains(node) == get_prev_dialog_chains(dialog_graph, node)
+
+
+def test_chain_index_sees_updated_lines():
+    dialog_graph = make_graph([("root", "a"), ("a", "b"), ("root", "b")])
+    chain_index = DialogChainIndex(dialog_graph)
+    assert chain_index.get_chains("b") == get_prev_dialog_chains(dialog_graph, "b")
+    dialog_graph.nodes["a"]["line"] = "npc a, regenerated"
+    dialog_graph.edges["root", "a"]["line"] = "root->a, regenerated"
+    assert chain_index.get_chains("b") == get_prev_dialog_chains(dialog_graph, "b")
+    assert "regenerated" in chain_index.get_chains("b")[0]
+
+
+def test_chain_index_on_cyclic_graph():
+    dialog_graph = make_graph([("root", "a"), ("a", "b"), ("b", "a"), ("b", "c")])
+    chain_index = DialogChainIndex(dialog_graph)
+    for node in dialog_graph.nodes:
+        assert chain_index.get_chains(node) == get_prev_dialog_chains(dialog_graph, node)
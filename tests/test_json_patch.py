@@ -0,0 +1,135 @@
+import uuid
+
+import pytest
+
+from db.json_patch import MAX_OPERATIONS, JsonPatchError, parse_json_patch, parse_merge_patch, parse_pointer, touches_games
+from db.users_db import Users
+
+DOCUMENT = {"arr": [1, 2, 3], "o": {"a": 1}}
+
+
+def test_pointer_escapes():
+    assert parse_pointer("") == []
+    assert parse_pointer("/a~1b/c~0d/0") == ["a/b", "c~d", "0"]
+    with pytest.raises(JsonPatchError):
+        parse_pointer("a/b")
+
+
+def test_json_patch_steps():
+    steps = parse_json_patch([
+        {"op": "add", "path": "/settings/theme", "value": "dark"},
+        {"op": "remove", "path": "/games/0"},
+        {"op": "move", "from": "/games/1", "path": "/games/0"},
+        {"op": "test", "path": "/name", "value": None},
+    ])
+    assert steps == [
+        {"op": "add", "path": ["settings", "theme"], "value": "dark"},
+        {"op": "remove", "path": ["games", "0"]},
+        {"op": "move", "path": ["games", "0"], "from": ["games", "1"]},
+        {"op": "test", "path": ["name"], "value": None},
+    ]
+    assert touches_games(steps)
+    assert not touches_games(steps[:1])
+
+
+@pytest.mark.parametrize("operations", [
+    {"op": "add", "path": "/a", "value": 1},
+    [{"op": "increment", "path": "/a"}],
+    [{"op": "add", "path": "/a"}],
+    [{"op": "add", "value": 1}],
+    [{"op": "copy", "path": "/a"}],
+    [{"op": "remove", "path": ""}],
+    [{"op": "move", "from": "/a", "path": "/a/b"}],
+    [{"op": "replace", "path": "/a", "value": 1}] * (MAX_OPERATIONS + 1),
+])
+def test_invalid_json_patch(operations):
+    with pytest.raises(JsonPatchError) as error:
+        parse_json_patch(operations)
+    assert error.value.status_code == 400
+
+
+@pytest.mark.parametrize("operation", [
+    {"op": "replace", "path": "/games/0/scenes/1/scripts/2/result", "value": {}},
+    {"op": "remove", "path": "/games/0/scenes/1/scripts/2/result/data"},
+    {"op": "move", "from": "/games/0/scenes/1/scripts/2/result", "path": "/tmp"},
+])
+def test_json_patch_cannot_touch_result(operation):
+    with pytest.raises(JsonPatchError) as error:
+        parse_json_patch([operation])
+    assert error.value.status_code == 422
+
+
+def test_json_patch_can_copy_result_and_replace_script():
+    parse_json_patch([
+        {"op": "copy", "from": "/games/0/scenes/1/scripts/2/result", "path": "/backup"},
+        {"op": "replace", "path": "/games/0/scenes/1/scripts/2", "value": {"id": "d"}},
+    ])
+
+
+def test_merge_patch_steps():
+    assert parse_merge_patch({"settings": {"theme": "dark", "lang": None}, "name": "A"}) == [
+        {"op": "merge_object", "path": []},
+        {"op": "merge_object", "path": ["settings"]},
+        {"op": "merge_set", "path": ["settings", "theme"], "value": "dark"},
+        {"op": "merge_remove", "path": ["settings", "lang"]},
+        {"op": "merge_set", "path": ["name"], "value": "A"},
+    ]
+
+
+def test_merge_patch_replaces_arrays_whole():
+    assert parse_merge_patch({"tags": [1, {"a": None}]})[-1] == {"op": "merge_set", "path": ["tags"], "value": [1, {"a": None}]}
+
+
+def test_invalid_merge_patch():
+    with pytest.raises(JsonPatchError) as error:
+        parse_merge_patch([1])
+    assert error.value.status_code == 400
+    with pytest.raises(JsonPatchError) as error:
+        parse_merge_patch({"games": []})
+    assert error.value.status_code == 422
+    with pytest.raises(JsonPatchError):
+        parse_merge_patch({f"k{ind}": ind for ind in range(MAX_OPERATIONS)})
+
+
+@pytest.fixture
+def patch_user(db_conn):
+    users = Users(db_conn)
+    user_id = users.create_user(f"patch-{uuid.uuid4().hex}@example.com", "Patch", "Test", "hash", data=DOCUMENT)
+    yield users, user_id
+    with db_conn.cursor() as curs:
+        curs.execute("DELETE FROM users_data WHERE id = %s;", (user_id,))
+    db_conn.commit()
+
+
+@pytest.mark.parametrize("operations, expected", [
+    ([{"op": "add", "path": "/arr/1", "value": 9}], {**DOCUMENT, "arr": [1, 9, 2, 3]}),
+    ([{"op": "add", "path": "/arr/-", "value": 9}], {**DOCUMENT, "arr": [1, 2, 3, 9]}),
+    ([{"op": "remove", "path": "/arr/0"}, {"op": "replace", "path": "/o/a", "value": 2}], {**DOCUMENT, "arr": [2, 3], "o": {"a": 2}}),
+    ([{"op": "move", "from": "/o/a", "path": "/arr/0"}], {**DOCUMENT, "arr": [1, 1, 2, 3], "o": {}}),
+    ([{"op": "copy", "from": "/arr", "path": "/o/b"}, {"op": "test", "path": "/o/b/2", "value": 3}], {**DOCUMENT, "o": {"a": 1, "b": [1, 2, 3]}}),
+    ([{"op": "add", "path": "/o/01", "value": 2}, {"op": "remove", "path": "/o/01"}], DOCUMENT),
+])
+def test_apply_json_patch(patch_user, operations, expected):
+    users, user_id = patch_user
+    result = users.patch_user_data(user_id, parse_json_patch(operations))
+    assert result["failed"] is None and result["updated"]
+    assert users.get_user_data(user_id) == {**expected, "games": []}
+
+
+@pytest.mark.parametrize("operations, failed", [
+    ([{"op": "remove", "path": "/arr/x"}], 0),
+    ([{"op": "remove", "path": "/arr/01"}], 0),
+    ([{"op": "replace", "path": "/arr/-1", "value": 1}], 0),
+    ([{"op": "test", "path": "/arr/ 1", "value": 2}], 0),
+    ([{"op": "copy", "from": "/arr/+1", "path": "/o/b"}], 0),
+    ([{"op": "move", "from": "/arr/-", "path": "/o/b"}], 0),
+    ([{"op": "replace", "path": "/missing", "value": 1}], 0),
+    ([{"op": "add", "path": "/arr/4", "value": 1}], 0),
+    ([{"op": "remove", "path": "/arr/0"}, {"op": "test", "path": "/arr/0", "value": 1}], 1),
+])
+def test_failed_json_patch_keeps_document(patch_user, operations, failed):
+    # невыполнимая операция не должна ни ронять запрос, ни частично менять документ (ответ 409)
+    users, user_id = patch_user
+    result = users.patch_user_data(user_id, parse_json_patch(operations))
+    assert result["failed"] == failed and not result["updated"]
+    assert users.get_user_data(user_id) == {**DOCUMENT, "games": []}
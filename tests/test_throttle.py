@@ -0,0 +1,86 @@
+import asyncio
+import random
+
+import pytest
+
+import lib.auth.throttle as throttle
+from lib.auth.throttle import MemoryThrottleBackend, Throttle, Throttled
+
+WINDOW = 60
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [WINDOW * 1000.0]
+    monkeypatch.setenv("THROTTLE_WINDOW", str(WINDOW))
+    monkeypatch.setenv("LOGIN_ACCOUNT_LIMIT", "3")
+    monkeypatch.setattr(throttle.time, "time", lambda: now[0])
+    Throttle.init_throttle(MemoryThrottleBackend())
+    yield now
+    Throttle._backend = None
+
+
+def attempt(mail="user@example.com"):
+    try:
+        asyncio.run(Throttle.check("login", account=mail))
+        return None
+    except Throttled as e:
+        return e.retry_after
+
+
+def test_limit_within_window(clock):
+    assert [attempt() for _ in range(3)] == [None, None, None]
+    assert attempt() is not None
+    # у другого аккаунта свой счёт, регистр и пробелы в почте счёт не обходят
+    assert attempt("other@example.com") is None
+    assert attempt(" USER@example.com") is not None
+
+
+def test_previous_window_is_weighted(clock):
+    for _ in range(3):
+        attempt()
+    # середина следующего окна: 3 прошлые попытки весят 1.5
+    clock[0] += WINDOW * 1.5
+    assert attempt() is None
+    assert attempt() is not None
+
+
+def test_reset(clock):
+    for _ in range(3):
+        attempt()
+    asyncio.run(Throttle.reset("login", "account", "user@example.com"))
+    assert attempt() is None
+
+
+def test_retry_after_formula():
+    Throttle.window = WINDOW
+    # начало окна, 4 попытки при лимите 3: следующая уложится, когда вес прошлого окна упадёт до 1/2
+    assert Throttle.get_retry_after(0, 4, 3, WINDOW * 10) == 90
+    # начало окна, 4 прошлые попытки: следующая уложится, когда 4 * вес + 1 <= 3
+    assert Throttle.get_retry_after(4, 0, 3, WINDOW * 10) == 30
+
+
+def test_retry_after_is_enough(clock):
+    # после ожидания Retry-After попытка проходит, а Retry-After не больше двух окон
+    rnd = random.Random(5)
+    for case in range(200):
+        mail = f"user{case}@example.com"
+        clock[0] = WINDOW * (1000 + 3 * case) + rnd.uniform(0, WINDOW)
+        for _ in range(rnd.randrange(0, 4)):
+            attempt(mail)
+        clock[0] += rnd.uniform(0, WINDOW)
+        retry_after = None
+        while retry_after is None:
+            retry_after = attempt(mail)
+        assert 1 <= retry_after <= 2 * WINDOW
+        clock[0] += retry_after
+        assert attempt(mail) is None
+
+
+def test_backend_error_lets_attempt_through(clock):
+    class BrokenBackend:
+        async def hit(self, key, window_index):
+            raise ConnectionError("database is down")
+
+    Throttle.init_throttle(BrokenBackend())
+    assert all(attempt() is None for _ in range(10))
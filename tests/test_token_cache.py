@@ -0,0 +1,86 @@
+import pytest
+
+import lib.auth.token_cache as token_cache
+from lib.auth.token_cache import TokenCache
+
+
+@pytest.fixture
+def tokens(monkeypatch):
+    # decode_token подменяется: кэш проверяется отдельно от подписи. valid - токены, которые ещё проходят проверку
+    now = [1000.0]
+    valid = {"a": {"id": 1, "exp": 1060}, "b": {"id": 2, "exp": 2000}, "c": {"id": 3, "exp": 2000}}
+    decoded = []
+
+    def decode_token(token):
+        decoded.append(token)
+        if token not in valid:
+            raise ValueError("Invalid token")
+        return dict(valid[token])
+
+    monkeypatch.setenv("TOKEN_CACHE_SIZE", "2")
+    monkeypatch.setattr(token_cache, "decode_token", decode_token)
+    monkeypatch.setattr(token_cache.time, "time", lambda: now[0])
+    TokenCache.init_cache()
+    yield now, valid, decoded
+    TokenCache._items = None
+
+
+def test_repeated_token_is_verified_once(tokens):
+    now, valid, decoded = tokens
+    assert TokenCache.decode("a") == {"id": 1, "exp": 1060}
+    claims = TokenCache.decode("a")
+    claims["id"] = 99
+    assert TokenCache.decode("a")["id"] == 1
+    assert decoded == ["a"]
+    assert TokenCache.get_stats()["hits"] == 2
+
+
+def test_entry_expires_with_token(tokens):
+    now, valid, decoded = tokens
+    TokenCache.decode("a")
+    now[0] = 1060
+    # подпись уже не примет просроченный токен - кэш тоже не должен
+    del valid["a"]
+    with pytest.raises(ValueError):
+        TokenCache.decode("a")
+    assert TokenCache.get_stats()["expired"] == 1
+
+
+def test_invalid_token_is_not_cached(tokens):
+    now, valid, decoded = tokens
+    for _ in range(2):
+        with pytest.raises(ValueError):
+            TokenCache.decode("forged")
+    assert decoded == ["forged", "forged"]
+    assert TokenCache.get_stats()["items"] == 0
+
+
+def test_least_recently_used_is_evicted(tokens):
+    now, valid, decoded = tokens
+    TokenCache.decode("a")
+    TokenCache.decode("b")
+    TokenCache.decode("a")
+    TokenCache.decode("c")
+    assert TokenCache.get_stats()["evicted"] == 1
+    TokenCache.decode("a")
+    TokenCache.decode("b")
+    assert decoded == ["a", "b", "c", "b"]
+
+
+def test_clear_revokes_cached_tokens(tokens):
+    # после clear (например, ключ подписи убран из доверенных) токен снова идёт на проверку и отклоняется
+    now, valid, decoded = tokens
+    TokenCache.decode("b")
+    del valid["b"]
+    TokenCache.clear()
+    with pytest.raises(ValueError):
+        TokenCache.decode("b")
+
+
+def test_disabled_cache(tokens, monkeypatch):
+    now, valid, decoded = tokens
+    monkeypatch.setenv("TOKEN_CACHE_SIZE", "0")
+    TokenCache.init_cache()
+    TokenCache.decode("b")
+    TokenCache.decode("b")
+    assert decoded == ["b", "b"]